@@ -0,0 +1,136 @@
+"""
+A two tier cache backend.
+
+The local tier is a small, short lived, per process in-memory cache that
+sits in front of a shared tier (any cache configured in settings.CACHES,
+e.g. memcached) so that hot keys (read on every page render) don't require
+a round trip to the shared cache.
+
+Example configuration:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'qatrack.cache.backends.TieredCache',
+            'TIMEOUT': 24*60*60,
+            'OPTIONS': {
+                'SHARED': 'shared',  # alias of the shared tier in CACHES
+                'LOCAL_TIMEOUT': 5,  # seconds a value may be served from the local tier
+            },
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+        },
+    }
+
+Writes and deletes go to both tiers, but deletes can only be seen by the
+local tier of the process that made them. Other processes may serve a stale
+value for up to LOCAL_TIMEOUT seconds, so keep it short (or use keys
+versioned by generation counters, see qatrack.cache.versioning).
+"""
+
+from django.core.cache import get_cache
+from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+#============================================================================
+class TieredCache(BaseCache):
+    """local in-memory cache in front of a shared cache"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, location, params):
+        super(TieredCache, self).__init__(params)
+
+        options = params.get("OPTIONS", {})
+        self.shared_alias = options.get("SHARED", "shared")
+        self.local_timeout = int(options.get("LOCAL_TIMEOUT", 5))
+
+        self.local = LocMemCache(location or "qatrack-tiered", {
+            "TIMEOUT": self.local_timeout,
+            "MAX_ENTRIES": options.get("LOCAL_MAX_ENTRIES", 1000),
+        })
+        self._shared = None
+
+    #----------------------------------------------------------------------
+    @property
+    def shared(self):
+        if self._shared is None:
+            self._shared = get_cache(self.shared_alias)
+        return self._shared
+
+    #----------------------------------------------------------------------
+    def _local_timeout(self, timeout):
+        timeout = self.default_timeout if timeout is None else timeout
+        return min(timeout, self.local_timeout)
+
+    #----------------------------------------------------------------------
+    def add(self, key, value, timeout=None, version=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self.local.set(key, value, self._local_timeout(timeout), version=version)
+        return added
+
+    #----------------------------------------------------------------------
+    def get(self, key, default=None, version=None):
+        sentinel = object()
+        value = self.local.get(key, sentinel, version=version)
+        if value is sentinel:
+            value = self.shared.get(key, sentinel, version=version)
+            if value is sentinel:
+                return default
+            self.local.set(key, value, self.local_timeout, version=version)
+        return value
+
+    #----------------------------------------------------------------------
+    def get_many(self, keys, version=None):
+        found = self.local.get_many(keys, version=version)
+        missing = [k for k in keys if k not in found]
+        if missing:
+            from_shared = self.shared.get_many(missing, version=version)
+            self.local.set_many(from_shared, self.local_timeout, version=version)
+            found.update(from_shared)
+        return found
+
+    #----------------------------------------------------------------------
+    def set(self, key, value, timeout=None, version=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        self.shared.set(key, value, timeout, version=version)
+        self.local.set(key, value, self._local_timeout(timeout), version=version)
+
+    #----------------------------------------------------------------------
+    def set_many(self, data, timeout=None, version=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        self.shared.set_many(data, timeout, version=version)
+        self.local.set_many(data, self._local_timeout(timeout), version=version)
+
+    #----------------------------------------------------------------------
+    def delete(self, key, version=None):
+        self.local.delete(key, version=version)
+        self.shared.delete(key, version=version)
+
+    #----------------------------------------------------------------------
+    def delete_many(self, keys, version=None):
+        self.local.delete_many(keys, version=version)
+        self.shared.delete_many(keys, version=version)
+
+    #----------------------------------------------------------------------
+    def has_key(self, key, version=None):
+        return self.local.has_key(key, version=version) or self.shared.has_key(key, version=version)
+
+    #----------------------------------------------------------------------
+    def incr(self, key, delta=1, version=None):
+        """counters live in the shared tier only so all processes agree on them"""
+        self.local.delete(key, version=version)
+        return self.shared.incr(key, delta, version=version)
+
+    #----------------------------------------------------------------------
+    def decr(self, key, delta=1, version=None):
+        self.local.delete(key, version=version)
+        return self.shared.decr(key, delta, version=version)
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
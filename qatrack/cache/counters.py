@@ -0,0 +1,85 @@
+"""
+Counters kept in the cache and maintained by deltas.
+
+A CachedCounter holds a total plus any number of breakdowns (e.g. by unit or
+by group).  Callers adjust the counter when the state being counted changes
+rather than invalidating it, so a count query is only required when a
+value is not in the cache (first use, eviction, or after reset()).
+
+Increments go through cache.incr which is atomic on memcached. A value that
+is missing from the cache is not incremented; it will be counted afresh the
+next time it is read. Counters expire after their timeout (24h by default)
+so any drift caused by races between counting and incrementing is bounded.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+from qatrack.cache.versioning import bump, versioned_key
+
+
+#============================================================================
+class CachedCounter(object):
+
+    #----------------------------------------------------------------------
+    def __init__(self, name, count, timeout=None):
+        """name is used for the cache keys and count is a callable that
+        takes keyword arguments of the form dimension=value (or no arguments
+        for the total) and returns the count from the database."""
+
+        self.name = name
+        self.count = count
+        self.timeout = timeout or getattr(settings, "MAX_CACHE_TIMEOUT", 24 * 60 * 60)
+
+    #----------------------------------------------------------------------
+    def key(self, dimension=None, value=None):
+        key = self.name if dimension is None else "%s:%s:%s" % (self.name, dimension, value)
+        return versioned_key(key, self.name)
+
+    #----------------------------------------------------------------------
+    def get(self, dimension=None, value=None):
+        """return total (or breakdown for dimension=value) count"""
+
+        key = self.key(dimension, value)
+        count = cache.get(key)
+        if count is None:
+            count = self.count() if dimension is None else self.count(**{dimension: value})
+            cache.add(key, count, self.timeout)
+        return count
+
+    #----------------------------------------------------------------------
+    def get_many(self, dimension, values):
+        """return dict of form {value: count} for breakdown by dimension"""
+
+        keys = dict((self.key(dimension, v), v) for v in values)
+        cached = cache.get_many(keys.keys())
+
+        counts = {}
+        for key, value in keys.items():
+            if key in cached:
+                counts[value] = cached[key]
+            else:
+                counts[value] = self.get(dimension, value)
+        return counts
+
+    #----------------------------------------------------------------------
+    def adjust(self, delta, **dimensions):
+        """adjust total and breakdowns for input dimensions by delta"""
+
+        if not delta:
+            return
+
+        keys = [self.key()]
+        keys.extend(self.key(dimension, value) for dimension, value in dimensions.items() if value is not None)
+
+        for key in keys:
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                # not cached. will be counted next time it is requested
+                pass
+
+    #----------------------------------------------------------------------
+    def reset(self):
+        """discard all cached counts"""
+        bump(self.name)
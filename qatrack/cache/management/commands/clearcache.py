@@ -1,8 +1,13 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.core.cache import cache
+from django.core.cache import get_cache
 
 
 class Command(BaseCommand):
     def handle(self, *args, **kwargs):
-        cache.clear()
+        # clear every configured cache so all tiers of a tiered cache are cleared.
+        # Note local tiers of other running processes expire on their own
+        # within their LOCAL_TIMEOUT.
+        for alias in settings.CACHES:
+            get_cache(alias).clear()
         self.stdout.write('Cleared cache\n')
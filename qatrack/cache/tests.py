@@ -0,0 +1,107 @@
+from django.core.cache import get_cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from qatrack.cache import versioning
+from qatrack.qa.models import Frequency
+
+import mock
+
+
+SHARED_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "test-default",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "test-shared",
+    },
+}
+
+
+#============================================================================
+@override_settings(CACHES=SHARED_CACHES)
+class TestTieredCache(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.cache = get_cache("qatrack.cache.backends.TieredCache", LOCATION="test-local", OPTIONS={"SHARED": "shared", "LOCAL_TIMEOUT": 5})
+        self.cache.clear()
+
+    #----------------------------------------------------------------------
+    def test_set_writes_both_tiers(self):
+        self.cache.set("key", "value")
+        self.assertEqual(self.cache.local.get("key"), "value")
+        self.assertEqual(self.cache.shared.get("key"), "value")
+
+    #----------------------------------------------------------------------
+    def test_local_hit_skips_shared(self):
+        self.cache.set("key", "value")
+        with mock.patch.object(self.cache.shared, "get") as shared_get:
+            self.assertEqual(self.cache.get("key"), "value")
+        self.assertFalse(shared_get.called)
+
+    #----------------------------------------------------------------------
+    def test_shared_hit_populates_local(self):
+        self.cache.shared.set("key", "value")
+        self.assertIsNone(self.cache.local.get("key"))
+        self.assertEqual(self.cache.get("key"), "value")
+        self.assertEqual(self.cache.local.get("key"), "value")
+
+    #----------------------------------------------------------------------
+    def test_get_many(self):
+        self.cache.set("a", 1)
+        self.cache.shared.set("b", 2)
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+
+    #----------------------------------------------------------------------
+    def test_delete(self):
+        self.cache.set("key", "value")
+        self.cache.delete("key")
+        self.assertIsNone(self.cache.get("key"))
+        self.assertIsNone(self.cache.shared.get("key"))
+
+    #----------------------------------------------------------------------
+    def test_incr_uses_shared(self):
+        self.cache.set("counter", 1)
+        self.cache.shared.incr("counter")  # e.g. another process
+        self.assertEqual(self.cache.incr("counter"), 3)
+        self.assertEqual(self.cache.get("counter"), 3)
+
+    #----------------------------------------------------------------------
+    def test_clear(self):
+        self.cache.set("key", "value")
+        self.cache.clear()
+        self.assertIsNone(self.cache.local.get("key"))
+        self.assertIsNone(self.cache.shared.get("key"))
+
+
+#============================================================================
+class TestVersioning(TestCase):
+
+    #----------------------------------------------------------------------
+    def test_generation_name(self):
+        self.assertEqual(versioning.generation_name(Frequency), "qa.frequency")
+        self.assertEqual(versioning.generation_name("foo"), "foo")
+
+    #----------------------------------------------------------------------
+    def test_bump_changes_key(self):
+        key = versioning.versioned_key("foo", Frequency)
+        self.assertEqual(key, versioning.versioned_key("foo", Frequency))
+        versioning.bump(Frequency)
+        self.assertNotEqual(key, versioning.versioned_key("foo", Frequency))
+
+    #----------------------------------------------------------------------
+    def test_bump_missing_generation(self):
+        versioning.cache.delete(versioning.generation_key("missing"))
+        versioning.bump("missing")
+        self.assertIsNotNone(versioning.get_generation("missing"))
+
+    #----------------------------------------------------------------------
+    def test_frequency_saved_invalidates(self):
+        import qatrack.context_processors  # NOQA registers invalidation receivers
+        from qatrack.qa.tests import utils
+        key = versioning.versioned_key("foo", Frequency)
+        utils.create_frequency()
+        self.assertNotEqual(key, versioning.versioned_key("foo", Frequency))
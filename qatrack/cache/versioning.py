@@ -0,0 +1,74 @@
+"""
+Generation counters for cache invalidation.
+
+Rather than tracking down and deleting every key derived from a model when
+one of its instances changes, keys are built to include the current
+generation of the models they depend on:
+
+    key = versioned_key(settings.CACHE_UNREVIEWED_COUNT, TestListInstance)
+
+and invalidation is a single increment of the model's generation:
+
+    bump(TestListInstance)
+
+Old entries are never read again and simply expire.
+"""
+
+import time
+
+from django.core.cache import cache
+
+
+#----------------------------------------------------------------------
+def generation_name(model_or_name):
+    """return generation name for a model class/instance or string"""
+
+    if isinstance(model_or_name, basestring):
+        return model_or_name
+    opts = model_or_name._meta
+    return "%s.%s" % (opts.app_label, opts.object_name.lower())
+
+
+#----------------------------------------------------------------------
+def generation_key(model_or_name):
+    return "generation:%s" % generation_name(model_or_name)
+
+
+#----------------------------------------------------------------------
+def initial_generation():
+    """Generations start from the current time (in ms) so that a counter
+    which has been evicted from the cache never restarts at a value
+    that was previously used."""
+    return int(time.time() * 1000)
+
+
+#----------------------------------------------------------------------
+def get_generation(model_or_name):
+    key = generation_key(model_or_name)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, initial_generation())
+        generation = cache.get(key)
+    return generation
+
+
+#----------------------------------------------------------------------
+def bump(*models_or_names):
+    """invalidate all keys versioned by the input models"""
+
+    for model_or_name in models_or_names:
+        key = generation_key(model_or_name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # counter doesn't exist (yet or any more)
+            cache.set(key, initial_generation())
+
+
+#----------------------------------------------------------------------
+def versioned_key(key, *models_or_names):
+    """return key versioned by the current generation of the input models"""
+
+    generations = [str(get_generation(m)) for m in models_or_names]
+    return ":".join([key] + generations)
+
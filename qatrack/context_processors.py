@@ -4,35 +4,28 @@ from django.conf import settings
 from django.contrib.sites.models import Site
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from qatrack.qa.models import Frequency, TestListInstance
-
-
-@receiver(post_save, sender=TestListInstance)
-@receiver(post_delete, sender=TestListInstance)
-def update_unreviewed_cache(*args, **kwargs):
-    """When a test list is completed invalidate the unreviewed count"""
-    cache.delete(settings.CACHE_UNREVIEWED_COUNT)
+from qatrack.cache.versioning import bump, versioned_key
+from qatrack.qa.models import Frequency, unreviewed_counter
 
 
 @receiver(post_save, sender=Frequency)
 @receiver(post_delete, sender=Frequency)
 def update_qa_freq_cache(*args, **kwargs):
-    """When a test list is completed invalidate the unreviewed count"""
-    cache.delete(settings.CACHE_QA_FREQUENCIES)
+    """When a frequency is changed invalidate the frequency choices"""
+    bump(Frequency)
 
 
 def site(request):
     site = Site.objects.get_current()
 
-    unreviewed = cache.get(settings.CACHE_UNREVIEWED_COUNT)
-    if unreviewed is None:
-        unreviewed = TestListInstance.objects.unreviewed_count()
-        cache.set(settings.CACHE_UNREVIEWED_COUNT, unreviewed)
+    # maintained incrementally as test lists are performed & reviewed
+    unreviewed = unreviewed_counter.get()
 
-    qa_frequencies = cache.get(settings.CACHE_QA_FREQUENCIES)
+    freq_key = versioned_key(settings.CACHE_QA_FREQUENCIES, Frequency)
+    qa_frequencies = cache.get(freq_key)
     if qa_frequencies is None:
         qa_frequencies = list(Frequency.objects.frequency_choices())
-        cache.set(settings.CACHE_QA_FREQUENCIES, qa_frequencies)
+        cache.set(freq_key, qa_frequencies)
 
     return {
         'SITE_NAME': site.name,
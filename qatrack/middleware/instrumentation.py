@@ -0,0 +1,276 @@
+"""
+Lightweight, always on request instrumentation.
+
+InstrumentationMiddleware records the wall time, number of SQL queries and
+total SQL time for every request that reaches a view, and the time taken by
+each individual query.  Samples are kept in fixed size in-process ring
+buffers (so memory use is bounded and old samples simply fall off the end)
+and aggregated on demand into per view percentiles and per query fingerprint
+totals.  The aggregates are available as JSON to staff users at
+/instrumentation/ (see `summary_view`).
+
+Optionally every view sample can also be sent to a statsd server over UDP:
+
+    INSTRUMENTATION_STATSD_HOST = "127.0.0.1"
+    INSTRUMENTATION_STATSD_PORT = 8125
+    INSTRUMENTATION_STATSD_PREFIX = "qatrack"
+
+Since each process has its own buffers, the JSON summary only reflects
+requests handled by the process that serves it.
+"""
+
+import collections
+import json
+import math
+import re
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.http import HttpResponse
+
+from qatrack.qa.utils import fingerprint
+
+
+ViewSample = collections.namedtuple("ViewSample", "view method status time queries sql_time")
+QuerySample = collections.namedtuple("QuerySample", "view sql time")
+
+#----------------------------------------------------------------------
+def percentile(ordered, pct):
+    """return the pct'th percentile (nearest rank) of an ordered list"""
+
+    if not ordered:
+        return None
+    rank = int(math.ceil(pct / 100. * len(ordered)))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+#----------------------------------------------------------------------
+def view_name(view_func):
+    """return dotted name for a view function or class based view"""
+
+    name = getattr(view_func, "__name__", view_func.__class__.__name__)
+    return "%s.%s" % (view_func.__module__, name)
+
+
+#============================================================================
+class Recorder(object):
+    """thread safe ring buffers of view and query samples"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, size=1000, query_size=5000):
+        self.lock = threading.Lock()
+        self.views = collections.deque(maxlen=size)
+        self.queries = collections.deque(maxlen=query_size)
+
+    #----------------------------------------------------------------------
+    def record(self, sample, queries=()):
+        with self.lock:
+            self.views.append(sample)
+            self.queries.extend(queries)
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+            self.queries.clear()
+
+    #----------------------------------------------------------------------
+    def view_stats(self):
+        """return list of per view aggregates ordered by 95th percentile time (slowest first)"""
+
+        with self.lock:
+            samples = list(self.views)
+
+        by_view = collections.defaultdict(list)
+        for sample in samples:
+            by_view[sample.view].append(sample)
+
+        stats = []
+        for view, view_samples in by_view.items():
+            times = sorted(s.time for s in view_samples)
+            n = float(len(view_samples))
+            stats.append({
+                "view": view,
+                "count": len(view_samples),
+                "mean": sum(times) / n,
+                "p50": percentile(times, 50),
+                "p95": percentile(times, 95),
+                "p99": percentile(times, 99),
+                "max": times[-1],
+                "queries": sum(s.queries for s in view_samples) / n,
+                "max_queries": max(s.queries for s in view_samples),
+                "sql_time": sum(s.sql_time for s in view_samples) / n,
+            })
+
+        return sorted(stats, key=lambda s: s["p95"], reverse=True)
+
+    #----------------------------------------------------------------------
+    def query_stats(self):
+        """return list of per query fingerprint aggregates ordered by total time"""
+
+        with self.lock:
+            samples = list(self.queries)
+
+        by_fingerprint = {}
+        for sample in samples:
+            fp = fingerprint(sample.sql)
+            stats = by_fingerprint.get(fp)
+            if stats is None:
+                stats = by_fingerprint[fp] = {
+                    "fingerprint": fp, "example": sample.sql,
+                    "count": 0, "total_time": 0., "max": 0., "views": set(),
+                }
+            stats["count"] += 1
+            stats["total_time"] += sample.time
+            stats["max"] = max(stats["max"], sample.time)
+            stats["views"].add(sample.view)
+
+        for stats in by_fingerprint.values():
+            stats["mean"] = stats["total_time"] / stats["count"]
+            stats["views"] = sorted(stats["views"])
+
+        return sorted(by_fingerprint.values(), key=lambda s: s["total_time"], reverse=True)
+
+    #----------------------------------------------------------------------
+    def summary(self, limit=20):
+        """return the slowest views and queries (all times in ms)"""
+
+        with self.lock:
+            samples = len(self.views)
+
+        return {
+            "samples": samples,
+            "views": self.view_stats()[:limit],
+            "queries": self.query_stats()[:limit],
+        }
+
+
+#============================================================================
+class StatsdExporter(object):
+    """send view samples to a statsd server as timers"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, host, port=8125, prefix="qatrack"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    #----------------------------------------------------------------------
+    def metric_name(self, view):
+        return "%s.views.%s" % (self.prefix, re.sub(r"[^\w.-]", "_", view))
+
+    #----------------------------------------------------------------------
+    def send(self, sample):
+        name = self.metric_name(sample.view)
+        packet = "\n".join([
+            "%s.time:%d|ms" % (name, sample.time),
+            "%s.queries:%d|h" % (name, sample.queries),
+            "%s.sql_time:%d|ms" % (name, sample.sql_time),
+        ])
+        try:
+            self.socket.sendto(packet, self.address)
+        except socket.error:
+            # metrics are best effort only
+            pass
+
+
+#----------------------------------------------------------------------
+def get_exporter():
+    host = getattr(settings, "INSTRUMENTATION_STATSD_HOST", None)
+    if not host:
+        return None
+    return StatsdExporter(
+        host,
+        getattr(settings, "INSTRUMENTATION_STATSD_PORT", 8125),
+        getattr(settings, "INSTRUMENTATION_STATSD_PREFIX", "qatrack"),
+    )
+
+
+recorder = Recorder(
+    getattr(settings, "INSTRUMENTATION_BUFFER_SIZE", 1000),
+    getattr(settings, "INSTRUMENTATION_QUERY_BUFFER_SIZE", 5000),
+)
+
+
+#============================================================================
+class InstrumentationMiddleware(object):
+    """
+    Record wall time and SQL statistics for every view.  Should be the
+    first entry in MIDDLEWARE_CLASSES so the time spent in all other
+    middleware is included.
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        self.recorder = recorder
+        self.exporter = get_exporter()
+
+    #----------------------------------------------------------------------
+    def process_request(self, request):
+
+        # force query logging (which is otherwise only done when DEBUG=True)
+        # for the duration of the request
+        state = {}
+        for connection in connections.all():
+            state[connection.alias] = (len(connection.queries), connection.use_debug_cursor)
+            connection.use_debug_cursor = True
+
+        request._instrumentation = {"start": time.time(), "connections": state, "view": None}
+
+    #----------------------------------------------------------------------
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        instrumentation = getattr(request, "_instrumentation", None)
+        if instrumentation is not None:
+            instrumentation["view"] = view_name(view_func)
+
+    #----------------------------------------------------------------------
+    def process_response(self, request, response):
+
+        instrumentation = getattr(request, "_instrumentation", None)
+        if instrumentation is None:
+            return response
+
+        elapsed = 1000. * (time.time() - instrumentation["start"])
+        view = instrumentation["view"]
+
+        queries = []
+        for connection in connections.all():
+            start, use_debug_cursor = instrumentation["connections"].get(connection.alias, (0, None))
+            queries.extend(connection.queries[start:])
+            connection.use_debug_cursor = use_debug_cursor
+            if not (settings.DEBUG or use_debug_cursor):
+                # query logging was only enabled for this request
+                del connection.queries[start:]
+
+        if view is None:
+            # request was handled by middleware (e.g. login redirect)
+            return response
+
+        query_samples = [QuerySample(view, q["sql"], 1000. * float(q["time"])) for q in queries]
+        sample = ViewSample(
+            view, request.method, response.status_code, elapsed,
+            len(query_samples), sum(q.time for q in query_samples),
+        )
+
+        self.recorder.record(sample, query_samples)
+        if self.exporter is not None:
+            self.exporter.send(sample)
+
+        return response
+
+
+#----------------------------------------------------------------------
+@staff_member_required
+def summary_view(request):
+    """JSON summary of the slowest views and queries recorded by this process"""
+
+    try:
+        limit = int(request.GET.get("limit", 20))
+    except ValueError:
+        limit = 20
+
+    return HttpResponse(json.dumps(recorder.summary(limit), indent=2), mimetype="application/json")
@@ -9,21 +9,39 @@
 #
 # To use it, pass 'profile=1' as a GET or POST parameter to any HTTP
 # request.
+#
+# The middleware also has a low overhead statistical sampling mode suitable
+# for production use.  A fraction of all requests (settings.PROFILE_SAMPLE_RATE)
+# and/or all requests to specific url names (settings.PROFILE_SAMPLE_URL_NAMES)
+# have the stack of the thread handling them sampled every
+# settings.PROFILE_SAMPLE_INTERVAL seconds by a background thread. Samples are
+# aggregated across requests as collapsed stacks (the input format for
+# flamegraph.pl and speedscope) and can be downloaded by staff users from
+# the sampled_profile view.
 
 from base64 import b64decode, b64encode
+import collections
 import cPickle
 from cStringIO import StringIO
 from decimal import Decimal
 import hotshot
 import hotshot.stats
+import os
+import random
 import sys
 import tempfile
+import threading
+import time
 
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.urlresolvers import resolve, Resolver404
 from django.db import connection, reset_queries
 from django.http import HttpResponse
 from django.utils import html
 
+from qatrack.middleware.instrumentation import view_name
+
 
 class StdoutWrapper(object):
     """Simple wrapper to capture and overload sys.stdout"""
@@ -278,13 +296,146 @@ def display_queries(request, stats, queries):
     return response
 
 
+class Sampler(object):
+    """
+    Statistical profiler. Threads register themselves (with a label e.g. the
+    view name) for sampling and a single background thread periodically
+    records their current stacks.  Safe to use with multithreaded servers
+    since the sampled threads are never interrupted or traced.
+    """
+
+    def __init__(self, interval=0.005, max_depth=100):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.active = {}
+        self.wake = threading.Event()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.thread = None
+        self.pid = None
+        self.filenames = {}
+
+    def start(self, label, ident=None):
+        """begin sampling thread ident (default current thread)"""
+        ident = threading.current_thread().ident if ident is None else ident
+        with self.lock:
+            self.active[ident] = label
+            self.ensure_running()
+            self.wake.set()
+
+    def stop(self, ident=None):
+        ident = threading.current_thread().ident if ident is None else ident
+        with self.lock:
+            self.active.pop(ident, None)
+            if not self.active:
+                self.wake.clear()
+
+    def ensure_running(self):
+        # (re)start the sampling thread e.g. after the server forks workers
+        if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name="profile-sampler")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        """record the current stack of every registered thread"""
+        with self.lock:
+            active = self.active.items()
+        if not active:
+            return
+
+        frames = sys._current_frames()
+        stacks = []
+        for ident, label in active:
+            frame = frames.get(ident)
+            if frame is not None:
+                stacks.append(self.collapse(label, frame))
+
+        with self.lock:
+            self.stacks.update(stacks)
+            self.samples += len(stacks)
+
+    def collapse(self, label, frame):
+        """return stack as a single line of ; separated frames, root first"""
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append("%s:%s:%d" % (self.short_filename(code.co_filename), code.co_name, code.co_firstlineno))
+            frame = frame.f_back
+        names.append(label)
+        return ";".join(reversed(names)).replace(" ", "_")
+
+    def short_filename(self, filename):
+        """strip sys.path entries from filename to keep stacks readable"""
+        try:
+            return self.filenames[filename]
+        except KeyError:
+            short = filename
+            for path in sorted(sys.path, key=len, reverse=True):
+                if path and filename.startswith(path):
+                    short = filename[len(path):].lstrip(os.sep)
+                    break
+            self.filenames[filename] = short
+            return short
+
+    def collapsed(self):
+        """return aggregated samples in collapsed stack format"""
+        with self.lock:
+            stacks = self.stacks.items()
+        return "".join("%s %d\n" % (stack, count) for stack, count in sorted(stacks))
+
+    def clear(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+
+
+sampler = Sampler(getattr(settings, "PROFILE_SAMPLE_INTERVAL", 0.005))
+
+
+@staff_member_required
+def sampled_profile(request):
+    """Download the samples collected so far as collapsed stacks.
+    Pass reset=1 to discard the samples after downloading."""
+    response = HttpResponse(sampler.collapsed(), mimetype="text/plain")
+    response["Content-Disposition"] = "attachment; filename=qatrack-%d.collapsed" % os.getpid()
+    if request.GET.get("reset"):
+        sampler.clear()
+    return response
+
+
 class ProfileMiddleware(object):
     """
     Displays hotshot profiling for any view.
     http://yoursite.com/yourview/?profile=1
 
     WARNING: It uses hotshot profiler which is not thread safe.
+
+    Also samples a subset of requests using the thread safe Sampler
+    (see PROFILE_SAMPLE_RATE and PROFILE_SAMPLE_URL_NAMES settings)
     """
+
+    def should_sample(self, request):
+        rate = getattr(settings, "PROFILE_SAMPLE_RATE", 0)
+        if rate and random.random() < rate:
+            return True
+
+        url_names = getattr(settings, "PROFILE_SAMPLE_URL_NAMES", ())
+        if url_names:
+            try:
+                return resolve(request.path_info).url_name in url_names
+            except Resolver404:
+                pass
+        return False
+
     def process_request(self, request):
         """
     Setup the profiler for a profiling run and clear the SQL query log.
@@ -334,9 +485,14 @@ class ProfileMiddleware(object):
                                         request, *view_args, **view_kwargs)
             finally:
                 request.GET = original_get
+        elif self.should_sample(request):
+            request.sampled = True
+            sampler.start(view_name(view_func))
 
     def process_response(self, request, response):
         """Finish profiling and render the results."""
+        if getattr(request, 'sampled', False):
+            sampler.stop()
         profiler = getattr(request, 'profiler', None)
         if profiler:
             profiler.close()
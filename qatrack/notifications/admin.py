@@ -1,3 +1,13 @@
 from django.contrib import admin
 import models
 admin.site.register([models.NotificationSubscription], admin.ModelAdmin)
+
+
+#============================================================================
+class QueuedNotificationAdmin(admin.ModelAdmin):
+
+    list_display = ("subject", "recipients", "status", "attempts", "created", "next_attempt", "sent",)
+    list_filter = ("status",)
+    readonly_fields = ("created", "sent", "last_error",)
+
+admin.site.register([models.QueuedNotification], QueuedNotificationAdmin)
@@ -1,14 +1,21 @@
+import collections
+
 from django.conf import settings
-from django.contrib.auth.models import User
-from django.core.mail import send_mail
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.template import Context
 from django.template.loader import get_template
+from django.utils import timezone
 
+from qatrack.qa.models import TestInstance, TOLERANCE as TI_TOLERANCE, ACTION as TI_ACTION
 from qatrack.qa.signals import testlist_complete
 
 
 import models
+import outbox
 
 
 #----------------------------------------------------------------------
@@ -16,29 +23,24 @@ import models
 def email_on_testlist_save(*args, **kwargs):
     """TestListInstance was completed.  Send email notification if applicable"""
 
+    if getattr(settings, "EMAIL_NOTIFICATION_DIGEST_WINDOW", None):
+        # results will be reported by the send_notification_digest command
+        return
+
     test_list_instance = kwargs["instance"]
 
-    failing = failing_tests_to_report(test_list_instance)
-    tolerance = tolerance_tests_to_report(test_list_instance)
+    failing, tolerance = tests_to_report(test_list_instance)
 
     if not (failing or tolerance):
         return
 
-    tol_recipients, act_recipients = get_notification_recipients()
-
-    recipients = tol_recipients
-    if failing:
-        recipients |= act_recipients
-
-    recipient_emails = recipients.distinct().values_list("email", flat=True)
+    recipient_emails = recipients_for(failing)
+    if not recipient_emails:
+        return
 
-    from_address = getattr(settings, "EMAIL_NOTIFICATION_SENDER", "QATrack+")
     subject = getattr(settings, "EMAIL_NOTIFICATION_SUBJECT", "QATrack+ Notification")
     subject_template = getattr(settings, "EMAIL_NOTIFICATION_SUBJECT_TEMPLATE", "notification_email_subject.txt")
     template = getattr(settings, "EMAIL_NOTIFICATION_TEMPLATE", "notification_email.txt")
-    user = getattr(settings, "EMAIL_NOTIFICATION_USER", None)
-    pwd = getattr(settings, "EMAIL_NOTIFICATION_PWD", None)
-    fail_silently = getattr(settings, "EMAIL_FAIL_SILENTLY", True)
 
     context = Context({
         "failing_tests": failing,
@@ -51,28 +53,162 @@ def email_on_testlist_save(*args, **kwargs):
 
     body = get_template(template).render(context)
 
-    send_mail(
-        subject, body, from_address, recipient_emails,
-        auth_user=user, auth_password=pwd,
-        fail_silently=fail_silently
-    )
+    deliver([(subject, body, sorted(recipient_emails))])
 
 
 #----------------------------------------------------------------------
-def failing_tests_to_report(test_list_instance):
-    """return failing tests to be reported for this test_list_instance"""
-    return test_list_instance.failing_tests()
+def deliver(messages):
+    """Send (or queue if settings.EMAIL_NOTIFICATION_QUEUE is set) messages
+    of the form [(subject, body, recipients), ...] over a single connection"""
+
+    from_address = getattr(settings, "EMAIL_NOTIFICATION_SENDER", "QATrack+")
+
+    if getattr(settings, "EMAIL_NOTIFICATION_QUEUE", False):
+        # delivered later by the send_notifications command
+        for subject, body, recipients in messages:
+            outbox.enqueue(subject, body, from_address, recipients)
+        return
+
+    connection = get_connection(
+        username=getattr(settings, "EMAIL_NOTIFICATION_USER", None),
+        password=getattr(settings, "EMAIL_NOTIFICATION_PWD", None),
+        fail_silently=getattr(settings, "EMAIL_FAIL_SILENTLY", True),
+    )
+
+    connection.send_messages([
+        EmailMessage(subject, body, from_address, recipients)
+        for subject, body, recipients in messages
+    ])
 
 
 #----------------------------------------------------------------------
-def tolerance_tests_to_report(test_list_instance):
-    """return tolerance tests to be reported for this test_list_instance"""
-    return test_list_instance.tolerance_tests()
+def tests_to_report(test_list_instance):
+    """return (failing, tolerance) lists of test instances to be reported
+    for this test_list_instance"""
+
+    to_report = test_list_instance.testinstance_set.filter(
+        pass_fail__in=(TI_ACTION, TI_TOLERANCE),
+    ).select_related(
+        "unit_test_info__test",
+        "reference",
+        "tolerance",
+    ).order_by("created")
+
+    failing = [ti for ti in to_report if ti.pass_fail == TI_ACTION]
+    tolerance = [ti for ti in to_report if ti.pass_fail == TI_TOLERANCE]
+
+    return failing, tolerance
 
 
 #----------------------------------------------------------------------
 def get_notification_recipients():
-    tolerance_users = User.objects.filter(groups__notificationsubscription__warning_level__lte=models.TOLERANCE).distinct()
-    action_users = User.objects.filter(groups__notificationsubscription__warning_level__lte=models.ACTION).distinct()
+    """return sets of email addresses to notify for tests at tolerance and
+    for tests at action levels.  The mapping is cached and invalidated
+    when subscriptions or group memberships change."""
 
-    return tolerance_users, action_users
+    recipients = cache.get(settings.CACHE_NOTIFICATION_RECIPIENTS)
+    if recipients is None:
+        subscribed = User.objects.filter(
+            groups__notificationsubscription__isnull=False,
+        ).exclude(
+            email="",
+        ).values_list(
+            "email", "groups__notificationsubscription__warning_level",
+        ).distinct()
+
+        recipients = {models.TOLERANCE: set(), models.ACTION: set()}
+        for email, level in subscribed:
+            for notify_level in recipients:
+                if level <= notify_level:
+                    recipients[notify_level].add(email)
+
+        cache.set(settings.CACHE_NOTIFICATION_RECIPIENTS, recipients)
+
+    return recipients[models.TOLERANCE], recipients[models.ACTION]
+
+
+#----------------------------------------------------------------------
+def recipients_for(failing):
+    """return email addresses to notify depending on whether there are failing tests"""
+
+    tol_recipients, act_recipients = get_notification_recipients()
+    return tol_recipients | act_recipients if failing else tol_recipients
+
+
+#----------------------------------------------------------------------
+@receiver(post_save, sender=models.NotificationSubscription)
+@receiver(post_delete, sender=models.NotificationSubscription)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Group)
+@receiver(m2m_changed, sender=User.groups.through)
+def update_recipients_cache(*args, **kwargs):
+    """subscriptions or group memberships changed so clear recipient cache"""
+    cache.delete(settings.CACHE_NOTIFICATION_RECIPIENTS)
+
+
+#----------------------------------------------------------------------
+def instances_to_digest(start, end):
+    """return list of (test_list_instance, failing, tolerance) for all test list
+    instances completed in the window (start, end] that have tests at
+    tolerance or action levels.  Lists are selected by the time they were
+    last submitted (modified) rather than created so that lists saved as in
+    progress are included once they are completed"""
+
+    test_instances = TestInstance.objects.filter(
+        test_list_instance__in_progress=False,
+        test_list_instance__modified__gt=start,
+        test_list_instance__modified__lte=end,
+        pass_fail__in=(TI_ACTION, TI_TOLERANCE),
+    ).select_related(
+        "test_list_instance__test_list",
+        "test_list_instance__unit_test_collection__unit",
+        "unit_test_info__test",
+        "reference",
+        "tolerance",
+    ).order_by("test_list_instance__work_completed", "test_list_instance", "created")
+
+    grouped = collections.OrderedDict()
+    for ti in test_instances:
+        failing, tolerance = grouped.setdefault(ti.test_list_instance_id, (ti.test_list_instance, [], []))[1:]
+        (failing if ti.pass_fail == TI_ACTION else tolerance).append(ti)
+
+    return grouped.values()
+
+
+#----------------------------------------------------------------------
+def send_digest(end=None):
+    """Send one email per recipient summarizing all test lists completed
+    with tests at tolerance/action since the previous digest (or within
+    settings.EMAIL_NOTIFICATION_DIGEST_WINDOW for the first digest).
+    Returns the NotificationDigest record for this run."""
+
+    end = end or timezone.now()
+    start = end - timezone.timedelta(seconds=getattr(settings, "EMAIL_NOTIFICATION_DIGEST_WINDOW", None) or 24 * 60 * 60)
+    try:
+        start = max(start, models.NotificationDigest.objects.latest().end)
+    except models.NotificationDigest.DoesNotExist:
+        pass
+
+    instances = instances_to_digest(start, end)
+
+    by_recipient = collections.defaultdict(list)
+    for instance in instances:
+        for email in recipients_for(instance[1]):
+            by_recipient[email].append(instance)
+
+    subject_template = get_template(getattr(settings, "EMAIL_NOTIFICATION_DIGEST_SUBJECT_TEMPLATE", "notification_digest_subject.txt"))
+    template = get_template(getattr(settings, "EMAIL_NOTIFICATION_DIGEST_TEMPLATE", "notification_digest_email.txt"))
+
+    messages = []
+    for email, recipient_instances in sorted(by_recipient.items()):
+        context = Context({"instances": recipient_instances, "start": start, "end": end})
+        messages.append((subject_template.render(context).strip(), template.render(context), [email]))
+
+    if messages:
+        deliver(messages)
+
+    return models.NotificationDigest.objects.create(
+        start=start, end=end,
+        test_list_instances=len(instances), recipients=len(messages),
+    )
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from qatrack.notifications.handlers import send_digest
+
+
+#============================================================================
+class Command(BaseCommand):
+    """A management command to email a digest of all test lists completed
+    with tests at tolerance or action levels since the last digest was sent.
+    Should be run periodically (e.g. from cron) at the interval set by
+    settings.EMAIL_NOTIFICATION_DIGEST_WINDOW.
+    """
+
+    help = 'Send digest of tolerance/action notifications'
+
+    #----------------------------------------------------------------------
+    def handle(self, *args, **kwargs):
+
+        if not getattr(settings, "EMAIL_NOTIFICATION_DIGEST_WINDOW", None):
+            raise CommandError("EMAIL_NOTIFICATION_DIGEST_WINDOW must be set to use notification digests")
+
+        digest = send_digest()
+        self.stdout.write(
+            "Sent digest of %d test lists to %d recipients\n" % (digest.test_list_instances, digest.recipients)
+        )
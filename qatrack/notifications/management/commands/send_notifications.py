@@ -0,0 +1,56 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from qatrack.notifications.outbox import Dispatcher
+
+
+#============================================================================
+class Command(BaseCommand):
+    """A management command to deliver notifications queued in the outbox
+    (see settings.EMAIL_NOTIFICATION_QUEUE).  Run periodically (e.g. from cron)
+    or leave running with --loop.
+    """
+
+    help = 'Deliver queued email notifications'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--loop", action="store_true", dest="loop", default=False,
+            help="Keep running and poll the outbox for new notifications",
+        ),
+        make_option(
+            "--interval", type="float", dest="interval", default=10.,
+            help="Seconds to wait between polls when running with --loop (default 10)",
+        ),
+        make_option(
+            "--batch-size", type="int", dest="batch_size", default=50,
+            help="Maximum number of notifications sent per batch (default 50)",
+        ),
+    )
+
+    #----------------------------------------------------------------------
+    def handle(self, *args, **options):
+
+        dispatcher = Dispatcher(batch_size=options["batch_size"])
+
+        try:
+            while True:
+                total_sent = total_failed = 0
+                while True:
+                    sent, failed = dispatcher.dispatch()
+                    total_sent += sent
+                    total_failed += failed
+                    if sent + failed < dispatcher.batch_size:
+                        break
+
+                if total_sent or total_failed or not options["loop"]:
+                    self.stdout.write("Sent %d notifications (%d failed)\n" % (total_sent, total_failed))
+
+                if not options["loop"]:
+                    break
+
+                time.sleep(options["interval"])
+        finally:
+            dispatcher.close()
@@ -1,8 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import Group
-
-# this import has to be here so that the signal handlers get registered
-import handlers  # NOQA
+from django.utils import timezone
 
 
 TOLERANCE = 10
@@ -25,3 +23,66 @@ class NotificationSubscription(models.Model):
     #----------------------------------------------------------------------
     def __unicode__(self):
         return "<NotificationSubscription(%s)>" % self.group.name
+
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+QUEUE_STATUSES = (
+    (PENDING, "Pending"),
+    (SENT, "Sent"),
+    (FAILED, "Failed"),
+)
+
+
+#============================================================================
+class QueuedNotification(models.Model):
+    """An email notification waiting to be delivered by the outbox dispatcher"""
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.TextField(help_text="Comma separated list of email addresses")
+
+    status = models.CharField(max_length=10, choices=QUEUE_STATUSES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("next_attempt", "pk",)
+
+    #----------------------------------------------------------------------
+    def recipient_list(self):
+        return [x for x in self.recipients.split(",") if x]
+
+    #----------------------------------------------------------------------
+    def __unicode__(self):
+        return "<QueuedNotification(%s, %s)>" % (self.pk, self.status)
+
+
+#============================================================================
+class NotificationDigest(models.Model):
+    """Record of a digest notification run so the next run can pick up
+    where the previous one left off"""
+
+    start = models.DateTimeField()
+    end = models.DateTimeField(db_index=True)
+    test_list_instances = models.PositiveIntegerField(default=0)
+    recipients = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        get_latest_by = "end"
+
+    #----------------------------------------------------------------------
+    def __unicode__(self):
+        return "<NotificationDigest(%s - %s)>" % (self.start, self.end)
+
+
+# this import has to be here so that the signal handlers get registered
+# (at the bottom since handlers refers to the models above)
+import handlers  # NOQA
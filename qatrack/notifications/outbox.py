@@ -0,0 +1,146 @@
+"""
+A persistent outbox for notification emails.
+
+Notifications are queued as :model:`notifications.QueuedNotification`'s
+and delivered in batches by a :class:`Dispatcher` (normally run via the
+`send_notifications` management command) so that a slow or unavailable
+mail server never holds up the request that generated the notification.
+
+Only one dispatcher should be run against a database at a time.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
+
+import models
+
+logger = logging.getLogger('qatrack.console')
+
+
+#----------------------------------------------------------------------
+def enqueue(subject, body, from_email, recipients):
+    """add a notification to the outbox"""
+
+    return models.QueuedNotification.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email,
+        recipients=",".join(recipients),
+    )
+
+
+#----------------------------------------------------------------------
+def retry_delay(attempts):
+    """return delay before next attempt after `attempts` failed attempts"""
+
+    base = getattr(settings, "EMAIL_NOTIFICATION_RETRY_DELAY", 60)
+    return timezone.timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+#============================================================================
+class Dispatcher(object):
+    """Deliver queued notifications in batches over a single connection"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, batch_size=50, backend=None):
+        self.batch_size = batch_size
+        self.backend = backend
+        self.connection = None
+        self.max_attempts = getattr(settings, "EMAIL_NOTIFICATION_MAX_ATTEMPTS", 5)
+
+    #----------------------------------------------------------------------
+    def open(self):
+        """open a connection to the mail server unless one is already open"""
+
+        if self.connection is None:
+            connection = get_connection(
+                backend=self.backend,
+                username=getattr(settings, "EMAIL_NOTIFICATION_USER", None),
+                password=getattr(settings, "EMAIL_NOTIFICATION_PWD", None),
+                fail_silently=False,
+            )
+            connection.open()
+            self.connection = connection
+
+    #----------------------------------------------------------------------
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    #----------------------------------------------------------------------
+    def pending(self):
+        """return batch of notifications that are due to be sent"""
+
+        return list(models.QueuedNotification.objects.filter(
+            status=models.PENDING,
+            next_attempt__lte=timezone.now(),
+        ).order_by("next_attempt", "pk")[:self.batch_size])
+
+    #----------------------------------------------------------------------
+    def failed(self, notification, error):
+        """record a failed attempt and schedule retry if allowed"""
+
+        notification.attempts += 1
+        notification.last_error = unicode(error)
+        if notification.attempts >= self.max_attempts:
+            notification.status = models.FAILED
+        else:
+            notification.next_attempt = timezone.now() + retry_delay(notification.attempts)
+        notification.save()
+
+    #----------------------------------------------------------------------
+    def dispatch(self):
+        """Send a single batch of due notifications. Returns a tuple of
+        (number sent, number failed). The connection is left open when
+        a full batch was processed since more work is likely waiting."""
+
+        batch = self.pending()
+        if not batch:
+            self.close()
+            return 0, 0
+
+        try:
+            self.open()
+        except Exception as e:
+            logger.error("Unable to connect to mail server: %s" % e)
+            self.close()
+            for notification in batch:
+                self.failed(notification, e)
+            return 0, len(batch)
+
+        sent, failed = [], 0
+        for notification in batch:
+            try:
+                # connection is reopened if a previous send failed
+                self.open()
+                EmailMessage(
+                    notification.subject, notification.body,
+                    notification.from_email, notification.recipient_list(),
+                    connection=self.connection,
+                ).send()
+            except Exception as e:
+                logger.error("Failed to send notification %s: %s" % (notification.pk, e))
+                self.failed(notification, e)
+                self.close()
+                failed += 1
+            else:
+                sent.append(notification.pk)
+
+        models.QueuedNotification.objects.filter(pk__in=sent).update(
+            status=models.SENT,
+            sent=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+
+        if len(batch) < self.batch_size:
+            self.close()
+
+        return len(sent), failed
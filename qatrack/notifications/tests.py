@@ -1,8 +1,16 @@
+import asyncore
+import smtpd
+import socket
+import threading
+
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.core import mail
+from django.utils import timezone
 from qatrack.qa import models, signals
 import qatrack.qa.tests.utils as utils
-from .models import NotificationSubscription, TOLERANCE
+from . import handlers, outbox
+from .models import NotificationSubscription, QueuedNotification, TOLERANCE, ACTION, PENDING, SENT, FAILED
 
 
 #============================================================================
@@ -75,3 +83,200 @@ class TestEmailSent(TestCase):
         self.test_list_instance.testinstance_set.update(pass_fail=models.OK)
         signals.testlist_complete.send(sender=self, instance=self.test_list_instance, created=True)
         self.assertEqual(len(mail.outbox), 0)
+
+    #----------------------------------------------------------------------
+    def test_email_queued(self):
+
+        NotificationSubscription(group=self.group, warning_level=TOLERANCE).save()
+
+        with override_settings(EMAIL_NOTIFICATION_QUEUE=True):
+            signals.testlist_complete.send(sender=self, instance=self.test_list_instance, created=True)
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = QueuedNotification.objects.get()
+        self.assertEqual(queued.recipient_list(), ["example@example.com"])
+
+        self.assertEqual(outbox.Dispatcher().dispatch(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    #----------------------------------------------------------------------
+    def test_recipients_cached(self):
+
+        NotificationSubscription(group=self.group, warning_level=TOLERANCE).save()
+        self.assertEqual(handlers.get_notification_recipients(), (set(["example@example.com"]),) * 2)
+
+        with self.assertNumQueries(0):
+            handlers.get_notification_recipients()
+
+        models.User.objects.get(pk=1).groups.remove(self.group)
+        self.assertEqual(handlers.get_notification_recipients(), (set(), set()))
+
+    #----------------------------------------------------------------------
+    def test_action_only_subscription(self):
+
+        NotificationSubscription(group=self.group, warning_level=ACTION).save()
+
+        self.test_list_instance.testinstance_set.filter(pass_fail=models.ACTION).update(pass_fail=models.OK)
+        signals.testlist_complete.send(sender=self, instance=self.test_list_instance, created=True)
+        self.assertEqual(len(mail.outbox), 0)
+
+    #----------------------------------------------------------------------
+    def test_digest(self):
+
+        NotificationSubscription(group=self.group, warning_level=TOLERANCE).save()
+        self.create_test_list_instance()
+
+        with override_settings(EMAIL_NOTIFICATION_DIGEST_WINDOW=60 * 60):
+            signals.testlist_complete.send(sender=self, instance=self.test_list_instance, created=True)
+            self.assertEqual(len(mail.outbox), 0)
+
+            digest = handlers.send_digest()
+            self.assertEqual((digest.test_list_instances, digest.recipients), (2, 1))
+            self.assertEqual(len(mail.outbox), 1)
+            self.assertEqual(mail.outbox[0].to, ["example@example.com"])
+            self.assertIn("2 test lists", mail.outbox[0].subject)
+
+            # nothing new since last digest
+            digest = handlers.send_digest()
+            self.assertEqual(digest.test_list_instances, 0)
+            self.assertEqual(len(mail.outbox), 1)
+
+    #----------------------------------------------------------------------
+    def test_digest_in_progress_completed_later(self):
+
+        NotificationSubscription(group=self.group, warning_level=TOLERANCE).save()
+        in_progress = self.create_test_list_instance()
+        in_progress.in_progress = True
+        in_progress.save()
+
+        with override_settings(EMAIL_NOTIFICATION_DIGEST_WINDOW=60 * 60):
+            digest = handlers.send_digest()
+            self.assertEqual(digest.test_list_instances, 1)
+
+            # completed after the digest ran
+            in_progress.in_progress = False
+            in_progress.modified = timezone.now()
+            in_progress.save()
+
+            digest = handlers.send_digest()
+            self.assertEqual(digest.test_list_instances, 1)
+
+
+#============================================================================
+class LocalSMTPServer(smtpd.SMTPServer):
+    """SMTP stand-in that records messages it receives"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        self.socket_map = {}
+        smtpd.SMTPServer.__init__(self, ("127.0.0.1", 0), None)
+        # move server out of the global asyncore map so it can be run in isolation
+        del asyncore.socket_map[self._fileno]
+        self.socket_map[self._fileno] = self
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #----------------------------------------------------------------------
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            conn, addr = pair
+            channel = smtpd.SMTPChannel(self, conn, addr)
+            # channels register themselves in the global map
+            del asyncore.socket_map[channel._fileno]
+            self.socket_map[channel._fileno] = channel
+
+    #----------------------------------------------------------------------
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+    #----------------------------------------------------------------------
+    def run(self):
+        while self.running:
+            asyncore.loop(timeout=0.05, count=1, map=self.socket_map)
+
+    #----------------------------------------------------------------------
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        for channel in self.socket_map.values():
+            channel.close()
+
+
+#============================================================================
+class TestOutbox(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.smtp_settings = override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=self.server.port,
+            EMAIL_USE_TLS=False,
+            EMAIL_NOTIFICATION_USER=None,
+            EMAIL_NOTIFICATION_PWD=None,
+        )
+        self.smtp_settings.enable()
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        self.smtp_settings.disable()
+        self.server.stop()
+
+    #----------------------------------------------------------------------
+    def test_dispatch_batches(self):
+        for i in range(3):
+            outbox.enqueue("subject %d" % i, "body", "qatrack@example.com", ["a@example.com", "b@example.com"])
+
+        dispatcher = outbox.Dispatcher(batch_size=2)
+        self.assertEqual(dispatcher.dispatch(), (2, 0))
+        self.assertIsNotNone(dispatcher.connection)
+        self.assertEqual(dispatcher.dispatch(), (1, 0))
+        self.assertIsNone(dispatcher.connection)
+
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.messages[0][1], ["a@example.com", "b@example.com"])
+        self.assertEqual(QueuedNotification.objects.filter(status=SENT, attempts=1).count(), 3)
+
+    #----------------------------------------------------------------------
+    def test_retry_with_backoff(self):
+        notification = outbox.enqueue("subject", "body", "qatrack@example.com", ["a@example.com"])
+
+        with override_settings(EMAIL_PORT=self.unused_port()):
+            self.assertEqual(outbox.Dispatcher().dispatch(), (0, 1))
+
+        notification = QueuedNotification.objects.get(pk=notification.pk)
+        self.assertEqual((notification.status, notification.attempts), (PENDING, 1))
+        self.assertTrue(notification.next_attempt > timezone.now())
+        self.assertTrue(notification.last_error)
+
+        # not due yet
+        self.assertEqual(outbox.Dispatcher().dispatch(), (0, 0))
+
+        QueuedNotification.objects.update(next_attempt=timezone.now())
+        self.assertEqual(outbox.Dispatcher().dispatch(), (1, 0))
+        self.assertEqual(len(self.server.messages), 1)
+
+    #----------------------------------------------------------------------
+    def test_gives_up_after_max_attempts(self):
+        notification = outbox.enqueue("subject", "body", "qatrack@example.com", ["a@example.com"])
+
+        with override_settings(EMAIL_PORT=self.unused_port(), EMAIL_NOTIFICATION_MAX_ATTEMPTS=2):
+            for i in range(2):
+                outbox.Dispatcher().dispatch()
+                QueuedNotification.objects.update(next_attempt=timezone.now())
+
+        self.assertEqual(QueuedNotification.objects.get(pk=notification.pk).status, FAILED)
+
+    #----------------------------------------------------------------------
+    def unused_port(self):
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+        s.close()
+        return port
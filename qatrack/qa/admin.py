@@ -15,6 +15,7 @@ from django.shortcuts import redirect
 from admin_views.admin import AdminViews
 
 import qatrack.qa.models as models
+from qatrack.qa import references
 
 
 #============================================================================
@@ -173,38 +174,9 @@ class UnitTestInfoAdmin(AdminViews, admin.ModelAdmin):
             reference = form.cleaned_data['reference']
             tolerance = form.cleaned_data['tolerance']
 
-            # Save the uti with the new references and tolerance
-            # TODO: Combine with save method: save_model ?
-            for uti in queryset:
-                if uti.test.type != models.MULTIPLE_CHOICE:
-                    if uti.test.type == models.BOOLEAN:
-                        ref_type = models.BOOLEAN
-                        if reference == 'True' or reference == 1:
-                            reference = 1
-                        else:
-                            reference = 0
-                    else:
-                        ref_type = models.NUMERICAL
-                    if reference not in ("", None):
-                        if not(uti.reference and uti.reference.value == float(reference)):
-                            try:
-                                ref = models.Reference.objects.get(value=reference, type=ref_type)
-                            except models.Reference.DoesNotExist:
-                                ref = models.Reference(
-                                    value=reference,
-                                    type=ref_type,
-                                    created_by=request.user,
-                                    modified_by=request.user,
-                                    name="%s %s" % (uti.unit.name, uti.test.name)[:255]
-                                )
-                                ref.save()
-                            uti.reference = ref
-                    else:
-                        uti.reference = None
-                uti.tolerance = tolerance
-                uti.save()
-
-            messages.success(request, "%s tolerances and references have been saved successfully." % queryset.count())
+            summary = references.set_references_and_tolerances(queryset, reference, tolerance, request.user)
+
+            messages.success(request, "%s tolerances and references have been saved successfully." % summary.updated)
             return HttpResponseRedirect(request.get_full_path())
 
     #---------------------------------------------------------------------------
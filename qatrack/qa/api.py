@@ -1,14 +1,23 @@
+import calendar
 import csv
+import itertools
+import json
 import StringIO
 from django.conf import settings
+from django.conf.urls import url
 from django.contrib.auth.models import Group
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
 from qatrack.formats.en.formats import DATETIME_FORMAT
 import django.utils.dateformat as dateformat
 import tastypie
 from tastypie.resources import Resource, ModelResource, ALL, ALL_WITH_RELATIONS
 from tastypie.authentication import BasicAuthentication
 from tastypie.authorization import DjangoAuthorization
-from tastypie.utils import timezone
+from tastypie.exceptions import BadRequest
+from tastypie.utils import timezone, trailing_slash
+from qatrack.qa import data_versions
 import qatrack.qa.models as models
 from qatrack.units.models import Unit, Modality, UnitType
 
@@ -19,6 +28,42 @@ def csv_date(dt):
     return dateformat.format(timezone.make_naive(dt), DATETIME_FORMAT)
 
 
+#----------------------------------------------------------------------
+def encode_cursor(work_completed, pk):
+    """return url safe cursor for the position after (work_completed, pk)"""
+    utc = work_completed.utctimetuple()
+    micros = calendar.timegm(utc) * 1000000 + work_completed.microsecond
+    return "%d-%d" % (micros, pk)
+
+
+#----------------------------------------------------------------------
+def decode_cursor(cursor):
+    """return (work_completed, pk) from a cursor created by encode_cursor"""
+    try:
+        micros, pk = [int(x) for x in cursor.split("-")]
+    except (ValueError, AttributeError):
+        raise BadRequest("Invalid cursor '%s'" % cursor)
+    epoch = timezone.timezone.datetime(1970, 1, 1, tzinfo=timezone.timezone.utc)
+    return epoch + timezone.timezone.timedelta(microseconds=micros), pk
+
+
+#----------------------------------------------------------------------
+def value_filters(request, **kwargs):
+    """return pks of units selected by the unit filter (None for all units)
+    (see qatrack.qa.data_versions)"""
+
+    units = request.GET.getlist("unit")
+    if units:
+        return list(Unit.objects.filter(number__in=units).values_list("pk", flat=True))
+
+
+# columns for ValueResourceCSVSerializer.values_row
+CSV_FIELDS = (
+    "work_completed", "value", "tolerance__act_low", "tolerance__tol_low", "reference__value",
+    "tolerance__tol_high", "tolerance__act_high", "tolerance__type", "comment", "created_by__username",
+)
+
+
 class ValueResourceCSVSerializer(Serializer):
 
     formats = ['json', 'jsonp', 'csv']
@@ -41,36 +86,58 @@ class ValueResourceCSVSerializer(Serializer):
     ]
 
     #----------------------------------------------------------------------
-    def instances_to_csv(self, instances):
-        rows = [[x[0] for x in self.columns]]
-        for i in instances:
-            tol_type = ""
-            al, tl, th, ah = "", "", "", ""
-            if i.tolerance:
-                al, tl = i.tolerance.act_low, i.tolerance.tol_low
-                ah, th = i.tolerance.act_high, i.tolerance.tol_high
-                tol_type = i.tolerance.type
-            r = ""
-            if i.reference:
-                r = i.reference.value
-
-            rows.append([csv_date(i.work_completed), i.value, al, tl, r, th, ah, tol_type, i.comment, i.created_by.username])
-
-        return rows
+    def instance_row(self, i):
+        tol_type = ""
+        al, tl, th, ah = "", "", "", ""
+        if i.tolerance:
+            al, tl = i.tolerance.act_low, i.tolerance.tol_low
+            ah, th = i.tolerance.act_high, i.tolerance.tol_high
+            tol_type = i.tolerance.type
+        r = ""
+        if i.reference:
+            r = i.reference.value
+
+        return [csv_date(i.work_completed), i.value, al, tl, r, th, ah, tol_type, i.comment, i.created_by.username]
 
     #----------------------------------------------------------------------
-    def to_csv(self, data, options=None):
-        options = options or {}
+    def values_row(self, values):
+        """row for a tuple of CSV_FIELDS values"""
+        return [csv_date(values[0])] + list(values[1:len(CSV_FIELDS)])
 
-        csv_data = StringIO.StringIO()
-        writer = csv.writer(csv_data)
+    #----------------------------------------------------------------------
+    def instances_to_csv(self, instances):
+        return [[x[0] for x in self.columns]] + [self.instance_row(i) for i in instances]
 
-        for item in data["objects"]:
-            headers = ["Unit:", "Unit%02d" % item.data["unit"], "Test:", item.data["name"]]
-            column = [headers] + self.instances_to_csv(item.obj["data"])
-            writer.writerows(column)
+    #----------------------------------------------------------------------
+    def iter_csv(self, groups, chunk_size=500):
+        """yield CSV text in chunks of chunk_size rows for an iterable of
+        (unit number, test name, rows) groups"""
+
+        buf = StringIO.StringIO()
+        writer = csv.writer(buf)
+        header = [x[0] for x in self.columns]
+
+        written = 0
+        for unit, name, rows in groups:
+            writer.writerow(["Unit:", "Unit%02d" % unit, "Test:", name])
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+                if written % chunk_size == 0:
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+
+        yield buf.getvalue()
 
-        return csv_data.getvalue()
+    #----------------------------------------------------------------------
+    def to_csv(self, data, options=None):
+        groups = (
+            (item.data["unit"], item.data["name"], (self.instance_row(i) for i in item.obj["data"]))
+            for item in data["objects"]
+        )
+        return "".join(self.iter_csv(groups))
 
 
 #============================================================================
@@ -144,7 +211,7 @@ class TestInstanceResource(ModelResource):
     reviewed_by = tastypie.fields.CharField()
 
     class Meta:
-        queryset = models.TestInstance.objects.complete().all()
+        queryset = models.TestInstance.objects.complete().select_related("reference", "tolerance", "status", "reviewed_by")
         resource_name = "values"
         allowed_methods = ["get", "patch", "put"]
         always_return_data = True
@@ -193,7 +260,7 @@ class TestInstanceResource(ModelResource):
                     orm_filters[filter_string] = value
                 except (ValueError, IndexError, TypeError):
                     pass
-            else:
+            elif value:
                 orm_filters[filter_string] = value
 
         # non specfic list filters
@@ -208,6 +275,152 @@ class TestInstanceResource(ModelResource):
         auth = super(TestInstanceResource, self).is_authorized(request, obj)
         return auth
 
+    #----------------------------------------------------------------------
+    @method_decorator(data_versions.conditional(value_filters))
+    def get_list(self, request, **kwargs):
+        return super(TestInstanceResource, self).get_list(request, **kwargs)
+
+    #----------------------------------------------------------------------
+    @method_decorator(data_versions.conditional(lambda request, **kwargs: None))
+    def get_detail(self, request, **kwargs):
+        return super(TestInstanceResource, self).get_detail(request, **kwargs)
+
+    #----------------------------------------------------------------------
+    def prepend_urls(self):
+        return [
+            url(
+                r"^(?P<resource_name>%s)/stream%s$" % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view("get_stream"), name="api_values_stream",
+            ),
+        ]
+
+    #----------------------------------------------------------------------
+    def get_stream(self, request, **kwargs):
+        """Stream values ordered by (work_completed, pk).
+
+        Accepts the same filters as the list view plus:
+
+            after   cursor returned by a previous request (next values only)
+            limit   maximum number of values (default 0 = all)
+            format  ndjson (default, one JSON object per line) or columns
+                    (single JSON object with a list per column)
+
+        Values are read from the database in keyset paginated chunks rather
+        than with offsets so that memory use is constant and each chunk is
+        an index range scan. When a limit is given and more values remain,
+        the cursor for the next page is returned in the X-Next-Cursor
+        header (and the "next" key for the columns format).
+        """
+
+        self.method_check(request, allowed=["get"])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        return self.stream_response(request, **kwargs)
+
+    #----------------------------------------------------------------------
+    @method_decorator(data_versions.conditional(value_filters))
+    def stream_response(self, request, **kwargs):
+
+        fmt = request.GET.get("format", "ndjson")
+        if fmt not in ("ndjson", "columns"):
+            raise BadRequest("Invalid format '%s'. Use ndjson or columns" % fmt)
+
+        try:
+            limit = int(request.GET.get("limit", 0))
+        except ValueError:
+            raise BadRequest("Invalid limit '%s'" % request.GET["limit"])
+
+        after = decode_cursor(request.GET["after"]) if request.GET.get("after") else None
+        objects = self.obj_get_list(self.build_bundle(request=request), **self.remove_api_resource_names(kwargs))
+
+        rows = stream_values(objects, after, limit + 1 if limit > 0 else None)
+        next_cursor = None
+        if limit > 0:
+            # limited pages are small enough to read up front
+            rows = list(rows)
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+
+        if fmt == "columns":
+            data = dict((col, []) for col in STREAM_COLUMNS)
+            for row in rows:
+                for col, value in zip(STREAM_COLUMNS, stream_row(row)):
+                    data[col].append(value)
+            content = json.dumps({"next": next_cursor, "columns": STREAM_COLUMNS, "data": data})
+            response = HttpResponse(content, mimetype="application/json")
+        else:
+            lines = (json.dumps(dict(zip(STREAM_COLUMNS, stream_row(row)))) + "\n" for row in rows)
+            response = HttpResponse(lines, mimetype="application/x-ndjson")
+
+        if next_cursor:
+            response["X-Next-Cursor"] = next_cursor
+
+        self.log_throttled_access(request)
+        return response
+
+
+STREAM_FIELDS = (
+    ("id", "pk"),
+    ("date", "work_completed"),
+    ("unit", "unit_test_info__unit__number"),
+    ("test", "unit_test_info__test__slug"),
+    ("value", "value"),
+    ("string_value", "string_value"),
+    ("skipped", "skipped"),
+    ("pass_fail", "pass_fail"),
+    ("status", "status__slug"),
+    ("reference", "reference__value"),
+    ("tol_type", "tolerance__type"),
+    ("act_low", "tolerance__act_low"),
+    ("tol_low", "tolerance__tol_low"),
+    ("tol_high", "tolerance__tol_high"),
+    ("act_high", "tolerance__act_high"),
+    ("comment", "comment"),
+    ("user", "created_by__username"),
+    ("reviewed_by", "reviewed_by__username"),
+    ("test_list_instance", "test_list_instance"),
+)
+STREAM_COLUMNS = [col for col, field in STREAM_FIELDS]
+
+
+#----------------------------------------------------------------------
+def stream_row(row):
+    """return JSON serializable values for a row from stream_values"""
+    row = list(row)
+    row[1] = row[1].isoformat()
+    return row
+
+
+#----------------------------------------------------------------------
+def stream_values(objects, after=None, limit=None, chunk_size=2000):
+    """yield value tuples (see STREAM_FIELDS) for TestInstance queryset
+    objects in (work_completed, pk) order starting after the position
+    `after` = (work_completed, pk)"""
+
+    objects = objects.order_by("work_completed", "pk").values_list(*[f for c, f in STREAM_FIELDS])
+    position = after
+
+    remaining = limit
+    while remaining is None or remaining > 0:
+        chunk = objects
+        if position:
+            date, pk = position
+            chunk = chunk.filter(Q(work_completed__gt=date) | Q(work_completed=date, pk__gt=pk))
+
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        rows = list(chunk[:size])
+        for row in rows:
+            yield row
+
+        if len(rows) < size:
+            return
+
+        position = (rows[-1][1], rows[-1][0])
+        if remaining is not None:
+            remaining -= len(rows)
+
 
 #----------------------------------------------------------------------
 def serialize_testinstance(test_instance):
@@ -275,6 +488,12 @@ class StatusResource(ModelResource):
         queryset = models.TestInstanceStatus.objects.all()
 
 
+#----------------------------------------------------------------------
+def group_key(ti):
+    test = ti.unit_test_info.test
+    return (test.slug, test.name, ti.unit_test_info.unit.number)
+
+
 #============================================================================
 class ValueResource(Resource):
     unit = tastypie.fields.IntegerField()
@@ -322,31 +541,77 @@ class ValueResource(Resource):
         return data
 
     #----------------------------------------------------------------------
-    def get_object_list(self, request):
-        """return organized values"""
-        objects = TestInstanceResource().obj_get_list(request)
-        names = objects.order_by("unit_test_info__test__name").values_list("unit_test_info__test__slug", "unit_test_info__test__name").distinct()
-        units = objects.order_by("unit_test_info__unit__number").values_list("unit_test_info__unit__number", flat=True).distinct()
-        self.dispatch
+    def instances(self, bundle):
+        """return filtered test instances ordered by test, unit & date"""
+
+        return TestInstanceResource().obj_get_list(bundle).select_related(
+            "reference", "tolerance", "status", "created_by", "reviewed_by",
+            "unit_test_info__unit", "unit_test_info__test",
+        ).order_by("unit_test_info__test__name", "unit_test_info__test__slug", "unit_test_info__unit__number", "work_completed", "pk")
+
+    #----------------------------------------------------------------------
+    def get_object_list(self, bundle):
+        """return values organized by test & unit (using a single query)"""
+
+        groups = {}
+        names = []
+        units = set()
+        for (slug, name, unit), data in itertools.groupby(self.instances(bundle), key=group_key):
+            groups[(slug, unit)] = list(data)
+            if not names or names[-1] != (slug, name):
+                names.append((slug, name))
+            units.add(unit)
+
         organized = []
         for slug, name in names:
-            for unit in units:
-                data = objects.filter(
-                    unit_test_info__test__slug=slug,
-                    unit_test_info__unit__number=unit,
-                ).order_by("work_completed", "pk")
-
+            for unit in sorted(units):
                 organized.append({
                     'slug': slug,
                     'name': name,
                     'unit': unit,
-                    'data': data,
+                    'data': groups.get((slug, unit), []),
                 })
         return organized
 
     #----------------------------------------------------------------------
-    def obj_get_list(self, request=None, **kwargs):
-        return self.get_object_list(request)
+    def obj_get_list(self, bundle, **kwargs):
+        return self.get_object_list(bundle)
+
+    #----------------------------------------------------------------------
+    def csv_groups(self, values, units):
+        """yield (unit number, test name, rows) for every test & unit in the
+        same way as get_object_list (i.e. including units without values for
+        a test) from CSV_FIELDS + (slug, name, unit number) values ordered
+        by test & unit"""
+
+        serializer = self._meta.serializer
+        for (slug, name), test_values in itertools.groupby(values, key=lambda v: v[-3:-1]):
+            by_unit = itertools.groupby(test_values, key=lambda v: v[-1])
+            unit, data = next(by_unit, (None, None))
+            for number in units:
+                if number == unit:
+                    yield number, name, (serializer.values_row(v) for v in data)
+                    unit, data = next(by_unit, (None, None))
+                else:
+                    yield number, name, ()
+
+    #----------------------------------------------------------------------
+    @method_decorator(data_versions.conditional(value_filters))
+    def get_list(self, request, **kwargs):
+        """CSV exports are streamed directly from a single query rather than
+        being built in memory.  Unlike other formats they are not paginated
+        (limit & offset are ignored) so every matching test & unit is
+        included in the export"""
+
+        if self.determine_format(request) != self._meta.serializer.content_types["csv"]:
+            return super(ValueResource, self).get_list(request, **kwargs)
+
+        instances = self.instances(self.build_bundle(request=request))
+        units = sorted(set(instances.order_by().values_list("unit_test_info__unit__number", flat=True).distinct()))
+
+        fields = CSV_FIELDS + ("unit_test_info__test__slug", "unit_test_info__test__name", "unit_test_info__unit__number")
+        groups = self.csv_groups(instances.values_list(*fields).iterator(), units)
+        return HttpResponse(self._meta.serializer.iter_csv(groups), content_type="text/csv")
 
 
 #============================================================================
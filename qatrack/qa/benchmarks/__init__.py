@@ -0,0 +1,11 @@
+"""
+Performance benchmarks for QATrack+.
+
+`data.generate` creates a reproducible synthetic clinic (units, test lists
+with sublists and cycles, composite tests and a history of results) and
+`suite.Suite` times the key request paths against it.  Normally run via
+the `benchmark` management command which uses a throwaway test database:
+
+    python manage.py benchmark --units 5 --days 365 --output results.json
+    python manage.py benchmark --compare results.json
+"""
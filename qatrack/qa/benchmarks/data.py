@@ -0,0 +1,334 @@
+"""
+Generate a reproducible synthetic clinic for benchmarking.
+
+The generated dataset consists of a number of units, each of which is
+assigned every test list (daily) and every test list cycle (weekly), and
+a history of completed test list instances covering the requested number
+of days.  Results are generated from a seeded random number generator so
+the same parameters always produce the same data.
+"""
+
+import random
+
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Max
+from django.utils import timezone
+
+from qatrack.qa import data_versions, models, signals
+from qatrack.qa.utils import chunks
+from qatrack.units.models import Unit, UnitType
+
+
+PREFIX = "bm"
+PASSWORD = "benchmark"
+
+DEFAULTS = {
+    "units": 3,
+    "test_lists": 5,
+    "tests_per_list": 10,
+    "sublists": 1,
+    "cycles": 1,
+    "cycle_length": 3,
+    "composites": 2,
+    "days": 180,
+    "seed": 0,
+}
+
+
+#============================================================================
+class Dataset(object):
+    """the objects created by `generate`"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, params):
+        self.params = params
+        self.user = None
+        self.password = PASSWORD
+        self.statuses = []
+        self.units = []
+        self.test_lists = []
+        self.cycles = []
+        self.composites = {}
+        self.composite_terms = {}
+        self.utcs = []
+
+    #----------------------------------------------------------------------
+    def counts(self):
+        """return dict of object counts in the database"""
+
+        return {
+            "units": Unit.objects.count(),
+            "tests": models.Test.objects.count(),
+            "test_lists": models.TestList.objects.count(),
+            "unit_test_collections": models.UnitTestCollection.objects.count(),
+            "test_list_instances": models.TestListInstance.objects.count(),
+            "test_instances": models.TestInstance.objects.count(),
+        }
+
+
+#----------------------------------------------------------------------
+def generate(**params):
+    """Create a synthetic dataset. See DEFAULTS for the available parameters.
+    Returns a Dataset."""
+
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise TypeError("Unknown parameters: %s" % ", ".join(sorted(unknown)))
+
+    p = dict(DEFAULTS, **params)
+    rng = random.Random(p["seed"])
+    dataset = Dataset(p)
+
+    create_users_and_statuses(dataset)
+    create_test_lists(dataset)
+    create_units(dataset)
+    create_assignments(dataset)
+    create_history(dataset, rng)
+
+    return dataset
+
+
+#----------------------------------------------------------------------
+def create_users_and_statuses(dataset):
+
+    user, created = User.objects.get_or_create(
+        username="%s-user" % PREFIX,
+        defaults={"is_staff": True, "is_superuser": True, "email": "%s@example.com" % PREFIX},
+    )
+    user.set_password(PASSWORD)
+    user.save()
+
+    group, _ = Group.objects.get_or_create(name="%s-group" % PREFIX)
+    user.groups.add(group)
+
+    dataset.user = user
+    dataset.group = group
+
+    dataset.statuses = [
+        models.TestInstanceStatus.objects.get_or_create(
+            slug="%s-unreviewed" % PREFIX,
+            defaults={"name": "%s Unreviewed" % PREFIX, "is_default": True, "requires_review": True},
+        )[0],
+        models.TestInstanceStatus.objects.get_or_create(
+            slug="%s-approved" % PREFIX,
+            defaults={"name": "%s Approved" % PREFIX, "is_default": False, "requires_review": False},
+        )[0],
+    ]
+
+    dataset.daily = models.Frequency.objects.get_or_create(
+        slug="%s-daily" % PREFIX,
+        defaults={"name": "%s Daily" % PREFIX, "nominal_interval": 1, "due_interval": 1, "overdue_interval": 1},
+    )[0]
+    dataset.weekly = models.Frequency.objects.get_or_create(
+        slug="%s-weekly" % PREFIX,
+        defaults={"name": "%s Weekly" % PREFIX, "nominal_interval": 7, "due_interval": 7, "overdue_interval": 9},
+    )[0]
+
+
+#----------------------------------------------------------------------
+def create_test_lists(dataset):
+    """Create test lists made up of simple, boolean and composite tests.
+    The first `sublists` lists include the last lists as sublists and
+    cycles are made up of consecutive lists."""
+
+    p = dataset.params
+    user = dataset.user
+    category, _ = models.Category.objects.get_or_create(
+        slug="%s-category" % PREFIX,
+        defaults={"name": "%s Category" % PREFIX, "description": "Benchmark tests"},
+    )
+
+    tests = []
+    for l in range(p["test_lists"]):
+        for t in range(p["tests_per_list"]):
+            test_type = models.BOOLEAN if t == p["tests_per_list"] - 1 and t > 1 else models.SIMPLE
+            tests.append(models.Test(
+                name="%s l%d t%d" % (PREFIX, l, t), slug="%s_l%d_t%d" % (PREFIX, l, t),
+                type=test_type, category=category, created_by=user, modified_by=user,
+            ))
+        for c in range(p["composites"] if p["tests_per_list"] > 1 else 0):
+            slug, a, b = ["%s_l%d_%s" % (PREFIX, l, name) for name in ("c%d" % c, "t0", "t1")]
+            dataset.composite_terms[slug] = (a, b, c + 1)
+            tests.append(models.Test(
+                name="%s l%d c%d" % (PREFIX, l, c), slug=slug,
+                type=models.COMPOSITE, category=category, created_by=user, modified_by=user,
+                calculation_procedure="result = %s + %s * %d" % (a, b, c + 1),
+            ))
+    models.Test.objects.bulk_create(tests)
+
+    tests = dict((t.slug, t) for t in models.Test.objects.filter(slug__startswith="%s_l" % PREFIX))
+
+    memberships = []
+    for l in range(p["test_lists"]):
+        test_list = models.TestList(
+            name="%s List %d" % (PREFIX, l), slug="%s-list-%d" % (PREFIX, l),
+            created_by=user, modified_by=user,
+        )
+        test_list.save()
+        dataset.test_lists.append(test_list)
+
+        slugs = ["%s_l%d_t%d" % (PREFIX, l, t) for t in range(p["tests_per_list"])]
+        composites = ["%s_l%d_c%d" % (PREFIX, l, c) for c in range(p["composites"] if p["tests_per_list"] > 1 else 0)]
+        dataset.composites[test_list.pk] = [tests[slug] for slug in composites]
+        for order, slug in enumerate(slugs + composites):
+            memberships.append(models.TestListMembership(test_list=test_list, test=tests[slug], order=order))
+
+    models.TestListMembership.objects.bulk_create(memberships)
+
+    n_lists = len(dataset.test_lists)
+    for l in range(min(p["sublists"], n_lists // 2)):
+        dataset.test_lists[l].sublists.add(dataset.test_lists[n_lists - 1 - l])
+
+    for c in range(p["cycles"]):
+        cycle = models.TestListCycle(
+            name="%s Cycle %d" % (PREFIX, c), slug="%s-cycle-%d" % (PREFIX, c),
+            created_by=user, modified_by=user,
+        )
+        cycle.save()
+        for day in range(p["cycle_length"]):
+            test_list = dataset.test_lists[(c + day) % n_lists]
+            models.TestListCycleMembership.objects.create(cycle=cycle, test_list=test_list, order=day)
+        dataset.cycles.append(cycle)
+
+
+#----------------------------------------------------------------------
+def create_units(dataset):
+
+    unit_type, _ = UnitType.objects.get_or_create(name="%s Linac" % PREFIX, vendor="Vendor", model="Model")
+    start = (Unit.objects.aggregate(n=Max("number"))["n"] or 0) + 1
+
+    for n in range(start, start + dataset.params["units"]):
+        unit = Unit(name="%s Unit %d" % (PREFIX, n), number=n, type=unit_type)
+        unit.save()
+        dataset.units.append(unit)
+
+
+#----------------------------------------------------------------------
+def create_assignments(dataset):
+    """Assign every test list (daily) & cycle (weekly) to every unit and
+    set references & tolerances for all the simple tests"""
+
+    user = dataset.user
+    list_ct = ContentType.objects.get_for_model(models.TestList)
+    cycle_ct = ContentType.objects.get_for_model(models.TestListCycle)
+
+    collections = [(list_ct, tl, dataset.daily) for tl in dataset.test_lists]
+    collections += [(cycle_ct, c, dataset.weekly) for c in dataset.cycles]
+
+    for unit in dataset.units:
+        for content_type, obj, frequency in collections:
+            utc = models.UnitTestCollection(
+                unit=unit, content_type=content_type, object_id=obj.pk,
+                frequency=frequency, assigned_to=dataset.group, auto_schedule=True,
+            )
+            utc.save()
+            utc.visible_to.add(dataset.group)
+            dataset.utcs.append(utc)
+
+    reference = models.Reference.objects.create(
+        name="%s reference" % PREFIX, type=models.NUMERICAL, value=100.,
+        created_by=user, modified_by=user,
+    )
+    tolerance = models.Tolerance.objects.create(
+        type=models.PERCENT, act_low=-3, tol_low=-2, tol_high=2, act_high=3,
+        created_by=user, modified_by=user,
+    )
+    bool_reference = models.Reference.objects.create(
+        name="%s bool reference" % PREFIX, type=models.BOOLEAN, value=1.,
+        created_by=user, modified_by=user,
+    )
+
+    utis = models.UnitTestInfo.objects.filter(unit__in=dataset.units)
+    utis.filter(test__type=models.SIMPLE).update(reference=reference, tolerance=tolerance)
+    utis.filter(test__type=models.BOOLEAN).update(reference=bool_reference)
+
+
+#----------------------------------------------------------------------
+def create_history(dataset, rng):
+    """Create test list instances (with bulk inserts) for every day (daily
+    lists) or week (cycles) of history"""
+
+    p = dataset.params
+    user = dataset.user
+    unreviewed, approved = dataset.statuses
+    now = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    start = now - timezone.timedelta(days=p["days"])
+    review_cutoff = now - timezone.timedelta(days=7)
+
+    utis = {}
+    for uti in models.UnitTestInfo.objects.filter(unit__in=dataset.units).select_related("test", "reference", "tolerance"):
+        utis[(uti.unit_id, uti.test_id)] = uti
+
+    list_tests = {}
+    for test_list in dataset.test_lists:
+        list_tests[test_list.pk] = test_list.ordered_tests()
+
+    cycle_lists = {}
+    for cycle in dataset.cycles:
+        cycle_lists[cycle.pk] = [m.test_list for m in cycle.testlistcyclemembership_set.order_by("order").select_related("test_list")]
+
+    cycle_ct = ContentType.objects.get_for_model(models.TestListCycle)
+
+    tlis = []
+    for utc in dataset.utcs:
+        interval = utc.frequency.nominal_interval
+        cycle = cycle_lists[utc.object_id] if utc.content_type_id == cycle_ct.pk else None
+        for n, offset in enumerate(range(0, p["days"], interval)):
+            work_completed = start + timezone.timedelta(days=offset, minutes=rng.randint(0, 8 * 60))
+            day, test_list = (n % len(cycle), cycle[n % len(cycle)]) if cycle else (0, models.TestList(pk=utc.object_id))
+            reviewed = work_completed < review_cutoff
+            tlis.append(models.TestListInstance(
+                unit_test_collection=utc, test_list_id=test_list.pk, day=day,
+                work_started=work_completed - timezone.timedelta(minutes=rng.randint(5, 30)),
+                work_completed=work_completed, modified=work_completed,
+                created_by=user, modified_by=user,
+                reviewed=work_completed if reviewed else None,
+                reviewed_by=user if reviewed else None,
+                all_reviewed=reviewed,
+            ))
+
+    last_pk = models.TestListInstance.objects.aggregate(pk=Max("pk"))["pk"] or 0
+    for chunk in chunks(tlis, 500):
+        models.TestListInstance.objects.bulk_create(chunk)
+
+    # bulk_create doesn't set primary keys so read them back
+    created = models.TestListInstance.objects.filter(pk__gt=last_pk).select_related("unit_test_collection").order_by("pk")
+
+    instances = []
+    dirty = set()
+    for tli in created.iterator():
+        unit_id = tli.unit_test_collection.unit_id
+        dirty.add((tli.unit_test_collection_id, unit_id, tli.test_list_id))
+        values = {}
+        for test in list_tests[tli.test_list_id]:
+            uti = utis[(unit_id, test.pk)]
+            ti = models.TestInstance(
+                unit_test_info=uti, test_list_instance=tli,
+                status=approved if tli.all_reviewed else unreviewed,
+                reference=uti.reference, tolerance=uti.tolerance,
+                work_started=tli.work_started, work_completed=tli.work_completed,
+                created=tli.work_completed, created_by=user, modified_by=user,
+                review_date=tli.reviewed, reviewed_by=tli.reviewed_by,
+            )
+            if test.type == models.BOOLEAN:
+                ti.value = float(rng.random() > 0.05)
+            elif test.type == models.COMPOSITE:
+                a, b, k = dataset.composite_terms[test.slug]
+                ti.value = values[a] + values[b] * k
+            else:
+                ti.value = rng.gauss(100., 1.)
+            values[test.slug] = ti.value
+            ti.calculate_pass_fail()
+            instances.append(ti)
+
+        if len(instances) >= 1000:
+            models.TestInstance.objects.bulk_create(instances)
+            instances = []
+
+    models.TestInstance.objects.bulk_create(instances)
+    data_versions.touch(unit for unit, test in utis)
+
+    # bookkeeping normally done by the TestListInstance post_save signal
+    signals.update_last_instances_bulk(dirty)
+    models.unreviewed_counter.reset()
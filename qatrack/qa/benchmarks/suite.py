@@ -0,0 +1,259 @@
+"""
+Timers for the key request paths.
+
+Each benchmark is a method of Suite decorated with `benchmark`.  It is run
+once to warm up (imports, caches etc) and then `repeat` times, recording
+the wall time (ms) and number of queries of every run.
+"""
+
+import base64
+import json
+import time
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+from django.utils import timezone
+
+from qatrack.qa import models
+from qatrack.qa.utils import QueryBudget
+
+
+BENCHMARKS = []
+
+
+#----------------------------------------------------------------------
+def benchmark(func):
+    """register a Suite method as a benchmark"""
+    BENCHMARKS.append(func.__name__)
+    return func
+
+
+#----------------------------------------------------------------------
+def summarize(times, queries):
+    times = sorted(times)
+    n = len(times)
+    median = times[n // 2] if n % 2 else (times[n // 2 - 1] + times[n // 2]) / 2.
+    return {
+        "runs": n,
+        "min": times[0],
+        "median": median,
+        "mean": sum(times) / n,
+        "max": times[-1],
+        "queries": max(queries),
+    }
+
+
+#----------------------------------------------------------------------
+def compare(previous, current):
+    """return list of (name, previous median, current median, % change,
+    previous queries, current queries) for benchmarks in both results"""
+
+    rows = []
+    for name, result in sorted(current["results"].items()):
+        old = previous["results"].get(name)
+        if not old or "error" in old or "error" in result:
+            continue
+        change = 100. * (result["median"] - old["median"]) / old["median"] if old["median"] else 0.
+        rows.append((name, old["median"], result["median"], change, old["queries"], result["queries"]))
+    return rows
+
+
+#============================================================================
+class Suite(object):
+
+    #----------------------------------------------------------------------
+    def __init__(self, dataset, repeat=5):
+        self.dataset = dataset
+        self.repeat = repeat
+
+        self.client = Client()
+        self.client.login(username=dataset.user.username, password=dataset.password)
+
+        # a list with sublists & composites is the most demanding to perform
+        self.test_list = dataset.test_lists[0]
+        self.unit = dataset.units[0]
+        self.utc = models.UnitTestCollection.objects.get(
+            unit=self.unit, object_id=self.test_list.pk,
+            content_type__model="testlist",
+        )
+        self.tli = models.TestListInstance.objects.filter(unit_test_collection=self.utc).latest("work_completed")
+
+        self.chart_params = {
+            "tests[]": [t.pk for t in self.test_list.tests.all()],
+            "test_lists[]": [self.test_list.pk],
+            "units[]": [self.unit.pk],
+            "statuses[]": [s.pk for s in dataset.statuses],
+            "from_date": (timezone.now() - timezone.timedelta(days=365)).strftime(settings.SIMPLE_DATE_FORMAT),
+            "to_date": timezone.now().strftime(settings.SIMPLE_DATE_FORMAT),
+        }
+
+    #----------------------------------------------------------------------
+    def run(self, names=None):
+        """run benchmarks (all by default) and return dict of results"""
+
+        results = {}
+        for name in names or BENCHMARKS:
+            results[name] = self.time(getattr(self, name))
+        return results
+
+    #----------------------------------------------------------------------
+    def time(self, func):
+
+        try:
+            func()
+            times, queries = [], []
+            for i in range(self.repeat):
+                with QueryBudget() as budget:
+                    t0 = time.time()
+                    func()
+                    times.append(1000. * (time.time() - t0))
+                queries.append(len(budget))
+        except Exception as e:
+            return {"error": "%s: %s" % (e.__class__.__name__, e)}
+
+        return summarize(times, queries)
+
+    #----------------------------------------------------------------------
+    def get(self, url, data=None, **extra):
+        response = self.client.get(url, data or {}, **extra)
+        if response.status_code != 200:
+            raise ValueError("GET %s returned %d" % (url, response.status_code))
+        return response
+
+    #----------------------------------------------------------------------
+    def datatables(self, url):
+        data = {"iDisplayLength": settings.PAGINATE_DEFAULT, "iDisplayStart": 0, "sEcho": 1}
+        return self.get(url, data, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def perform_get(self):
+        self.get(reverse("perform_qa", kwargs={"pk": self.utc.pk}))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def perform_post(self):
+
+        if not hasattr(self, "perform_data"):
+            response = self.get(reverse("perform_qa", kwargs={"pk": self.utc.pk}))
+            forms = response.context["formset"].forms
+            data = {
+                "work_started": timezone.localtime(timezone.now() - timezone.timedelta(minutes=30)).strftime(settings.INPUT_DATE_FORMATS[0]),
+                "status": self.dataset.statuses[0].pk,
+                "form-TOTAL_FORMS": len(forms),
+                "form-INITIAL_FORMS": len(forms),
+                "form-MAX_NUM_FORMS": "",
+            }
+            for idx, form in enumerate(forms):
+                data["form-%d-value" % idx] = 1 if form.unit_test_info.test.is_boolean() else 100.
+                data["form-%d-comment" % idx] = ""
+            self.perform_data = data
+
+        url = reverse("perform_qa", kwargs={"pk": self.utc.pk})
+        response = self.client.post(url, self.perform_data)
+        if response.status_code != 302:
+            raise ValueError("POST %s returned %d" % (url, response.status_code))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def composite(self):
+        tests = self.test_list.ordered_tests()
+        values = dict((t.slug, "" if t.type == models.COMPOSITE else 100.) for t in tests)
+        composites = [t.pk for t in tests if t.type == models.COMPOSITE]
+        data = {
+            "qavalues": json.dumps(values),
+            "composite_ids": json.dumps(composites),
+            "meta": "{}",
+        }
+        response = self.client.post(reverse("composite"), data)
+        if not json.loads(response.content)["success"]:
+            raise ValueError("composite calculation failed")
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def history(self):
+        self.utc.history()
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def review_get(self):
+        self.get(reverse("review_test_list_instance", kwargs={"pk": self.tli.pk}))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def charts(self):
+        self.get(reverse("charts"))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def chart_data(self):
+        self.get(reverse("chart_data"), self.chart_params)
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def control_chart(self):
+        params = dict(self.chart_params, **{"tests[]": self.chart_params["tests[]"][:1]})
+        self.get(reverse("control_chart"), params)
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def utc_list(self):
+        self.datatables(reverse("all_lists"))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def tli_list(self):
+        self.datatables(reverse("complete_instances"))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def unreviewed(self):
+        self.datatables(reverse("unreviewed"))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def overview(self):
+        self.get(reverse("overview"))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def due_dates(self):
+        self.get(reverse("overview_due_dates"))
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def api_values(self):
+        auth = "Basic %s" % base64.b64encode("%s:%s" % (self.dataset.user.username, self.dataset.password))
+        params = {
+            "format": "json",
+            "unit": self.unit.number,
+            "slug": [t.slug for t in self.test_list.tests.all()],
+            "limit": 0,
+        }
+        self.get(reverse("api_dispatch_list", kwargs={"api_name": "v1", "resource_name": "values"}), params, HTTP_AUTHORIZATION=auth)
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def api_grouped_values(self):
+        params = {
+            "format": "json",
+            "unit": self.unit.number,
+            "slug": [t.slug for t in self.test_list.tests.all()],
+        }
+        self.get(reverse("api_dispatch_list", kwargs={"api_name": "v1", "resource_name": "grouped_values"}), params)
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def api_stream(self):
+        auth = "Basic %s" % base64.b64encode("%s:%s" % (self.dataset.user.username, self.dataset.password))
+        params = {"unit": self.unit.number, "slug": [t.slug for t in self.test_list.tests.all()]}
+        response = self.get(reverse("api_values_stream", kwargs={"api_name": "v1", "resource_name": "values"}), params, HTTP_AUTHORIZATION=auth)
+        response.content
+
+    #----------------------------------------------------------------------
+    @benchmark
+    def api_csv_export(self):
+        params = {"format": "csv", "unit": [u.number for u in self.dataset.units]}
+        response = self.get(reverse("api_dispatch_list", kwargs={"api_name": "v1", "resource_name": "grouped_values"}), params)
+        response.content
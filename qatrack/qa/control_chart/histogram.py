@@ -23,7 +23,8 @@ def binwidth(x, maxBins=None):
     C = np.zeros(len(numOfBins))
 
     for i in np.arange(0, len(numOfBins)):
-        k, edges = np.histogram(x, bins=numOfBins[i])
+        # numpy requires an integer number of bins
+        k, edges = np.histogram(x, bins=int(numOfBins[i]))
         C[i] = get_cost_func(k, span, numOfBins[i])
 
     minCindex = np.where(C == np.min(C))[0][0]
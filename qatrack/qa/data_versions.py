@@ -0,0 +1,172 @@
+"""
+Data versions for conditional GET requests.
+
+Every unit has a data version which changes whenever TestInstances
+performed on the unit are created, edited, reviewed or deleted.  A global
+version changes along with every unit version:
+
+    touch_instances(test_instances)
+
+Views serving TestInstance data can then build strong ETags and
+Last-Modified headers from the versions of the units requested (or the
+global version when no units are specified) and answer repeat requests
+with 304 Not Modified without querying the TestInstance table:
+
+    get = conditional(lambda request: unit_pks)(get)
+
+Tests are not versioned individually since performing a single test list
+can change the data of hundreds of tests and each version is a separate
+cache write.
+
+Versions look like "<ms timestamp>.<random>" so they record when the data
+last changed and are never reused.  A version missing from the cache (first
+use or evicted) is recreated with the current time which can only cause
+an unnecessary full response, never a stale 304.  Versions are always read
+from the shared tier of a TieredCache since a value served from another
+process's local tier could be out of date.
+"""
+
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+import models
+
+UNIT = "unit"
+ALL = "all"
+
+
+#----------------------------------------------------------------------
+def version_key(kind, pk=None):
+    return "data-version:%s:%s" % (kind, pk)
+
+
+#----------------------------------------------------------------------
+def new_version():
+    return "%d.%s" % (time.time() * 1000, uuid.uuid4().hex[:8])
+
+
+#----------------------------------------------------------------------
+def version_time(version):
+    """return the (utc) time a version was created"""
+    ms = int(version.split(".")[0])
+    return timezone.datetime.utcfromtimestamp(ms / 1000.).replace(tzinfo=timezone.utc)
+
+
+#----------------------------------------------------------------------
+def _store():
+    return getattr(cache, "shared", cache)
+
+
+#----------------------------------------------------------------------
+def touch(units):
+    """units is an iterable of pks of units whose data changed"""
+
+    units = set(units)
+    if not units:
+        return
+
+    keys = [version_key(ALL)] + [version_key(UNIT, unit) for unit in units]
+
+    version = new_version()
+    cache.set_many(dict((key, version) for key in keys), settings.MAX_CACHE_TIMEOUT)
+
+
+#----------------------------------------------------------------------
+def touch_all():
+    """change the version used when no units are specified"""
+    cache.set(version_key(ALL), new_version(), settings.MAX_CACHE_TIMEOUT)
+
+
+#----------------------------------------------------------------------
+def touch_instances(test_instances):
+    """touch all units of test_instances (whose unit_test_info is loaded)"""
+    touch(ti.unit_test_info.unit_id for ti in test_instances)
+
+
+#----------------------------------------------------------------------
+def touch_unit_test_infos(unit_test_infos):
+    """touch all units of unit_test_infos (pks).  If some of them no longer
+    exist (deletion cascading from a UnitTestInfo to its TestInstances)
+    their units are unknown so the global version is changed as well"""
+
+    unit_test_infos = set(unit_test_infos)
+    if not unit_test_infos:
+        return
+
+    units = dict(models.UnitTestInfo.objects.filter(pk__in=unit_test_infos).values_list("pk", "unit"))
+    if len(units) < len(unit_test_infos):
+        touch_all()
+    touch(units.values())
+
+
+#----------------------------------------------------------------------
+def touch_test_list_instances(test_list_instances):
+    """touch all units of test_list_instances (pks)"""
+
+    units = models.TestListInstance.objects.filter(
+        pk__in=test_list_instances,
+    ).values_list("unit_test_collection__unit", flat=True).distinct()
+    touch(units)
+
+
+#----------------------------------------------------------------------
+def get_versions(units=None):
+    """return list of current versions for the input unit pks.
+    When no units are given the global version is used."""
+
+    keys = [version_key(UNIT, u) for u in units or []]
+    if not keys:
+        keys = [version_key(ALL)]
+
+    store = _store()
+    versions = store.get_many(keys)
+    for key in set(keys) - set(versions):
+        store.add(key, new_version(), settings.MAX_CACHE_TIMEOUT)
+        versions[key] = store.get(key)
+
+    return [versions[key] for key in sorted(versions)]
+
+
+#----------------------------------------------------------------------
+def make_etag(request, versions, since=None):
+    """ETag for the requested representation of the data at versions"""
+
+    parts = [request.get_full_path()] + list(versions)
+    if since:
+        parts.append(since.isoformat())
+    return hashlib.md5("|".join(parts)).hexdigest()
+
+
+#----------------------------------------------------------------------
+def conditional(get_filters, get_since=None):
+    """Decorator adding ETag & Last-Modified headers (and 304 responses)
+    to views of TestInstance data.  get_filters(request, *args, **kwargs)
+    returns the unit pks the response depends on (None for all).
+    get_since(request) may return a datetime the response also depends on
+    (e.g. when a date range defaults to 'until now')."""
+
+    def state(request, *args, **kwargs):
+        if not hasattr(request, "_data_versions"):
+            units = get_filters(request, *args, **kwargs)
+            since = get_since(request) if get_since else None
+            request._data_versions = (get_versions(units), since)
+        return request._data_versions
+
+    def etag(request, *args, **kwargs):
+        versions, since = state(request, *args, **kwargs)
+        return make_etag(request, versions, since)
+
+    def last_modified(request, *args, **kwargs):
+        versions, since = state(request, *args, **kwargs)
+        times = [version_time(v) for v in versions]
+        if since:
+            times.append(since)
+        return max(times) if times else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
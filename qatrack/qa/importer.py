@@ -0,0 +1,413 @@
+"""
+Bulk import of historical test results.
+
+Rows are dicts with the keys:
+
+    unit            unit number or name (required)
+    test            test slug (required)
+    work_completed  date & time the test was performed (required)
+    value           numerical, boolean (yes/no/true/false/1/0), multiple
+                    choice (choice text or index) or string value
+    test_list       test list slug. Only required when the test belongs
+                    to more than one test list assigned to the unit
+    work_started    defaults to work_completed
+    skipped         true/false
+    comment         test comment
+    status          TestInstanceStatus slug (defaults to the importers status)
+    user            username of the person who performed the test
+
+Rows with the same unit, test list and work_completed are grouped into a
+single TestListInstance.  All the rows for a TestListInstance must appear
+within batch_size TestListInstances of each other and each test may only
+appear once per TestListInstance.  Units, tests, assignments etc are
+resolved through lookup maps built once up front and the TestListInstances
+are saved (one query each) and their TestInstances bulk inserted, one
+batch at a time.  The last_instance & due date bookkeeping done by the
+TestListInstance post_save signal is coalesced into a single update per
+batch.
+
+Typical use:
+
+    importer = BulkImporter(user)
+    importer.import_rows(read_csv(open("history.csv")))
+    importer.finish()
+"""
+
+import collections
+import csv
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from qatrack.qa import data_versions, models, signals
+from qatrack.qa.utils import chunks
+from qatrack.units.models import Unit
+
+
+REQUIRED_FIELDS = ("unit", "test", "work_completed")
+TRUE_VALUES = ("1", "1.0", "true", "yes", "y", "t")
+FALSE_VALUES = ("0", "0.0", "false", "no", "n", "f", "")
+
+
+#============================================================================
+class RowError(ValueError):
+    """raised for rows that can not be imported"""
+
+
+#----------------------------------------------------------------------
+def read_csv(fileobj):
+    """yield rows from a CSV file with a header line"""
+
+    for row in csv.DictReader(fileobj):
+        yield dict((k.strip(), (v or "").strip()) for k, v in row.items() if k)
+
+
+#----------------------------------------------------------------------
+def read_json(fileobj):
+    """yield rows from a file containing either a JSON list of objects or
+    one JSON object per line"""
+
+    first = fileobj.read(1)
+    while first.isspace():
+        first = fileobj.read(1)
+
+    if first == "[":
+        for row in json.loads(first + fileobj.read()):
+            yield row
+        return
+
+    yield json.loads(first + fileobj.readline())
+    for line in fileobj:
+        if line.strip():
+            yield json.loads(line)
+
+
+#----------------------------------------------------------------------
+def parse_bool(value):
+    value = u"" if value is None else unicode(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    elif value in FALSE_VALUES:
+        return False
+    raise RowError("Invalid boolean value '%s'" % value)
+
+
+#----------------------------------------------------------------------
+def parse_date(value):
+    """return timezone aware datetime from ISO 8601 or INPUT_DATE_FORMATS string"""
+
+    if not isinstance(value, timezone.datetime):
+        text = unicode(value).strip()
+        try:
+            value = parse_datetime(text.replace(" ", "T", 1))
+        except ValueError:
+            value = None
+        for fmt in settings.INPUT_DATE_FORMATS if value is None else ():
+            try:
+                value = timezone.datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                pass
+        if value is None:
+            raise RowError("Invalid date '%s'" % text)
+
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_current_timezone())
+    return value
+
+
+#============================================================================
+class BulkImporter(object):
+
+    #----------------------------------------------------------------------
+    def __init__(self, user, status=None, batch_size=1000, units=None):
+        """user is recorded as the creator of the imported instances (and as
+        the performer when rows don't specify a user).  status is the
+        default TestInstanceStatus.  batch_size is the number of
+        TestListInstances inserted at a time. units optionally limits the
+        lookup maps to a set of units."""
+
+        self.user = user
+        self.status = status or models.TestInstanceStatus.objects.default()
+        if self.status is None:
+            raise ValueError("No default TestInstanceStatus configured")
+
+        self.batch_size = batch_size
+        self.pending = collections.OrderedDict()
+        self.flushed = set()
+        self.errors = []
+        self.line = 0
+        self.test_list_instances = 0
+        self.test_instances = 0
+
+        self.build_lookups(units)
+
+    #----------------------------------------------------------------------
+    def build_lookups(self, units=None):
+        """load everything required to resolve rows into dicts"""
+
+        unit_qs = Unit.objects.all() if units is None else Unit.objects.filter(pk__in=[getattr(u, "pk", u) for u in units])
+        self.units = {}
+        for unit in unit_qs:
+            self.units[unicode(unit.number)] = unit
+            self.units.setdefault(unit.name, unit)
+
+        self.tests = dict((t.slug, t) for t in models.Test.objects.all())
+        self.test_lists = dict(models.TestList.objects.values_list("slug", "pk"))
+        self.statuses = dict((s.slug, s) for s in models.TestInstanceStatus.objects.all())
+        self.users = {}
+        self.dates = {}
+
+        self.utis = {}
+        utis = models.UnitTestInfo.objects.filter(unit__in=unit_qs).select_related("test", "reference", "tolerance")
+        for uti in utis:
+            self.utis[(uti.unit_id, uti.test_id)] = uti
+
+        # test lists include the tests of their sublists
+        list_tests = collections.defaultdict(set)
+        for test_list_id, test_id in models.TestListMembership.objects.values_list("test_list", "test"):
+            list_tests[test_list_id].add(test_id)
+        for parent_id, child_id in models.TestList.sublists.through.objects.values_list("from_testlist", "to_testlist"):
+            list_tests[parent_id] |= list_tests[child_id]
+
+        cycle_days = collections.defaultdict(list)
+        for cycle_id, test_list_id, order in models.TestListCycleMembership.objects.order_by("order").values_list("cycle", "test_list", "order"):
+            cycle_days[cycle_id].append(test_list_id)
+
+        list_ct = ContentType.objects.get_for_model(models.TestList)
+
+        # (unit_id, test_list_id) -> (utc, day). Direct assignments take
+        # precedence over cycles that contain the test list
+        self.utcs = {}
+        utcs = models.UnitTestCollection.objects.filter(unit__in=unit_qs).order_by("pk")
+        for utc in sorted(utcs, key=lambda u: u.content_type_id == list_ct.pk):
+            if utc.content_type_id == list_ct.pk:
+                self.utcs[(utc.unit_id, utc.object_id)] = (utc, 0)
+            else:
+                for day, test_list_id in enumerate(cycle_days[utc.object_id]):
+                    self.utcs.setdefault((utc.unit_id, test_list_id), (utc, day))
+
+        # (unit_id, test_id) -> test lists assigned to that unit containing the test
+        self.unit_test_lists = collections.defaultdict(set)
+        for unit_id, test_list_id in self.utcs:
+            for test_id in list_tests[test_list_id]:
+                self.unit_test_lists[(unit_id, test_id)].add(test_list_id)
+
+    #----------------------------------------------------------------------
+    def get_user(self, username):
+        if not username:
+            return self.user
+        if username not in self.users:
+            try:
+                self.users[username] = User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise RowError("Unknown user '%s'" % username)
+        return self.users[username]
+
+    #----------------------------------------------------------------------
+    def resolve(self, row):
+        """return (session key, session attributes, TestInstance) for row"""
+
+        missing = [f for f in REQUIRED_FIELDS if not row.get(f)]
+        if missing:
+            raise RowError("Missing required fields: %s" % ", ".join(missing))
+
+        unit = self.units.get(unicode(row["unit"]).strip())
+        if unit is None:
+            raise RowError("Unknown unit '%s'" % row["unit"])
+
+        test = self.tests.get(row["test"])
+        if test is None:
+            raise RowError("Unknown test '%s'" % row["test"])
+
+        uti = self.utis.get((unit.pk, test.pk))
+        if uti is None:
+            raise RowError("Test '%s' is not assigned to unit '%s'" % (test.slug, row["unit"]))
+
+        if row.get("test_list"):
+            test_list_id = self.test_lists.get(row["test_list"])
+            if test_list_id is None:
+                raise RowError("Unknown test list '%s'" % row["test_list"])
+        else:
+            candidates = self.unit_test_lists.get((unit.pk, test.pk), ())
+            if len(candidates) != 1:
+                raise RowError("Test '%s' belongs to %d test lists on unit '%s'. Please specify test_list" % (test.slug, len(candidates), row["unit"]))
+            test_list_id = list(candidates)[0]
+
+        try:
+            utc, day = self.utcs[(unit.pk, test_list_id)]
+        except KeyError:
+            raise RowError("Test list '%s' is not assigned to unit '%s'" % (row.get("test_list"), row["unit"]))
+
+        work_completed = self.parse_date(row["work_completed"])
+        work_started = self.parse_date(row["work_started"]) if row.get("work_started") else work_completed
+        if work_started > work_completed:
+            raise RowError("work_started is after work_completed")
+
+        status = self.statuses.get(row["status"]) if row.get("status") else self.status
+        if status is None:
+            raise RowError("Unknown status '%s'" % row["status"])
+
+        performed_by = self.get_user(row.get("user"))
+        reviewed = not status.requires_review
+
+        ti = models.TestInstance(
+            unit_test_info=uti, status=status,
+            reference=uti.reference, tolerance=uti.tolerance,
+            skipped=parse_bool(row.get("skipped", "")),
+            comment=row.get("comment") or None,
+            work_started=work_started, work_completed=work_completed,
+            created=work_completed, created_by_id=performed_by.pk, modified_by_id=self.user.pk,
+            review_date=work_completed if reviewed else None,
+            reviewed_by_id=self.user.pk if reviewed else None,
+        )
+        self.set_value(ti, test, row.get("value"))
+        try:
+            ti.calculate_pass_fail()
+        except ZeroDivisionError:
+            raise RowError("Can not calculate percent difference for test '%s' with a zero reference" % test.slug)
+
+        key = (utc.pk, test_list_id, work_completed)
+        session = {
+            "utc": utc, "test_list_id": test_list_id, "day": day,
+            "work_started": work_started, "work_completed": work_completed,
+            "created_by": performed_by,
+        }
+        return key, session, ti
+
+    #----------------------------------------------------------------------
+    def parse_date(self, value):
+        """parse_date with the results cached since all the rows for a
+        test list instance generally share the same dates"""
+
+        if value not in self.dates:
+            if len(self.dates) > 10000:
+                self.dates.clear()
+            self.dates[value] = parse_date(value)
+        return self.dates[value]
+
+    #----------------------------------------------------------------------
+    def set_value(self, ti, test, value):
+
+        value = u"" if value is None else unicode(value).strip()
+        if ti.skipped:
+            return
+        elif value == "":
+            raise RowError("No value for test '%s' (mark as skipped instead)" % test.slug)
+
+        if test.is_boolean():
+            ti.value = float(parse_bool(value))
+        elif test.is_mult_choice():
+            choices = [c.strip().lower() for c in test.choices.split(",")]
+            if value.lower() in choices:
+                ti.value = choices.index(value.lower())
+            else:
+                try:
+                    ti.value = int(value)
+                    choices[ti.value]
+                except (ValueError, IndexError):
+                    raise RowError("Invalid choice '%s' for test '%s'" % (value, test.slug))
+        elif test.is_string_type() or test.is_upload():
+            ti.string_value = value[:models.MAX_STRING_VAL_LEN]
+        else:
+            try:
+                ti.value = float(value)
+            except ValueError:
+                raise RowError("Invalid value '%s' for test '%s'" % (value, test.slug))
+
+    #----------------------------------------------------------------------
+    def add(self, row):
+        """queue a single row for import, raising RowError if it is invalid"""
+
+        key, session, ti = self.resolve(row)
+        if key in self.flushed:
+            raise RowError(
+                "Test list instance for %s was already written. Rows for the same "
+                "test list instance must be closer together (or use a larger batch size)" % session["work_completed"]
+            )
+
+        if key not in self.pending:
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+            session["instances"] = {}
+            self.pending[key] = session
+
+        instances = self.pending[key]["instances"]
+        if ti.unit_test_info_id in instances:
+            raise RowError("Duplicate row for test '%s' completed %s" % (ti.unit_test_info.test.slug, session["work_completed"]))
+        instances[ti.unit_test_info_id] = ti
+
+    #----------------------------------------------------------------------
+    def import_rows(self, rows, raise_errors=False):
+        """queue all rows for import. Invalid rows are recorded in
+        self.errors as (row number, message) and skipped unless
+        raise_errors is True"""
+
+        self.line = 0
+        for row in rows:
+            self.line += 1
+            try:
+                self.add(row)
+            except RowError as e:
+                if raise_errors:
+                    raise RowError("Row %d: %s" % (self.line, e))
+                self.errors.append((self.line, unicode(e)))
+        self.flush()
+
+    #----------------------------------------------------------------------
+    def flush(self):
+        """write the pending test list instances and their test instances"""
+
+        if not self.pending:
+            return
+
+        with transaction.commit_on_success():
+            with signals.coalesce_last_instance_updates():
+                self.write(self.pending.values())
+        self.flushed.update(self.pending)
+        self.pending = collections.OrderedDict()
+
+    #----------------------------------------------------------------------
+    def write(self, sessions):
+
+        instances = []
+        for session in sessions:
+            session_instances = session["instances"].values()
+            all_reviewed = all(not ti.status.requires_review for ti in session_instances)
+
+            # saved individually (rather than bulk_create) so the primary key is set
+            tli = models.TestListInstance(
+                unit_test_collection=session["utc"], test_list_id=session["test_list_id"],
+                day=session["day"], work_started=session["work_started"],
+                work_completed=session["work_completed"], modified=session["work_completed"],
+                created_by=session["created_by"], modified_by=self.user,
+                reviewed=session["work_completed"] if all_reviewed else None,
+                reviewed_by=self.user if all_reviewed else None,
+                all_reviewed=all_reviewed,
+            )
+            tli.save()
+
+            for ti in session_instances:
+                ti.test_list_instance_id = tli.pk
+                instances.append(ti)
+
+        for chunk in chunks(instances, 500):
+            models.TestInstance.objects.bulk_create(chunk)
+        data_versions.touch_instances(instances)
+
+        self.test_list_instances += len(sessions)
+        self.test_instances += len(instances)
+
+    #----------------------------------------------------------------------
+    def finish(self):
+        """write any pending rows and recount the unreviewed test list
+        instances (the incremental counts are not reliable if a batch was
+        rolled back)"""
+
+        self.flush()
+        models.unreviewed_counter.reset()
@@ -41,11 +41,8 @@ class Command(BaseCommand):
     #----------------------------------------------------------------------
     def schedule_all(self):
         """Sets due date for all UnitTestCollections with assigned frequencies"""
-        utcs = UnitTestCollection.objects.exclude(frequency=None)
-        for utc in utcs:
-            utc.set_due_date()
-
-        self.stdout.write("Successfully set all due dates")
+        updated = UnitTestCollection.objects.set_due_dates()
+        self.stdout.write("Successfully set all due dates (%d updated)" % updated)
 
     #----------------------------------------------------------------------
     def unschedule_all(self):
@@ -0,0 +1,127 @@
+import json
+import platform
+import sys
+from optparse import make_option
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from qatrack.qa.benchmarks import data, suite
+
+
+#============================================================================
+class Command(BaseCommand):
+    """A management command to generate a synthetic dataset in a throwaway
+    test database and time the key request paths against it.  Results are
+    written as JSON so that runs can be compared with --compare.
+    """
+
+    help = 'Run performance benchmarks against a synthetic dataset'
+
+    option_list = BaseCommand.option_list + tuple(
+        make_option(
+            "--%s" % name.replace("_", "-"), type="int", dest=name, default=default,
+            help="Synthetic data: %s (default %d)" % (name.replace("_", " "), default),
+        )
+        for name, default in sorted(data.DEFAULTS.items())
+    ) + (
+        make_option(
+            "--repeat", type="int", dest="repeat", default=5,
+            help="Number of timed runs per benchmark (default 5)",
+        ),
+        make_option(
+            "--only", dest="only", default="",
+            help="Comma separated benchmarks to run (default all: %s)" % ", ".join(suite.BENCHMARKS),
+        ),
+        make_option(
+            "--output", dest="output", default=None,
+            help="Write JSON results to this file",
+        ),
+        make_option(
+            "--compare", dest="compare", default=None,
+            help="Compare results with a previous JSON results file",
+        ),
+    )
+
+    #----------------------------------------------------------------------
+    def handle(self, *args, **options):
+
+        names = [n.strip() for n in options["only"].split(",") if n.strip()]
+        unknown = set(names) - set(suite.BENCHMARKS)
+        if unknown:
+            raise CommandError("Unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+        previous = None
+        if options["compare"]:
+            try:
+                previous = json.load(open(options["compare"]))
+            except (IOError, ValueError) as e:
+                raise CommandError("Unable to read %s: %s" % (options["compare"], e))
+
+        params = dict((name, options[name]) for name in data.DEFAULTS)
+
+        setup_test_environment()
+        if "south" in settings.INSTALLED_APPS:
+            from south.management.commands import patch_for_test_db_setup
+            patch_for_test_db_setup()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            self.stdout.write("Generating synthetic data...\n")
+            dataset = data.generate(**params)
+            counts = dataset.counts()
+            self.stdout.write("%s\n" % ", ".join("%d %s" % (v, k) for k, v in sorted(counts.items())))
+
+            self.stdout.write("Running benchmarks...\n")
+            results = suite.Suite(dataset, repeat=options["repeat"]).run(names)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "meta": {
+                "timestamp": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": settings.DATABASES["default"]["ENGINE"],
+                "repeat": options["repeat"],
+            },
+            "params": params,
+            "counts": counts,
+            "results": results,
+        }
+
+        self.write_results(results)
+        if previous:
+            self.write_comparison(previous, report)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        elif not previous:
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+            self.stdout.write("\n")
+
+    #----------------------------------------------------------------------
+    def write_results(self, results):
+        self.stdout.write("\n%-20s %10s %10s %10s %8s\n" % ("benchmark", "median ms", "min ms", "max ms", "queries"))
+        for name, result in sorted(results.items()):
+            if "error" in result:
+                self.stdout.write("%-20s %s\n" % (name, result["error"]))
+            else:
+                self.stdout.write("%-20s %10.1f %10.1f %10.1f %8d\n" % (
+                    name, result["median"], result["min"], result["max"], result["queries"]
+                ))
+
+    #----------------------------------------------------------------------
+    def write_comparison(self, previous, report):
+        if previous.get("params") != report["params"]:
+            self.stdout.write("\nWARNING: synthetic data parameters differ from the previous run\n")
+
+        self.stdout.write("\n%-20s %10s %10s %8s %12s\n" % ("benchmark", "before ms", "after ms", "change", "queries"))
+        for name, before, after, change, q_before, q_after in suite.compare(previous, report):
+            self.stdout.write("%-20s %10.1f %10.1f %+7.1f%% %5d -> %-5d\n" % (name, before, after, change, q_before, q_after))
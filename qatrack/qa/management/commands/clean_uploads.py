@@ -0,0 +1,61 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from qatrack.qa import uploads
+
+
+#============================================================================
+class Command(BaseCommand):
+    """A management command to remove abandoned temporary uploads and
+    uploaded files no longer referenced by any test instance (see
+    qa.uploads).  Intended to be run periodically (e.g. from cron) with
+    --max-seconds so that each run takes a bounded amount of time.
+    """
+
+    help = 'Remove unreferenced uploaded files and optionally move old style uploads to the blob store'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--max-age", type="float", dest="max_age", default=24,
+            help="Only remove files not modified for this many hours (default 24)",
+        ),
+        make_option(
+            "--batch-size", type="int", dest="batch_size", default=500,
+            help="Number of files processed per batch (default 500)",
+        ),
+        make_option(
+            "--max-seconds", type="float", dest="max_seconds", default=None,
+            help="Stop after the first batch finishing after this many seconds (default no limit)",
+        ),
+        make_option(
+            "--migrate", action="store_true", dest="migrate", default=False,
+            help="Move uploads stored per test list instance to the blob store first",
+        ),
+        make_option(
+            "--dry-run", action="store_true", dest="dry_run", default=False,
+            help="Report what would be done without changing anything",
+        ),
+    )
+
+    #----------------------------------------------------------------------
+    def handle(self, *args, **options):
+
+        summary = uploads.collect_garbage(
+            max_age=options["max_age"] * 60 * 60,
+            batch_size=options["batch_size"],
+            max_seconds=options["max_seconds"],
+            migrate=options["migrate"],
+            dry_run=options["dry_run"],
+        )
+
+        self.stdout.write(
+            "%s%d temporary files & %d blobs removed (%.1f MB), %d uploads migrated%s\n" % (
+                "Dry run: " if options["dry_run"] else "",
+                summary.temp_removed,
+                summary.blobs_removed,
+                summary.bytes_freed / (1024. * 1024.),
+                summary.migrated,
+                "" if summary.complete else " (time limit reached, run again to continue)",
+            )
+        )
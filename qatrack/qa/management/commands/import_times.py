@@ -0,0 +1,85 @@
+import collections
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from qatrack.qa import scientific
+
+DEFAULT_MODULES = ("qatrack.urls",) + scientific.SCIENTIFIC_MODULES
+
+ImportTime = collections.namedtuple("ImportTime", "module seconds rss_kb scientific_modules")
+
+# run in a fresh interpreter so modules already imported by this process
+# don't hide the cost of importing the module being measured
+MEASURE_SCRIPT = """
+import json, resource, sys, time
+from django.conf import settings
+settings.INSTALLED_APPS
+name = sys.argv[1]
+scientific = sys.argv[2:]
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+__import__(name)
+if name.endswith("urls"):
+    from django.core.urlresolvers import get_resolver
+    get_resolver(name).url_patterns
+seconds = time.time() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+print json.dumps([seconds, rss, [m for m in scientific if m in sys.modules]])
+"""
+
+
+#----------------------------------------------------------------------
+def measure_import(name):
+    """return an ImportTime for importing module name (including all the
+    modules it imports) in a new python process with settings configured"""
+
+    env = dict(os.environ)
+    env["DJANGO_SETTINGS_MODULE"] = settings.SETTINGS_MODULE
+    env["PYTHONPATH"] = os.pathsep.join(p for p in sys.path if p)
+
+    args = [sys.executable, "-c", MEASURE_SCRIPT, name] + list(scientific.SCIENTIFIC_MODULES)
+    proc = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise ImportError("Unable to import %s: %s" % (name, err.strip().splitlines()[-1] if err.strip() else ""))
+
+    seconds, rss_kb, loaded = json.loads(out.strip().splitlines()[-1])
+    return ImportTime(name, seconds, rss_kb, loaded)
+
+
+#============================================================================
+class Command(BaseCommand):
+    """A management command to report how long importing modules (by default
+    the url configuration and the scientific python stack, see qa.scientific)
+    takes and how much memory it uses.  Each module is imported in a new
+    process.  Any scientific modules pulled in by a module are listed so
+    that e.g. an accidental top level numpy import in a view module shows
+    up as a slow qatrack.urls import.
+    """
+
+    args = "[module module ...]"
+    help = 'Report the time & memory used to import modules'
+
+    #----------------------------------------------------------------------
+    def handle(self, *args, **options):
+
+        modules = args or DEFAULT_MODULES
+
+        self.stdout.write("%-45s %10s %10s  %s\n" % ("Module", "Seconds", "RSS (MB)", "Scientific modules imported"))
+        for name in modules:
+            try:
+                result = measure_import(name)
+            except ImportError as e:
+                raise CommandError(str(e))
+
+            self.stdout.write("%-45s %10.3f %10.1f  %s\n" % (
+                result.module,
+                result.seconds,
+                result.rss_kb / 1024.,
+                ", ".join(m for m in result.scientific_modules if m != name) or "-",
+            ))
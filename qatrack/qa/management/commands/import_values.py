@@ -0,0 +1,90 @@
+import time
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from qatrack.qa import importer
+from qatrack.qa.models import TestInstanceStatus
+
+
+#============================================================================
+class Command(BaseCommand):
+    """A management command to bulk import historical test results from
+    CSV or JSON files.  See qatrack.qa.importer for the file format.
+    """
+
+    args = "<file file ...>"
+    help = 'Bulk import historical test results from CSV or JSON files'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--user", dest="user", default=None,
+            help="Username recorded as creator of the imported results (required)",
+        ),
+        make_option(
+            "--status", dest="status", default=None,
+            help="Slug of status for rows without a status (default: the default status)",
+        ),
+        make_option(
+            "--format", dest="format", default=None, choices=["csv", "json"],
+            help="File format (csv or json). Guessed from the file extension by default",
+        ),
+        make_option(
+            "--batch-size", type="int", dest="batch_size", default=1000,
+            help="Number of test list instances inserted at a time (default 1000)",
+        ),
+        make_option(
+            "--strict", action="store_true", dest="strict", default=False,
+            help="Stop at the first invalid row rather than skipping it",
+        ),
+    )
+
+    #----------------------------------------------------------------------
+    def handle(self, *args, **options):
+
+        if not args:
+            raise CommandError("Please specify one or more files to import")
+
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError("Please specify a valid username with --user")
+
+        status = None
+        if options["status"]:
+            try:
+                status = TestInstanceStatus.objects.get(slug=options["status"])
+            except TestInstanceStatus.DoesNotExist:
+                raise CommandError("Unknown status '%s'" % options["status"])
+
+        try:
+            bulk = importer.BulkImporter(user, status=status, batch_size=options["batch_size"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        start = time.time()
+        try:
+            for path in args:
+                fmt = options["format"] or ("json" if path.lower().endswith((".json", ".ndjson")) else "csv")
+                reader = importer.read_json if fmt == "json" else importer.read_csv
+                errors = len(bulk.errors)
+                with open(path, "rb") as f:
+                    bulk.import_rows(reader(f), raise_errors=options["strict"])
+                self.write_errors(path, bulk.errors[errors:])
+        except (IOError, ValueError) as e:
+            raise CommandError("%s: %s" % (path, e))
+        finally:
+            # keep bookkeeping consistent with whatever was written
+            bulk.finish()
+
+        self.stdout.write("Imported %d test list instances (%d test instances) in %.1fs. %d rows skipped\n" % (
+            bulk.test_list_instances, bulk.test_instances, time.time() - start, len(bulk.errors),
+        ))
+
+    #----------------------------------------------------------------------
+    def write_errors(self, path, errors, limit=50):
+        for line, message in errors[:limit]:
+            self.stderr.write("%s row %d: %s\n" % (path, line, message))
+        if len(errors) > limit:
+            self.stderr.write("%s: %d more invalid rows\n" % (path, len(errors) - limit))
@@ -0,0 +1,50 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from qatrack.qa import models, thumbnails, uploads
+
+
+#============================================================================
+class Command(BaseCommand):
+    """A management command to generate thumbnails for uploaded images which
+    don't have one yet (e.g. uploaded before thumbnails were introduced or
+    still queued when a web process was restarted, see qa.thumbnails).
+    Files in formats that can't be decoded (see thumbnails.can_thumbnail)
+    are skipped.  Uploads stored per test list instance must first be
+    moved to the blob store with clean_uploads --migrate.
+    """
+
+    help = 'Generate missing thumbnails of uploaded images'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--force", action="store_true", dest="force", default=False,
+            help="Regenerate existing thumbnails too",
+        ),
+    )
+
+    #----------------------------------------------------------------------
+    def handle(self, *args, **options):
+
+        references = models.TestInstance.objects.filter(
+            unit_test_info__test__type=models.UPLOAD,
+            unit_test_info__test__display_image=True,
+            string_value__startswith=uploads.REFERENCE_PREFIX,
+        ).values_list("string_value", flat=True)
+
+        created = skipped = failed = 0
+        for reference in set(references.iterator()):
+            if not options["force"] and thumbnails.has_thumbnail(reference):
+                continue
+            if not thumbnails.can_thumbnail(reference):
+                skipped += 1
+                continue
+            try:
+                thumbnails.make_thumbnail(reference)
+                created += 1
+            except IOError as e:
+                self.stderr.write("%s\n" % e)
+                failed += 1
+
+        self.stdout.write("%d thumbnails created, %d unsupported files skipped, %d failed\n" % (created, skipped, failed))
@@ -0,0 +1,90 @@
+from optparse import make_option
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+
+from qatrack.qa import models, paper
+from qatrack.units.models import Unit
+
+
+#----------------------------------------------------------------------
+def pk_list(value):
+    return [int(pk) for pk in value.split(",") if pk.strip()] if value else None
+
+
+#============================================================================
+class Command(BaseCommand):
+    """A management command to pre-generate paper based backup forms as a
+    zip file containing one html file per unit (e.g. before a planned
+    outage).  By default all units, categories & groups and all frequencies
+    with a due interval of a week or less are included (the same defaults
+    as the paper backup form page).
+    """
+
+    args = "<output.zip>"
+    help = 'Write paper based backup forms for each unit to a zip file'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--units", dest="units", default="",
+            help="Comma separated unit numbers (default all)",
+        ),
+        make_option(
+            "--frequencies", dest="frequencies", default="",
+            help="Comma separated frequency pks (default due interval <= 7 days)",
+        ),
+        make_option(
+            "--categories", dest="categories", default="",
+            help="Comma separated category pks (default all)",
+        ),
+        make_option(
+            "--assigned-to", dest="assigned_to", default="",
+            help="Comma separated group pks (default all)",
+        ),
+        make_option(
+            "--no-refs", action="store_false", dest="include_refs", default=True,
+            help="Don't include references & tolerances",
+        ),
+        make_option(
+            "--include-inactive", action="store_true", dest="include_inactive", default=False,
+            help="Include inactive test lists",
+        ),
+    )
+
+    #----------------------------------------------------------------------
+    def handle(self, *args, **options):
+
+        if len(args) != 1:
+            raise CommandError("Usage: paper_forms %s" % self.args)
+
+        try:
+            units = pk_list(options["units"])
+            frequencies = pk_list(options["frequencies"])
+            categories = pk_list(options["categories"])
+            assigned_to = pk_list(options["assigned_to"])
+        except ValueError as e:
+            raise CommandError("Invalid option: %s" % e)
+
+        if units is None:
+            units = Unit.objects.values_list("pk", flat=True)
+        else:
+            units = Unit.objects.filter(number__in=units).values_list("pk", flat=True)
+
+        if frequencies is None:
+            frequencies = models.Frequency.objects.filter(due_interval__lte=7).values_list("pk", flat=True)
+
+        if categories is None:
+            categories = models.Category.objects.values_list("pk", flat=True)
+
+        if assigned_to is None:
+            assigned_to = Group.objects.values_list("pk", flat=True)
+
+        utcs = paper.unit_test_collections(units, frequencies, assigned_to, include_inactive=options["include_inactive"])
+        documents = paper.paper_documents(utcs, list(categories))
+
+        try:
+            paper.write_zip(documents, args[0], include_refs=options["include_refs"])
+        except IOError as e:
+            raise CommandError("Unable to write %s: %s" % (args[0], e))
+
+        self.stdout.write("Wrote paper forms for %d units to %s\n" % (len(documents), args[0]))
@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.db import models
-from django.db.models import Q
+from django.db.models import Q, Max
 from django.contrib.auth.models import User, Group
 from django.utils.translation import ugettext as _
 from django.core import urlresolvers
@@ -10,6 +10,7 @@ from django.contrib.contenttypes import generic
 from django.utils import timezone
 
 
+from qatrack.cache.counters import CachedCounter
 from qatrack.units.models import Unit
 from qatrack.qa import utils
 
@@ -737,6 +738,12 @@ class TestCollectionInterface(models.Model):
     def first(self):
         return self
 
+    #----------------------------------------------------------------------
+    def compiled(self):
+        """return cached structure of this collection (see qa.plans)"""
+        from qatrack.qa.plans import compile_collection
+        return compile_collection(self)
+
     #----------------------------------------------------------------------
     def all_tests(self):
         """returns all tests from this list and sublists"""
@@ -818,6 +825,77 @@ class UnitTestListManager(models.Manager):
     def by_visibility(self, groups):
         return self.get_query_set().filter(visible_to__in=groups)
 
+    #----------------------------------------------------------------------
+    def last_valid_completions(self, utcs=None):
+        """return dict of form {utc_pk: work_completed} for the last
+        valid (complete with no invalid tests) TestListInstance of each UTC.
+        Uses a single grouped query rather than one latest() per UTC"""
+
+        tlis = TestListInstance.objects.filter(
+            in_progress=False
+        ).exclude(
+            testinstance__status__valid=False
+        )
+
+        if utcs is None:
+            return dict(tlis.values_list("unit_test_collection").annotate(Max("work_completed")))
+
+        last = {}
+        for pks in utils.chunks([getattr(u, "pk", u) for u in utcs], 500):
+            chunk = tlis.filter(unit_test_collection__in=pks)
+            last.update(chunk.values_list("unit_test_collection").annotate(Max("work_completed")))
+        return last
+
+    #----------------------------------------------------------------------
+    def calc_due_dates(self, utcs, last_valid=None):
+        """return dict of form {utc_pk: due_date} for input utcs.  Due dates
+        are calculated the same way as UnitTestCollection.calc_due_date but
+        using a constant number of queries.  utcs should have their
+        frequency preselected to avoid a query per utc"""
+
+        if last_valid is None:
+            last_valid = self.last_valid_completions(utcs)
+
+        now = timezone.now()
+        due_dates = {}
+        for utc in utcs:
+            due_date = utc.due_date
+            if utc.auto_schedule and utc.frequency_id is not None:
+                completed = last_valid.get(utc.pk)
+                if completed is not None:
+                    due_date = completed + utc.frequency.due_delta()
+                elif utc.last_instance_id is not None:
+                    # Done before but no valid lists
+                    due_date = now
+            due_dates[utc.pk] = due_date
+
+        return due_dates
+
+    #----------------------------------------------------------------------
+    def set_due_dates(self, utcs=None):
+        """Recalculate and set due dates for all auto scheduled utcs (or only
+        the input utcs) using batched updates. As with set_due_date
+        no signals are sent. Returns number of UTCs updated."""
+
+        if utcs is None:
+            utcs = self.get_query_set().filter(
+                auto_schedule=True
+            ).exclude(
+                frequency=None
+            ).select_related("frequency")
+
+        utcs = list(utcs)
+        due_dates = self.calc_due_dates(utcs)
+
+        changed = {}
+        for utc in utcs:
+            due_date = due_dates[utc.pk]
+            if due_date is not None and due_date != utc.due_date:
+                utc.due_date = due_date
+                changed[utc.pk] = (due_date,)
+
+        return utils.bulk_case_update(UnitTestCollection, ["due_date"], changed)
+
 
 #============================================================================
 class UnitTestCollection(models.Model):
@@ -847,6 +925,12 @@ class UnitTestCollection(models.Model):
         verbose_name_plural = _("Assign Test Lists to Units")
         # ordering = ("testlist__name","testlistcycle__name",)
 
+    #----------------------------------------------------------------------
+    def __init__(self, *args, **kwargs):
+        super(UnitTestCollection, self).__init__(*args, **kwargs)
+        # unit & group as currently reflected in unreviewed_counter breakdowns
+        self._counted_breakdown = (self.unit_id, self.assigned_to_id) if self.pk else None
+
     #----------------------------------------------------------------------
     def calc_due_date(self):
         """return the next due date of this Unit/TestList pair """
@@ -926,7 +1010,8 @@ class UnitTestCollection(models.Model):
         )
 
     #---------------------------------------------------------------------------
-    def history(self, before=None):
+    def history(self, before=None, tests=None):
+        """return history of tests (default all tests of tests_object)"""
 
         before = before or timezone.now()
 
@@ -949,13 +1034,20 @@ class UnitTestCollection(models.Model):
 
         dates = tlis.values_list("work_completed", flat=True)
 
-        instances = []
-        for test in self.tests_object.ordered_tests():
-            test_history = []
-            for tli in tlis:
-                match = [x for x in tli.testinstance_set.all() if x.unit_test_info.test == test]
-                test_history.append(match[0] if match else None)
+        if tests is None:
+            tests = self.tests_object.ordered_tests()
 
+        # test instances of each test list instance keyed by test
+        tli_tests = []
+        for tli in tlis:
+            tis = {}
+            for ti in tli.testinstance_set.all():
+                tis.setdefault(ti.unit_test_info.test_id, ti)
+            tli_tests.append(tis)
+
+        instances = []
+        for test in tests:
+            test_history = [tis.get(test.pk) for tis in tli_tests]
             instances.append((test, test_history))
 
         return instances, dates
@@ -995,21 +1087,11 @@ class UnitTestCollection(models.Model):
 
     #----------------------------------------------------------------------
     def copy_references(self, dest_unit):
+        """copy references & tolerances for all tests of this collection
+        to dest_unit (see references.copy_references)"""
 
-        all_tests = self.tests_object.all_tests()
-        source_unit_test_infos = UnitTestInfo.objects.filter(
-            test__in=all_tests, unit=self.unit
-        ).select_related(
-            "reference", "tolerance"
-        )
-
-        for source_uti in source_unit_test_infos:
-            UnitTestInfo.objects.filter(
-                test=source_uti.test, unit=dest_unit
-            ).update(
-                reference=source_uti.reference,
-                tolerance=source_uti.tolerance
-            )
+        from qatrack.qa.references import copy_references
+        return copy_references(self.unit, dest_unit, self.tests_object.all_tests())
 
     #----------------------------------------------------------------------
     def __unicode__(self):
@@ -1223,15 +1305,34 @@ class TestInstance(models.Model):
     def upload_url(self):
         if not self.unit_test_info.test.is_upload():
             return None
-        url = "%s%d/%s" % (settings.UPLOADS_URL, self.test_list_instance.pk, self.string_value)
-        return '<a href="%s" title="%s">%s</a>' % (url, self.string_value, self.string_value)
+        url, name = self.upload_location()
+        return '<a href="%s" title="%s">%s</a>' % (url, name, name)
 
     #----------------------------------------------------------------------
     def image_url(self):
         if not self.unit_test_info.test.is_upload() or not self.unit_test_info.test.display_image:
             return None
-        url = "%s%d/%s" % (settings.UPLOADS_URL, self.test_list_instance.pk, self.string_value)
-        return url
+        return self.upload_location()[0]
+
+    #----------------------------------------------------------------------
+    def thumbnail_url(self):
+        """url of thumbnail of uploaded image (None if no thumbnail exists)"""
+
+        from qatrack.qa import thumbnails, uploads
+        if self.image_url() and uploads.is_reference(self.string_value) and thumbnails.has_thumbnail(self.string_value):
+            return uploads.thumbnail_url(self.string_value)
+        return None
+
+    #----------------------------------------------------------------------
+    def upload_location(self):
+        """return (url, original file name) of uploaded file"""
+
+        from qatrack.qa import uploads
+        if uploads.is_reference(self.string_value):
+            return uploads.blob_url(self.string_value), uploads.parse_reference(self.string_value)[1]
+
+        # stored per test list instance before the blob store was introduced
+        return "%s%d/%s" % (settings.UPLOADS_URL, self.test_list_instance.pk, self.string_value), self.string_value
 
     #----------------------------------------------------------------------
     def __unicode__(self):
@@ -1247,8 +1348,18 @@ class TestListInstanceManager(models.Manager):
         return self.complete().filter(all_reviewed=False)
 
     #----------------------------------------------------------------------
-    def unreviewed_count(self):
-        return self.unreviewed().count()
+    def unreviewed_count(self, unit=None, group=None):
+        """return number of unreviewed instances, optionally only those
+        for a given unit and/or assigned group (pk's or objects).
+        Note: unreviewed_counter should be used instead where a
+        cached count is acceptable"""
+
+        qs = self.unreviewed()
+        if unit is not None:
+            qs = qs.filter(unit_test_collection__unit=unit)
+        if group is not None:
+            qs = qs.filter(unit_test_collection__assigned_to=group)
+        return qs.count()
 
     #----------------------------------------------------------------------
     def in_progress(self):
@@ -1303,6 +1414,35 @@ class TestListInstance(models.Model):
             ("can_view_completed", "Can view previously completed instances"),
         )
 
+    #----------------------------------------------------------------------
+    def __init__(self, *args, **kwargs):
+        super(TestListInstance, self).__init__(*args, **kwargs)
+        # review state as currently reflected in unreviewed_counter
+        self._counted_unreviewed = self.pk is not None and self.is_unreviewed()
+
+    #----------------------------------------------------------------------
+    def is_unreviewed(self):
+        return not self.in_progress and not self.all_reviewed
+
+    #----------------------------------------------------------------------
+    def update_unreviewed_counts(self, deleted=False):
+        """adjust unreviewed_counter if the review state of this instance
+        has changed since it was loaded (or last counted)"""
+
+        unreviewed = not deleted and self.is_unreviewed()
+        if unreviewed == self._counted_unreviewed:
+            return
+
+        try:
+            utc = self.unit_test_collection
+        except UnitTestCollection.DoesNotExist:
+            # deletion cascading from UnitTestCollection. breakdowns unknown
+            unreviewed_counter.reset()
+        else:
+            unreviewed_counter.adjust(1 if unreviewed else -1, unit=utc.unit_id, group=utc.assigned_to_id)
+
+        self._counted_unreviewed = unreviewed
+
     #----------------------------------------------------------------------
     def pass_fail_status(self):
         """return string with pass fail status of this qa instance"""
@@ -1335,6 +1475,7 @@ class TestListInstance(models.Model):
 
         # use update instead of save so we don't trigger save signal
         TestListInstance.objects.filter(pk=self.pk).update(all_reviewed=self.all_reviewed)
+        self.update_unreviewed_counts()
 
     #----------------------------------------------------------------------
     def tolerance_tests(self):
@@ -1403,6 +1544,17 @@ class TestListInstance(models.Model):
         return "TestListInstance(pk=%s)" % self.pk
 
 
+# incrementally maintained count of unreviewed TestListInstances with
+# breakdowns by unit & assigned group (pk's) e.g.
+#   unreviewed_counter.get()
+#   unreviewed_counter.get("unit", unit.pk)
+#   unreviewed_counter.get_many("group", [g.pk for g in groups])
+unreviewed_counter = CachedCounter(
+    settings.CACHE_UNREVIEWED_COUNT,
+    lambda **kwargs: TestListInstance.objects.unreviewed_count(**kwargs),
+)
+
+
 #============================================================================
 class TestListCycle(TestCollectionInterface):
     """
@@ -1416,7 +1568,7 @@ class TestListCycle(TestCollectionInterface):
     def __len__(self):
         """return the number of test_lists"""
         if self.pk:
-            return self.test_lists.count()
+            return len(self.compiled().days)
         else:
             return 0
 
@@ -1428,10 +1580,8 @@ class TestListCycle(TestCollectionInterface):
     #----------------------------------------------------------------------
     def first(self):
         """return first in order membership obect for this cycle"""
-        try:
-            return self.testlistcyclemembership_set.all()[0].test_list
-        except IndexError:
-            return None
+        days = self.compiled().days
+        return days[0][1] if days else None
 
     #----------------------------------------------------------------------
     def all_lists(self):
@@ -1455,23 +1605,22 @@ class TestListCycle(TestCollectionInterface):
     #----------------------------------------------------------------------
     def get_list(self, day=0):
         """get actual day and test list for given input day"""
-        try:
-            membership = self.testlistcyclemembership_set.get(order=day)
-            return day, membership.test_list
-        except TestListCycleMembership.DoesNotExist:
+        test_list = self.compiled().lists.get(day)
+        if test_list is None:
             return None, None
+        return day, test_list
 
     #----------------------------------------------------------------------
     def next_list(self, day):
         """return day and test list following input day in cycle order"""
 
-        try:
-            return day + 1, self.testlistcyclemembership_set.get(order=day + 1).test_list
-        except (TypeError, TestListCycleMembership.DoesNotExist):
-            first = self.first()
-            if not first:
-                return None, None
-            return 0, self.first()
+        if day is not None and day + 1 in self.compiled().lists:
+            return day + 1, self.compiled().lists[day + 1]
+
+        first = self.first()
+        if not first:
+            return None, None
+        return 0, first
 
     #----------------------------------------------------------------------
     def __unicode__(self):
@@ -0,0 +1,139 @@
+"""
+Paper based backup forms.
+
+Builds one PaperDocument per unit containing a PaperForm (test list name
+and the UnitTestInfos to be filled in) for each test list assigned to the
+unit.  Test list structures come from the compiled (cached) collections
+(see plans) and all the UnitTestInfos required are fetched with a single
+query so the number of queries doesn't depend on the number of units or
+test lists:
+
+    documents = paper_documents(unit_test_collections, categories)
+
+Documents can be rendered one at a time (see render_document) or written
+to a zip file of per unit html files for offline use (see write_zip and
+the paper_forms management command).
+"""
+
+import zipfile
+
+from django.template import Context
+from django.template.defaultfilters import slugify
+from django.template.loader import get_template
+
+import models
+from plans import compile_collection
+
+# tests that can't be performed on paper are excluded
+PAPER_TEST_TYPES = (models.BOOLEAN, models.SIMPLE, models.MULTIPLE_CHOICE, models.STRING)
+
+
+#============================================================================
+class PaperForm(object):
+    """a single test list to be filled in for a unit"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, test_list, utis):
+        self.test_list = test_list
+        self.name = test_list.name
+        self.utis = utis
+
+
+#============================================================================
+class PaperDocument(object):
+    """all the paper forms for a single unit"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, unit):
+        self.unit = unit
+        self.forms = []
+
+    #----------------------------------------------------------------------
+    @property
+    def filename(self):
+        return "%s-%s.html" % (self.unit.number, slugify(self.unit.name))
+
+
+#----------------------------------------------------------------------
+def unit_test_collections(units, frequencies, assigned_to, include_inactive=False):
+    """return UnitTestCollections to create paper forms for"""
+
+    utcs = models.UnitTestCollection.objects.filter(
+        unit__pk__in=units,
+        frequency__pk__in=frequencies,
+        assigned_to__pk__in=assigned_to,
+    )
+
+    if not include_inactive:
+        utcs = utcs.filter(active=True)
+
+    return utcs.select_related("unit").prefetch_related("tests_object").order_by("unit__number", "pk")
+
+
+#----------------------------------------------------------------------
+def collection_lists(collection):
+    """return list of (test_list, ordered tests) for each test list of collection"""
+
+    if isinstance(collection, models.TestListCycle):
+        test_lists = [test_list for day, test_list in compile_collection(collection).days]
+    else:
+        test_lists = [collection]
+
+    return [(test_list, compile_collection(test_list).tests) for test_list in test_lists]
+
+
+#----------------------------------------------------------------------
+def paper_documents(unit_test_collections, categories):
+    """return a PaperDocument (in order of first appearance) for each unit
+    of unit_test_collections (with tests_object prefetched) including
+    tests from the input categories (pks) only"""
+
+    unit_test_collections = list(unit_test_collections)
+
+    structures = {}
+    for utc in unit_test_collections:
+        key = (utc.content_type_id, utc.object_id)
+        if key not in structures:
+            structures[key] = collection_lists(utc.tests_object)
+
+    utis = models.UnitTestInfo.objects.filter(
+        unit__in=set(utc.unit_id for utc in unit_test_collections),
+        test__type__in=PAPER_TEST_TYPES,
+        test__category__pk__in=categories,
+    ).select_related("test", "reference", "tolerance")
+    utis = dict(((uti.unit_id, uti.test_id), uti) for uti in utis)
+
+    documents = []
+    by_unit = {}
+    for utc in unit_test_collections:
+        if utc.unit_id not in by_unit:
+            by_unit[utc.unit_id] = PaperDocument(utc.unit)
+            documents.append(by_unit[utc.unit_id])
+
+        for test_list, tests in structures[(utc.content_type_id, utc.object_id)]:
+            list_utis = [utis[(utc.unit_id, t.pk)] for t in tests if (utc.unit_id, t.pk) in utis]
+            by_unit[utc.unit_id].forms.append(PaperForm(test_list, list_utis))
+
+    return documents
+
+
+#----------------------------------------------------------------------
+def render_document(document, include_refs=True):
+    """render a document as a standalone html page"""
+
+    template = get_template("qa/paper_forms_document.html")
+    return template.render(Context({"document": document, "include_refs": include_refs}))
+
+
+#----------------------------------------------------------------------
+def write_zip(documents, fileobj, include_refs=True):
+    """write a zip file containing an html file per document to fileobj
+    (a path or file like object).  Each document is rendered and written
+    before the next is rendered."""
+
+    archive = zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED)
+    try:
+        for document in documents:
+            archive.writestr(document.filename, render_document(document, include_refs).encode("utf-8"))
+    finally:
+        archive.close()
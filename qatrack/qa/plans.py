@@ -0,0 +1,148 @@
+"""
+Execution plans for performing test lists.
+
+The structure of a TestList (its tests & sublists flattened in order) or
+a TestListCycle (its test lists in day order) only changes when lists are
+edited but is needed every time a list is performed.  The compiled
+structure is cached, versioned by a generation that is bumped by the
+TestList/membership/cycle save & delete signals (see qa.signals):
+
+    compiled = compile_collection(test_list)
+
+An ExecutionPlan combines the compiled structure of a TestList with the
+UnitTestInfo (with reference, tolerance & category) of each of its tests
+for a unit so that a list can be performed with a single UnitTestInfo
+query regardless of the number of tests or sublists.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.forms.models import model_to_dict
+
+from qatrack.cache.versioning import bump, versioned_key
+from qatrack.qa import models
+
+STRUCTURE_GENERATION = settings.CACHE_TEST_LIST_STRUCTURE
+
+
+#============================================================================
+class CompiledTestList(object):
+    """Ordered tests of a TestList and its sublists"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, test_list):
+
+        self.pk = test_list.pk
+
+        sublists = list(test_list.sublists.values_list("pk", flat=True))
+        self.list_ids = [test_list.pk] + [pk for pk in sublists if pk != test_list.pk]
+
+        memberships = models.TestListMembership.objects.filter(
+            test_list__in=self.list_ids,
+        ).select_related("test__category").order_by("order", "pk")
+
+        by_list = dict((pk, []) for pk in self.list_ids)
+        for membership in memberships:
+            by_list[membership.test_list_id].append(membership.test)
+
+        # tests of the main list followed by tests of each sublist
+        self.tests = []
+        for pk in self.list_ids:
+            self.tests.extend(by_list[pk])
+
+        # serialized test metadata for the perform page
+        self.test_data = dict((test.pk, model_to_dict(test)) for test in self.tests)
+
+
+#============================================================================
+class CompiledCycle(object):
+    """Test lists of a TestListCycle in day order"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, cycle):
+
+        self.pk = cycle.pk
+
+        # filtering by the cycle instance would call TestListCycle.__len__
+        memberships = models.TestListCycleMembership.objects.filter(
+            cycle=cycle.pk,
+        ).select_related("test_list").order_by("order")
+
+        self.days = [(m.order, m.test_list) for m in memberships]
+        self.lists = dict(self.days)
+
+
+#----------------------------------------------------------------------
+def compile_collection(collection):
+    """return cached CompiledTestList or CompiledCycle for collection"""
+
+    compiler = CompiledCycle if isinstance(collection, models.TestListCycle) else CompiledTestList
+    key = "%s:%s:%s" % (STRUCTURE_GENERATION, compiler.__name__, collection.pk)
+    key = versioned_key(key, STRUCTURE_GENERATION)
+
+    compiled = cache.get(key)
+    if compiled is None:
+        compiled = compiler(collection)
+        cache.set(key, compiled)
+    return compiled
+
+
+#----------------------------------------------------------------------
+def invalidate():
+    """invalidate all compiled test list & cycle structures"""
+    bump(STRUCTURE_GENERATION)
+
+
+#============================================================================
+class ExecutionPlan(object):
+    """Ordered tests and UnitTestInfos for performing test_list on unit"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, unit, test_list):
+
+        self.unit_id = getattr(unit, "pk", unit)
+        self.test_list_id = test_list.pk
+
+        self.compiled = compile_collection(test_list)
+        self.tests = self.compiled.tests
+
+        self.set_unit_test_infos()
+
+    #----------------------------------------------------------------------
+    def set_unit_test_infos(self):
+        """UnitTestInfos keyed by test id and in test order"""
+
+        utis = models.UnitTestInfo.objects.filter(
+            unit=self.unit_id,
+            test__in=set(t.pk for t in self.tests),
+            active=True,
+        ).select_related("reference", "tolerance", "unit")
+
+        tests = dict((t.pk, t) for t in self.tests)
+        self.utis = {}
+        for uti in utis:
+            # share already loaded test & category
+            uti.test = tests[uti.test_id]
+            self.utis[uti.test_id] = uti
+
+        self.unit_test_infos = [self.utis[t.pk] for t in self.tests if t.pk in self.utis]
+        self.missing = [t for t in self.tests if t.pk not in self.utis]
+
+    #----------------------------------------------------------------------
+    @property
+    def categories(self):
+        return set(uti.test.category for uti in self.unit_test_infos)
+
+    #----------------------------------------------------------------------
+    def template_unit_test_infos(self):
+        """UnitTestInfos as dicts for rendering in the perform template"""
+
+        template_utis = []
+        for uti in self.unit_test_infos:
+            template_utis.append({
+                "id": uti.pk,
+                "test": self.compiled.test_data[uti.test_id],
+                "reference": model_to_dict(uti.reference) if uti.reference else None,
+                "tolerance": model_to_dict(uti.tolerance) if uti.tolerance else None,
+            })
+        return template_utis
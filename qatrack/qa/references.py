@@ -0,0 +1,137 @@
+"""
+Bulk assignment of References & Tolerances to UnitTestInfos.
+
+Setting references for many UnitTestInfos (e.g. when commissioning a new
+unit) one at a time requires a Reference lookup/insert and a save per
+UnitTestInfo.  The functions here instead:
+
+    1. look up existing References for all the distinct (value, type)
+       pairs required with a single query (the oldest Reference is reused
+       when there are duplicates)
+    2. create the missing References with a single bulk_create
+    3. apply the UnitTestInfo changes with CASE based bulk updates
+       (see utils.bulk_case_update)
+
+and return an AssignmentSummary of what was done:
+
+    summary = set_references_and_tolerances(utis, "1.0", tolerance, user)
+
+Note: no pre_save/post_save signals are sent for the updated UnitTestInfos.
+"""
+
+import collections
+
+import models
+import utils
+
+AssignmentSummary = collections.namedtuple("AssignmentSummary", "updated references_created references_reused")
+
+
+#----------------------------------------------------------------------
+def reference_type(test):
+    return models.BOOLEAN if test.type == models.BOOLEAN else models.NUMERICAL
+
+
+#----------------------------------------------------------------------
+def get_or_create_references(required, user):
+    """required is a dict of form {(value, type): name} where name is used
+    for any new Reference.  Returns ({(value, type): reference_pk}, number created)"""
+
+    if not required:
+        return {}, 0
+
+    def existing():
+        refs = models.Reference.objects.filter(
+            value__in=set(value for value, _ in required),
+        ).order_by("-pk").values_list("value", "type", "pk")
+        # oldest reference wins when there are duplicates
+        return dict(((value, ref_type), pk) for value, ref_type, pk in refs if (value, ref_type) in required)
+
+    found = existing()
+    missing = sorted(set(required) - set(found))
+    if not missing:
+        return found, 0
+
+    models.Reference.objects.bulk_create([
+        models.Reference(
+            value=value,
+            type=ref_type,
+            name=required[(value, ref_type)][:255],
+            created_by=user,
+            modified_by=user,
+        ) for value, ref_type in missing
+    ])
+
+    # bulk_create doesn't set the pk's of the new references (Django 1.4)
+    return existing(), len(missing)
+
+
+#----------------------------------------------------------------------
+def assign(changes, user):
+    """changes is a dict of form {uti: (reference, tolerance_pk)} where
+    reference is None (no reference), a (value, type) pair or a Reference
+    pk (to keep/copy an existing reference).  Returns an AssignmentSummary."""
+
+    required = {}
+    for uti, (reference, tolerance) in sorted(changes.items(), key=lambda c: c[0].pk):
+        if isinstance(reference, tuple):
+            required.setdefault(reference, "%s %s" % (uti.unit.name, uti.test.name))
+
+    ref_pks, created = get_or_create_references(required, user)
+
+    values = {}
+    for uti, (reference, tolerance) in changes.items():
+        ref_pk = ref_pks[reference] if isinstance(reference, tuple) else reference
+        values[uti.pk] = (ref_pk, tolerance)
+
+    updated = utils.bulk_case_update(models.UnitTestInfo, ["reference", "tolerance"], values)
+
+    return AssignmentSummary(updated, created, len(required) - created)
+
+
+#----------------------------------------------------------------------
+def set_references_and_tolerances(utis, reference, tolerance, user):
+    """Set the same reference value (None or "" to clear) and tolerance on
+    all utis (with test, unit & reference loaded).  Multiple choice tests
+    keep their current reference and boolean references are 0 or 1."""
+
+    tolerance = getattr(tolerance, "pk", tolerance)
+
+    changes = {}
+    for uti in utis:
+        ref = uti.reference_id
+        if uti.test.type != models.MULTIPLE_CHOICE:
+            value = reference
+            if uti.test.type == models.BOOLEAN:
+                value = 1 if reference in ("True", 1, True) else 0
+
+            if value in ("", None):
+                ref = None
+            elif not (uti.reference and uti.reference.value == float(value)):
+                ref = (float(value), reference_type(uti.test))
+
+        changes[uti] = (ref, tolerance)
+
+    return assign(changes, user)
+
+
+#----------------------------------------------------------------------
+def copy_references(source_unit, dest_unit, tests):
+    """copy the reference & tolerance of each of tests (a queryset or pk's)
+    from source_unit to dest_unit for UnitTestInfos existing on both units"""
+
+    source = dict(
+        (test, (reference, tolerance)) for test, reference, tolerance in
+        models.UnitTestInfo.objects.filter(
+            unit=source_unit, test__in=tests,
+        ).values_list("test", "reference", "tolerance")
+    )
+
+    dest = models.UnitTestInfo.objects.filter(
+        unit=dest_unit, test__in=list(source),
+    ).values_list("pk", "test")
+
+    values = dict((pk, source[test]) for pk, test in dest)
+    updated = utils.bulk_case_update(models.UnitTestInfo, ["reference", "tolerance"], values)
+
+    return AssignmentSummary(updated, 0, len(set(ref for ref, tol in values.values() if ref)))
@@ -0,0 +1,58 @@
+"""
+Lazy access to the scientific python stack.
+
+numpy, scipy & matplotlib take a significant amount of time & memory to
+import but are only needed to run calculation procedures and draw control
+charts.  Rather than importing them when urls are loaded (i.e. in every
+web process and management command) they are imported on first use:
+
+    context = calculation_context()
+
+Processes which will run calculations can import them up front by setting
+PRELOAD_SCIENTIFIC_MODULES = True (see qatrack/wsgi.py).  The import_times
+management command reports the cost of importing these modules.
+"""
+
+import importlib
+import math
+
+# modules preloaded by preload() (submodules used by control charts included)
+SCIENTIFIC_MODULES = (
+    "numpy",
+    "scipy",
+    "scipy.optimize",
+    "scipy.special",
+    "matplotlib",
+    "matplotlib.figure",
+    "matplotlib.backends.backend_agg",
+    "qatrack.qa.control_chart.control_chart",
+)
+
+_calculation_context = None
+
+
+#----------------------------------------------------------------------
+def calculation_context():
+    """modules available to calculation procedures by default"""
+
+    global _calculation_context
+
+    if _calculation_context is None:
+        import numpy
+        import scipy
+        _calculation_context = {
+            "math": math,
+            "scipy": scipy,
+            "numpy": numpy,
+        }
+
+    return _calculation_context
+
+
+#----------------------------------------------------------------------
+def preload():
+    """import all of the scientific modules now rather than on first use"""
+
+    for name in SCIENTIFIC_MODULES:
+        importlib.import_module(name)
+    calculation_context()
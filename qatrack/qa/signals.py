@@ -1,10 +1,19 @@
+import collections
+import contextlib
+import functools
+import threading
+
 from django.dispatch import receiver, Signal
-from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models import Q, Max
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 
 from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.models import ContentType
 
+import data_versions
 import models
+import plans
+import utils
 
 
 #============================================================================
@@ -14,65 +23,183 @@ def loaded_from_fixture(kwargs):
 
 testlist_complete = Signal(providing_args=["instance", "created"])
 
+# per thread set of UnitTestCollections awaiting last_instance/due date updates
+_pending_updates = threading.local()
+
 
 #----------------------------------------------------------------------
 def update_last_instances(test_list_instance):
+    """Update last_instance & due_date of all UnitTestCollections affected
+    by test_list_instance being saved or deleted.  If called within a
+    coalesce_last_instance_updates block the update is deferred until
+    the end of the block."""
+
     try:
-        last_instance = models.TestListInstance.objects.complete().filter(
-            unit_test_collection=test_list_instance.unit_test_collection
-        ).latest("work_completed")
-    except models.TestListInstance.DoesNotExist:
-        last_instance = None
+        unit_id = test_list_instance.unit_test_collection.unit_id
     except models.UnitTestCollection.DoesNotExist:
         # this will occur when a UnitTestCollection deletion cascades and
         # deletes all test_list_instances associated with it.
         # in that case it doesn't make sense to try to update anything
         return
 
-    cycle_ids = models.TestListCycle.objects.filter(
-        test_lists=test_list_instance.test_list
-    ).values_list("pk", flat=True)
-    cycle_ct = ContentType.objects.get_for_model(models.TestListCycle)
+    dirty = (test_list_instance.unit_test_collection_id, unit_id, test_list_instance.test_list_id)
 
-    test_list_ids = [test_list_instance.test_list.pk]
-    list_ct = ContentType.objects.get_for_model(models.TestList)
+    pending = getattr(_pending_updates, "dirty", None)
+    if pending is not None:
+        pending.add(dirty)
+    else:
+        update_last_instances_bulk([dirty])
 
-    to_update = [(cycle_ct, cycle_ids), (list_ct, test_list_ids)]
 
-    for ct, object_ids in to_update:
+#----------------------------------------------------------------------
+def last_complete_instances(utc_ids):
+    """return dict of form {utc_pk: (work_completed, tli_pk)} for the most
+    recently completed TestListInstance of each UnitTestCollection"""
 
-        utcs = models.UnitTestCollection.objects.filter(
-            content_type=ct,
-            object_id__in=object_ids,
-            unit=test_list_instance.unit_test_collection.unit,
-        )
+    complete = models.TestListInstance.objects.complete().filter(unit_test_collection__in=utc_ids)
+    latest = dict(complete.values_list("unit_test_collection").annotate(Max("work_completed")))
+    if not latest:
+        return {}
 
-        for utc in utcs:
-            utc.last_instance = last_instance
-            due_date = utc.calc_due_date()
+    candidates = complete.filter(
+        work_completed__in=set(latest.values())
+    ).values_list("unit_test_collection", "work_completed", "pk")
 
-            # Use update here rather than just calling utc.save()
-            # since utc.save kicks off a bunch of other db queries
-            # due to the UnitTestCollection post_save signal
-            models.UnitTestCollection.objects.filter(pk=utc.pk).update(
-                due_date=due_date,
-                last_instance=last_instance,
-            )
+    last = {}
+    for utc_id, work_completed, pk in candidates:
+        if work_completed == latest[utc_id]:
+            last[utc_id] = max(last.get(utc_id), (work_completed, pk))
+    return last
 
 
 #----------------------------------------------------------------------
-def get_or_create_unit_test_info(unit, test, assigned_to=None, active=True):
+def update_last_instances_bulk(dirty):
+    """dirty is an iterable of (utc_pk, unit_pk, test_list_pk) tuples
+    for saved/deleted TestListInstances.  All UnitTestCollections on the same
+    unit that are assigned the test list (or a cycle containing it) get their
+    last_instance & due_date updated using a constant number of queries."""
+
+    dirty = set(dirty)
+    if not dirty:
+        return
+
+    last_instances = last_complete_instances(set(utc_id for utc_id, _, _ in dirty))
+
+    test_list_ids = set(tl_id for _, _, tl_id in dirty)
+    cycle_ids = collections.defaultdict(set)
+    memberships = models.TestListCycleMembership.objects.filter(test_list__in=test_list_ids)
+    for test_list_id, cycle_id in memberships.values_list("test_list", "cycle"):
+        cycle_ids[test_list_id].add(cycle_id)
+
+    cycle_ct = ContentType.objects.get_for_model(models.TestListCycle)
+    list_ct = ContentType.objects.get_for_model(models.TestList)
 
-    uti, created = models.UnitTestInfo.objects.get_or_create(
-        unit=unit,
-        test=test,
+    collections_q = Q(content_type=list_ct, object_id__in=test_list_ids)
+    all_cycle_ids = set().union(*cycle_ids.values())
+    if all_cycle_ids:
+        collections_q |= Q(content_type=cycle_ct, object_id__in=all_cycle_ids)
+
+    utcs = list(models.UnitTestCollection.objects.filter(
+        collections_q,
+        unit__in=set(unit_id for _, unit_id, _ in dirty),
+    ).select_related("frequency"))
+
+    for utc in utcs:
+        found = []
+        for utc_id, unit_id, test_list_id in dirty:
+            is_list = utc.content_type_id == list_ct.pk and utc.object_id == test_list_id
+            is_cycle = utc.content_type_id == cycle_ct.pk and utc.object_id in cycle_ids[test_list_id]
+            if utc.unit_id == unit_id and (is_list or is_cycle) and utc_id in last_instances:
+                found.append(last_instances[utc_id])
+        utc.last_instance_id = max(found)[1] if found else None
+
+    due_dates = models.UnitTestCollection.objects.calc_due_dates(utcs)
+
+    # Use a batched update here rather than just calling utc.save()
+    # since utc.save kicks off a bunch of other db queries
+    # due to the UnitTestCollection post_save signal
+    utils.bulk_case_update(
+        models.UnitTestCollection,
+        ["due_date", "last_instance"],
+        dict((utc.pk, (due_dates[utc.pk], utc.last_instance_id)) for utc in utcs),
     )
 
-    if created:
-        uti.assigned_to = assigned_to
-        uti.active = active
-        uti.save()
-    return uti
+
+#----------------------------------------------------------------------
+@contextlib.contextmanager
+def coalesce_last_instance_updates():
+    """Collect the UnitTestCollections affected by TestListInstance saves &
+    deletes within the block and update their last_instance & due_date
+    exactly once, in a single batch, when the block exits successfully.
+    Data versions of units with TestInstances saved or deleted within the
+    block are also changed once on exit.  Nested blocks are flushed by the
+    outermost one.
+
+    Note: Django 1.4 has no on_commit hook so the block should wrap the
+    whole unit of work (e.g. a views form_valid).
+    """
+
+    if getattr(_pending_updates, "dirty", None) is not None:
+        yield
+        return
+
+    _pending_updates.dirty = set()
+    _pending_updates.unit_test_infos = set()
+    try:
+        yield
+        dirty, unit_test_infos = _pending_updates.dirty, _pending_updates.unit_test_infos
+    finally:
+        _pending_updates.dirty = _pending_updates.unit_test_infos = None
+
+    update_last_instances_bulk(dirty)
+    data_versions.touch_unit_test_infos(unit_test_infos)
+
+
+#----------------------------------------------------------------------
+def coalesced_last_instance_updates(func):
+    """decorator version of coalesce_last_instance_updates"""
+
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        with coalesce_last_instance_updates():
+            return func(*args, **kwargs)
+    return wrapped
+
+
+#----------------------------------------------------------------------
+def provision_unit_test_infos(assignments, tests):
+    """Make sure there is a UnitTestInfo for every unit in assignments and
+    every test in tests.  assignments is an iterable of (unit_pk, group_pk)
+    pairs (the group the UTI is assigned to if it needs to be created) and
+    tests is an iterable (or queryset) of Tests or Test pks.  Uses one query
+    to find the existing UnitTestInfos and one insert for the missing ones
+    regardless of the number of units & tests."""
+
+    assigned_to = {}
+    for unit_id, group_id in assignments:
+        assigned_to.setdefault(unit_id, group_id)
+
+    if hasattr(tests, "values_list"):
+        test_ids = set(tests.values_list("pk", flat=True))
+    else:
+        test_ids = set(getattr(t, "pk", t) for t in tests)
+
+    if not assigned_to or not test_ids:
+        return []
+
+    existing = set(models.UnitTestInfo.objects.filter(
+        unit__in=assigned_to.keys(),
+        test__in=test_ids,
+    ).values_list("unit", "test"))
+
+    missing = sorted(set((u, t) for u in assigned_to for t in test_ids) - existing)
+
+    utis = [
+        models.UnitTestInfo(unit_id=unit_id, test_id=test_id, assigned_to_id=assigned_to[unit_id], active=True)
+        for unit_id, test_id in missing
+    ]
+    models.UnitTestInfo.objects.bulk_create(utis)
+    return utis
 
 
 #----------------------------------------------------------------------
@@ -90,22 +217,19 @@ def find_assigned_unit_test_collections(collection):
     for parent_type in parent_types:
 
         if hasattr(collection, parent_type):
-            parents = getattr(collection, parent_type).all()
-            if parents.count() > 0:
+            parents = list(getattr(collection, parent_type).all())
+            if parents:
                 ct = ContentType.objects.get_for_model(parents[0])
-                try:
-                    all_parents[ct].extend(list(parents))
-                except KeyError:
-                    all_parents[ct] = list(parents)
+                all_parents.setdefault(ct, []).extend(parents)
 
     assigned_utcs = []
     for ct, objects in all_parents.items():
         utcs = models.UnitTestCollection.objects.filter(
             object_id__in=[x.pk for x in objects],
             content_type=ct,
-        ).select_related("unit", "assigned_to")
+        ).order_by("pk")
         assigned_utcs.extend(utcs)
-    return list(set(assigned_utcs))
+    return assigned_utcs
 
 
 #----------------------------------------------------------------------
@@ -113,25 +237,11 @@ def update_unit_test_infos(collection):
     """find out which units this test_list is assigned to and make
     sure there are UnitTestInfo's for each Unit, Test pair"""
 
-    all_tests = collection.all_tests()
-
     assigned_utcs = find_assigned_unit_test_collections(collection)
-
-    for utc in assigned_utcs:
-        existing_uti_units = models.UnitTestInfo.objects.filter(
-            unit=utc.unit,
-            test__in=all_tests,
-        ).select_related("test")
-
-        existing_tests = [x.test for x in existing_uti_units]
-        missing_utis = [x for x in all_tests if x not in existing_tests]
-        for test in missing_utis:
-            get_or_create_unit_test_info(
-                unit=utc.unit,
-                test=test,
-                assigned_to=utc.assigned_to,
-                active=True
-            )
+    provision_unit_test_infos(
+        [(utc.unit_id, utc.assigned_to_id) for utc in assigned_utcs],
+        collection.all_tests(),
+    )
 
 
 @receiver(pre_save, sender=models.Test)
@@ -157,6 +267,9 @@ def on_test_list_instance_saved(*args, **kwargs):
 
     if not loaded_from_fixture(kwargs):
         update_last_instances(kwargs["instance"])
+        kwargs["instance"].update_unreviewed_counts()
+    else:
+        models.unreviewed_counter.reset()
 
 
 #----------------------------------------------------------------------
@@ -164,6 +277,24 @@ def on_test_list_instance_saved(*args, **kwargs):
 def on_test_list_instance_deleted(*args, **kwargs):
     """update last_instance if available"""
     update_last_instances(kwargs["instance"])
+    kwargs["instance"].update_unreviewed_counts(deleted=True)
+
+
+#----------------------------------------------------------------------
+@receiver(post_save, sender=models.TestInstance)
+@receiver(post_delete, sender=models.TestInstance)
+def on_test_instance_changed(*args, **kwargs):
+    """change data version of the unit (see data_versions).  Within a
+    coalesce_last_instance_updates block the units of all changed
+    instances are looked up & touched once on exit"""
+
+    uti_id = kwargs["instance"].unit_test_info_id
+
+    pending = getattr(_pending_updates, "unit_test_infos", None)
+    if pending is not None:
+        pending.add(uti_id)
+    else:
+        data_versions.touch_unit_test_infos([uti_id])
 
 
 #----------------------------------------------------------------------
@@ -173,7 +304,20 @@ def list_assigned_to_unit(*args, **kwargs):
     if not loaded_from_fixture(kwargs):
         utc = kwargs["instance"]
         tests_object = utc.content_type.get_object_for_this_type(pk=utc.object_id)
-        update_unit_test_infos(tests_object)
+        provision_unit_test_infos([(utc.unit_id, utc.assigned_to_id)], tests_object.all_tests())
+
+
+#----------------------------------------------------------------------
+@receiver(post_save, sender=models.UnitTestCollection)
+def list_reassigned(*args, **kwargs):
+    """UnitTestCollection was saved. If its unit or assigned group changed,
+    the unreviewed count breakdowns for its test list instances are stale"""
+
+    utc = kwargs["instance"]
+    breakdown = (utc.unit_id, utc.assigned_to_id)
+    if not kwargs["created"] and breakdown != utc._counted_breakdown:
+        models.unreviewed_counter.reset()
+    utc._counted_breakdown = breakdown
 
 
 #----------------------------------------------------------------------
@@ -204,3 +348,23 @@ def test_list_added_to_cycle(*args, **kwargs):
     """
     if (not loaded_from_fixture(kwargs)):
         update_unit_test_infos(kwargs["instance"].test_list)
+
+
+#----------------------------------------------------------------------
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+@receiver(post_save, sender=models.Test)
+@receiver(post_delete, sender=models.Test)
+@receiver(post_save, sender=models.TestList)
+@receiver(post_delete, sender=models.TestList)
+@receiver(post_save, sender=models.TestListMembership)
+@receiver(post_delete, sender=models.TestListMembership)
+@receiver(post_save, sender=models.TestListCycle)
+@receiver(post_delete, sender=models.TestListCycle)
+@receiver(post_save, sender=models.TestListCycleMembership)
+@receiver(post_delete, sender=models.TestListCycleMembership)
+@receiver(m2m_changed, sender=models.TestList.sublists.through)
+def test_list_structure_changed(*args, **kwargs):
+    """invalidate cached test list & cycle structures (see plans)"""
+    if not kwargs.get("action", "post_").startswith("pre_"):
+        plans.invalidate()
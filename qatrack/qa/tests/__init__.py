@@ -2,10 +2,26 @@ from qatrack.qa.tests.test_views import *  # NOQA
 from qatrack.qa.tests.test_models import *  # NOQA
 from qatrack.qa.tests.test_tags import *  # NOQA
 from qatrack.qa.tests.test_utils import *  # NOQA
+from qatrack.qa.tests.test_instrumentation import *  # NOQA
+from qatrack.qa.tests.test_benchmarks import *  # NOQA
+from qatrack.qa.tests.test_importer import *  # NOQA
+from qatrack.qa.tests.test_api import *  # NOQA
+from qatrack.qa.tests.test_plans import *  # NOQA
+from qatrack.qa.tests.test_references import *  # NOQA
+from qatrack.qa.tests.test_uploads import *  # NOQA
+from qatrack.qa.tests.test_scientific import *  # NOQA
 
 __test__ = {
     "views": ["test_views"],
     "models": ["test_models"],
     "utils": ["test_utils"],
     "tags": ["test_tags"],
+    "instrumentation": ["test_instrumentation"],
+    "benchmarks": ["test_benchmarks"],
+    "importer": ["test_importer"],
+    "api": ["test_api"],
+    "plans": ["test_plans"],
+    "references": ["test_references"],
+    "uploads": ["test_uploads"],
+    "scientific": ["test_scientific"],
 }
@@ -0,0 +1,199 @@
+import base64
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+
+from qatrack.qa import api, data_versions, models, utils as qautils
+
+import utils
+
+
+#============================================================================
+class TestValuesStream(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.user = utils.create_user()
+        self.status = utils.create_status()
+        self.unit1 = utils.create_unit(name="unit1", number=1)
+        self.unit2 = utils.create_unit(name="unit2", number=2)
+        self.test1 = utils.create_test("test1")
+        self.test2 = utils.create_test("test2")
+
+        group = utils.create_group()
+        self.utis = [
+            utils.create_unit_test_info(unit=unit, test=test, assigned_to=group)
+            for unit in (self.unit1, self.unit2) for test in (self.test1, self.test2)
+        ]
+
+        # values at the same work_completed to exercise the pk tie break
+        now = timezone.now().replace(microsecond=123456)
+        self.tis = []
+        for n in range(5):
+            for uti in self.utis:
+                ti = utils.create_test_instance(uti, value=n, work_completed=now - timezone.timedelta(days=5 - n), status=self.status)
+                self.tis.append(ti)
+
+        self.url = reverse("api_values_stream", kwargs={"api_name": "v1", "resource_name": "values"})
+        self.auth = "Basic %s" % base64.b64encode("user:password")
+        self.client.login(username="user", password="password")
+
+    #----------------------------------------------------------------------
+    def get(self, etag="", **params):
+        return self.client.get(self.url, params, HTTP_AUTHORIZATION=self.auth, HTTP_IF_NONE_MATCH=etag)
+
+    #----------------------------------------------------------------------
+    def test_cursor(self):
+
+        d = timezone.now().replace(microsecond=654321)
+        self.assertEqual(api.decode_cursor(api.encode_cursor(d, 12)), (d, 12))
+
+    #----------------------------------------------------------------------
+    def test_ndjson(self):
+
+        response = self.get()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+        rows = [json.loads(line) for line in response.content.splitlines()]
+        expected = sorted(self.tis, key=lambda ti: (ti.work_completed, ti.pk))
+        self.assertEqual([r["id"] for r in rows], [ti.pk for ti in expected])
+        self.assertEqual(rows[0]["unit"], 1)
+        self.assertEqual(rows[0]["test"], "test1")
+        self.assertEqual(rows[0]["status"], "status")
+        self.assertFalse(response.has_header("X-Next-Cursor"))
+
+    #----------------------------------------------------------------------
+    def test_pages(self):
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 3, "unit": 2}
+            if cursor:
+                params["after"] = cursor
+            response = self.get(**params)
+            seen.extend(json.loads(line)["id"] for line in response.content.splitlines())
+            cursor = response.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        expected = [ti.pk for ti in sorted(self.tis, key=lambda ti: (ti.work_completed, ti.pk)) if ti.unit_test_info.unit == self.unit2]
+        self.assertEqual(seen, expected)
+
+    #----------------------------------------------------------------------
+    def test_chunks(self):
+
+        objects = models.TestInstance.objects.all()
+        all_rows = list(api.stream_values(objects))
+        self.assertEqual(list(api.stream_values(objects, chunk_size=3)), all_rows)
+        self.assertEqual(list(api.stream_values(objects, limit=7, chunk_size=3)), all_rows[:7])
+
+    #----------------------------------------------------------------------
+    def test_columns(self):
+
+        response = self.get(format="columns", slug="test2", limit=4)
+        content = json.loads(response.content)
+        self.assertEqual(content["columns"], api.STREAM_COLUMNS)
+        self.assertEqual(content["data"]["test"], ["test2"] * 4)
+        self.assertEqual(content["next"], response["X-Next-Cursor"])
+
+    #----------------------------------------------------------------------
+    def test_invalid(self):
+        self.assertEqual(self.get(limit="abc").status_code, 400)
+        self.assertEqual(self.get(after="abc").status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    #----------------------------------------------------------------------
+    def test_not_modified(self):
+
+        url = reverse("api_dispatch_list", kwargs={"api_name": "v1", "resource_name": "grouped_values"})
+        for params in ({"unit": 1, "format": "csv"}, {"unit": 1, "format": "json"}):
+            response = self.client.get(url, params)
+            etag = response["ETag"]
+            self.assertTrue(response.has_header("Last-Modified"))
+
+            # session & user + unit lookup
+            with qautils.QueryBudget(max_queries=3):
+                response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+        # only data on the requested units matters
+        ti = utils.create_test_instance(self.utis[2], value=1, status=self.status)
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        ti.value = 2
+        ti.save()
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        ti.delete()
+        self.tis[0].delete()
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    #----------------------------------------------------------------------
+    def test_stream_not_modified(self):
+
+        etag = self.get(slug="test1")["ETag"]
+        self.assertEqual(self.get(etag, slug="test1").status_code, 304)
+        self.assertEqual(self.client.get(self.url, {"slug": "test1"}, HTTP_IF_NONE_MATCH=etag).status_code, 401)
+
+        models.TestInstance.objects.filter(pk=self.tis[0].pk).update(value=3)
+        self.assertEqual(self.get(etag, slug="test1").status_code, 304)
+        data_versions.touch_instances([self.tis[0]])
+        self.assertEqual(self.get(etag, slug="test1").status_code, 200)
+
+    #----------------------------------------------------------------------
+    def test_grouped_values(self):
+
+        url = reverse("api_dispatch_list", kwargs={"api_name": "v1", "resource_name": "grouped_values"})
+
+        with qautils.QueryBudget(max_queries=5):
+            response = self.client.get(url, {"format": "json", "unit": [1, 2], "slug": ["test1", "test2"]})
+
+        objects = json.loads(response.content)["objects"]
+        self.assertEqual([(o["slug"], o["unit"]) for o in objects], [("test1", 1), ("test1", 2), ("test2", 1), ("test2", 2)])
+        self.assertEqual(objects[0]["data"]["values"], [0, 1, 2, 3, 4])
+
+    #----------------------------------------------------------------------
+    def test_grouped_values_csv(self):
+
+        url = reverse("api_dispatch_list", kwargs={"api_name": "v1", "resource_name": "grouped_values"})
+
+        with qautils.QueryBudget(max_queries=5) as budget:
+            response = self.client.get(url, {"format": "csv", "unit": [1, 2], "slug": ["test1", "test2"]})
+            self.assertTrue(response._base_content_is_iter)
+            lines = response.content.splitlines()
+        queries = len(budget)
+
+        self.assertEqual(lines[0], "Unit:,Unit01,Test:,test1")
+        self.assertTrue(lines[1].startswith("Dates,Values,"))
+        self.assertEqual(len(lines), 4 * (2 + 5))
+        self.assertEqual([l for l in lines if l.startswith("Unit:")][-1], "Unit:,Unit02,Test:,test2")
+
+        # more values don't require more queries
+        for uti in self.utis:
+            utils.create_test_instance(uti, value=1, status=self.status)
+        with qautils.QueryBudget(max_queries=queries):
+            self.client.get(url, {"format": "csv"}).content
+
+    #----------------------------------------------------------------------
+    def test_grouped_values_csv_empty_groups(self):
+
+        url = reverse("api_dispatch_list", kwargs={"api_name": "v1", "resource_name": "grouped_values"})
+        models.TestInstance.objects.filter(unit_test_info=self.utis[3]).delete()
+
+        objects = json.loads(self.client.get(url, {"format": "json"}).content)["objects"]
+        lines = self.client.get(url, {"format": "csv"}).content.splitlines()
+
+        # same groups in the same order as other formats
+        sections = [l for l in lines if l.startswith("Unit:")]
+        self.assertEqual(sections, ["Unit:,Unit%02d,Test:,%s" % (o["unit"], o["name"]) for o in objects])
+        self.assertEqual(lines[-2:], ["Unit:,Unit02,Test:,test2", lines[1]])
+
+    #----------------------------------------------------------------------
+    def test_grouped_values_csv_not_paginated(self):
+
+        url = reverse("api_dispatch_list", kwargs={"api_name": "v1", "resource_name": "grouped_values"})
+        lines = self.client.get(url, {"format": "csv", "limit": 1}).content.splitlines()
+        self.assertEqual(len([l for l in lines if l.startswith("Unit:")]), 4)
@@ -0,0 +1,71 @@
+from django.test import TestCase
+
+from qatrack.qa import models
+from qatrack.qa.benchmarks import data
+from qatrack.qa.benchmarks.suite import BENCHMARKS, Suite, compare
+
+
+#============================================================================
+class TestSyntheticData(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.dataset = data.generate(units=2, test_lists=4, tests_per_list=4, composites=1, sublists=1, cycles=1, cycle_length=2, days=14)
+
+    #----------------------------------------------------------------------
+    def test_counts(self):
+
+        counts = self.dataset.counts()
+        self.assertEqual(counts["units"], 2)
+        self.assertEqual(counts["tests"], 4 * 5)
+        self.assertEqual(counts["unit_test_collections"], 2 * (4 + 1))
+
+        # 14 daily instances per list and 2 weekly instances per cycle
+        self.assertEqual(counts["test_list_instances"], 2 * (4 * 14 + 2))
+
+        tli = models.TestListInstance.objects.filter(test_list=self.dataset.test_lists[0])[0]
+        self.assertEqual(tli.testinstance_set.count(), 2 * 5)
+
+    #----------------------------------------------------------------------
+    def test_composite_values(self):
+
+        composite = self.dataset.composites[self.dataset.test_lists[1].pk][0]
+        ti = models.TestInstance.objects.filter(unit_test_info__test=composite)[0]
+        values = dict(ti.test_list_instance.testinstance_set.values_list("unit_test_info__test__slug", "value"))
+        self.assertAlmostEqual(ti.value, values["bm_l1_t0"] + values["bm_l1_t1"])
+
+    #----------------------------------------------------------------------
+    def test_bookkeeping(self):
+        utc = self.dataset.utcs[0]
+        utc = models.UnitTestCollection.objects.get(pk=utc.pk)
+        self.assertEqual(utc.last_instance, models.TestListInstance.objects.filter(unit_test_collection=utc).latest("work_completed"))
+        self.assertIsNotNone(utc.due_date)
+
+    #----------------------------------------------------------------------
+    def test_reproducible(self):
+        values = list(models.TestInstance.objects.order_by("pk").values_list("value", flat=True))
+        models.TestInstance.objects.all().delete()
+        models.TestListInstance.objects.all().delete()
+        data.create_history(self.dataset, data.random.Random(self.dataset.params["seed"]))
+        self.assertEqual(values, list(models.TestInstance.objects.order_by("pk").values_list("value", flat=True)))
+
+    #----------------------------------------------------------------------
+    def test_suite(self):
+        results = Suite(self.dataset, repeat=2).run(["perform_get", "perform_post", "history", "chart_data"])
+        for name, result in results.items():
+            self.assertNotIn("error", result, name)
+            self.assertEqual(result["runs"], 2)
+            self.assertGreater(result["queries"], 0)
+
+    #----------------------------------------------------------------------
+    def test_all_benchmarks_run(self):
+        results = Suite(self.dataset, repeat=1).run()
+        self.assertEqual(sorted(results), sorted(BENCHMARKS))
+        for name, result in results.items():
+            self.assertNotIn("error", result, "%s: %s" % (name, result.get("error")))
+
+    #----------------------------------------------------------------------
+    def test_compare(self):
+        before = {"results": {"a": {"median": 10., "queries": 5}, "b": {"error": "oops"}}}
+        after = {"results": {"a": {"median": 5., "queries": 3}, "b": {"median": 1., "queries": 1}}}
+        self.assertEqual(compare(before, after), [("a", 10., 5., -50., 5, 3)])
@@ -0,0 +1,180 @@
+import json
+import StringIO
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from qatrack.qa import importer, models
+
+import utils
+
+
+CSV = """unit,test,test_list,work_completed,value,comment
+1,simple,tl1,2013-01-02 10:00,1.0,
+1,bool,tl1,2013-01-02 10:00,yes,
+1,mc,tl1,2013-01-02 10:00,b,choice
+1,simple,tl1,2013-01-03 10:00,5,out of tolerance
+1,bool,tl1,2013-01-03 10:00,no,
+1,mc,tl1,2013-01-03 10:00,0,
+"""
+
+
+#============================================================================
+class TestBulkImporter(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.user = utils.create_user()
+        self.status = utils.create_status()
+        self.unit = utils.create_unit()
+
+        self.tl1 = utils.create_test_list("tl1")
+        self.simple = utils.create_test("simple")
+        self.bool = utils.create_test("bool", models.BOOLEAN)
+        self.mc = utils.create_test("mc", models.MULTIPLE_CHOICE)
+        self.mc.choices = "a,b,c"
+        self.mc.save()
+        for order, test in enumerate([self.simple, self.bool, self.mc]):
+            utils.create_test_list_membership(self.tl1, test, order)
+
+        self.tl2 = utils.create_test_list("tl2")
+        self.other = utils.create_test("other")
+        utils.create_test_list_membership(self.tl2, self.other)
+
+        frequency = utils.create_frequency()
+        self.utc1 = utils.create_unit_test_collection(unit=self.unit, test_collection=self.tl1, frequency=frequency)
+        self.cycle = utils.create_cycle([self.tl2], name="cycle")
+        self.utc2 = utils.create_unit_test_collection(unit=self.unit, test_collection=self.cycle, frequency=frequency)
+
+        uti = models.UnitTestInfo.objects.get(unit=self.unit, test=self.simple)
+        uti.reference = utils.create_reference(value=1.)
+        uti.tolerance = utils.create_tolerance()
+        uti.save()
+
+    #----------------------------------------------------------------------
+    def test_import_csv(self):
+
+        bulk = importer.BulkImporter(self.user)
+        bulk.import_rows(importer.read_csv(StringIO.StringIO(CSV)))
+        bulk.finish()
+
+        self.assertEqual(bulk.errors, [])
+        self.assertEqual((bulk.test_list_instances, bulk.test_instances), (2, 6))
+
+        tlis = models.TestListInstance.objects.order_by("work_completed")
+        self.assertEqual([tli.testinstance_set.count() for tli in tlis], [3, 3])
+
+        last = tlis[1]
+        values = dict((ti.unit_test_info.test.slug, (ti.value, ti.pass_fail)) for ti in last.testinstance_set.all())
+        self.assertEqual(values["simple"], (5., models.ACTION))
+        self.assertEqual(values["bool"], (0., models.NO_TOL))
+        self.assertEqual(values["mc"], (0., models.NO_TOL))
+
+        first_mc = tlis[0].testinstance_set.get(unit_test_info__test=self.mc)
+        self.assertEqual((first_mc.value, first_mc.comment), (1., "choice"))
+
+        utc = models.UnitTestCollection.objects.get(pk=self.utc1.pk)
+        self.assertEqual(utc.last_instance, last)
+        self.assertIsNotNone(utc.due_date)
+        self.assertEqual(models.unreviewed_counter.get(), 2)
+
+    #----------------------------------------------------------------------
+    def test_cycle_and_implicit_test_list(self):
+
+        rows = [{"unit": "unit", "test": "other", "work_completed": "02-01-2013 10:00", "value": 3}]
+        bulk = importer.BulkImporter(self.user)
+        bulk.import_rows(rows)
+        bulk.finish()
+
+        tli = models.TestListInstance.objects.get()
+        self.assertEqual((tli.unit_test_collection, tli.test_list), (self.utc2, self.tl2))
+        self.assertEqual(tli.work_completed, timezone.make_aware(timezone.datetime(2013, 1, 2, 10), timezone.get_current_timezone()))
+        self.assertEqual(models.UnitTestCollection.objects.get(pk=self.utc2.pk).last_instance, tli)
+
+    #----------------------------------------------------------------------
+    def test_invalid_rows(self):
+
+        rows = [
+            {"unit": "99", "test": "simple", "work_completed": "2013-01-02 10:00", "value": 1},
+            {"unit": "1", "test": "nope", "work_completed": "2013-01-02 10:00", "value": 1},
+            {"unit": "1", "test": "simple", "work_completed": "yesterday", "value": 1},
+            {"unit": "1", "test": "simple", "work_completed": "2013-01-02 10:00", "value": "abc"},
+            {"unit": "1", "test": "mc", "work_completed": "2013-01-02 10:00", "value": "z"},
+            {"unit": "1", "test": "simple", "work_completed": "2013-01-02 10:00", "value": "", "skipped": "yes"},
+            {"unit": "1", "test": "simple"},
+        ]
+        bulk = importer.BulkImporter(self.user)
+        bulk.import_rows(rows)
+        bulk.finish()
+
+        self.assertEqual([line for line, msg in bulk.errors], [1, 2, 3, 4, 5, 7])
+        ti = models.TestInstance.objects.get()
+        self.assertTrue(ti.skipped)
+        self.assertEqual(ti.pass_fail, models.NOT_DONE)
+
+        self.assertRaises(importer.RowError, bulk.import_rows, rows, raise_errors=True)
+
+    #----------------------------------------------------------------------
+    def test_batches(self):
+
+        rows = []
+        for day in range(1, 11):
+            for test in ["simple", "bool"]:
+                rows.append({"unit": "1", "test": test, "test_list": "tl1", "work_completed": "2013-01-%02d 10:00" % day, "value": 1})
+
+        bulk = importer.BulkImporter(self.user, status=utils.create_status("approved", "approved", False, False), batch_size=3)
+        bulk.import_rows(rows)
+        bulk.finish()
+
+        self.assertEqual(models.TestListInstance.objects.filter(all_reviewed=True).count(), 10)
+        self.assertEqual(models.TestInstance.objects.count(), 20)
+        self.assertEqual(models.unreviewed_counter.get(), 0)
+        self.assertEqual(
+            models.UnitTestCollection.objects.get(pk=self.utc1.pk).last_instance,
+            models.TestListInstance.objects.latest("work_completed"),
+        )
+
+    #----------------------------------------------------------------------
+    def test_repeated_rows(self):
+
+        def row(day, test="simple", **kwargs):
+            r = {"unit": "1", "test": test, "test_list": "tl1", "work_completed": "2013-01-%02d 10:00" % day, "value": 1}
+            r.update(kwargs)
+            return r
+
+        rows = [
+            row(1), row(1, "bool", skipped=None),
+            row(1),  # duplicate within batch
+            row(2), row(3),
+            row(1, "mc"),  # test list instance for day 1 already written
+        ]
+        bulk = importer.BulkImporter(self.user, batch_size=2)
+        bulk.import_rows(rows)
+        bulk.finish()
+
+        self.assertEqual([line for line, msg in bulk.errors], [3, 6])
+        self.assertEqual(models.TestListInstance.objects.count(), 3)
+        self.assertEqual(models.TestInstance.objects.count(), 4)
+
+    #----------------------------------------------------------------------
+    def test_read_json(self):
+
+        rows = [{"unit": 1, "test": "simple", "value": 1}, {"unit": 1, "test": "bool", "value": True}]
+        self.assertEqual(list(importer.read_json(StringIO.StringIO(json.dumps(rows)))), rows)
+
+        ndjson = "\n".join(json.dumps(r) for r in rows) + "\n\n"
+        self.assertEqual(list(importer.read_json(StringIO.StringIO(ndjson))), rows)
+
+    #----------------------------------------------------------------------
+    def test_command(self):
+
+        with tempfile.NamedTemporaryFile(suffix=".csv") as f:
+            f.write(CSV)
+            f.flush()
+            stdout = StringIO.StringIO()
+            call_command("import_values", f.name, user="user", stdout=stdout)
+
+        self.assertIn("Imported 2 test list instances (6 test instances)", stdout.getvalue())
+        self.assertEqual(models.TestInstance.objects.count(), 6)
@@ -0,0 +1,224 @@
+import json
+import socket
+import threading
+import time
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from qatrack.middleware import instrumentation, profiler
+
+import utils
+
+
+#============================================================================
+class TestInstrumentationUtils(TestCase):
+
+    #----------------------------------------------------------------------
+    def test_fingerprint(self):
+        a = instrumentation.fingerprint("SELECT * FROM qa_test WHERE id = 1 AND name = 'foo'")
+        b = instrumentation.fingerprint("SELECT *  FROM qa_test WHERE id = 23 AND name = 'it''s'")
+        self.assertEqual(a, b)
+        self.assertEqual(a, "SELECT * FROM qa_test WHERE id = ? AND name = ?")
+
+    #----------------------------------------------------------------------
+    def test_fingerprint_in_list(self):
+        a = instrumentation.fingerprint("SELECT * FROM qa_test2 WHERE id IN (1, 2, 3)")
+        b = instrumentation.fingerprint("SELECT * FROM qa_test2 WHERE id IN (4)")
+        self.assertEqual(a, b)
+        self.assertEqual(a, "SELECT * FROM qa_test2 WHERE id IN (...)")
+
+    #----------------------------------------------------------------------
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(instrumentation.percentile(values, 50), 50)
+        self.assertEqual(instrumentation.percentile(values, 95), 95)
+        self.assertEqual(instrumentation.percentile(values, 100), 100)
+        self.assertEqual(instrumentation.percentile([7], 99), 7)
+        self.assertIsNone(instrumentation.percentile([], 50))
+
+    #----------------------------------------------------------------------
+    def test_ring_buffer(self):
+        recorder = instrumentation.Recorder(size=10)
+        for i in range(25):
+            recorder.record(instrumentation.ViewSample("view", "GET", 200, i, 0, 0))
+        self.assertEqual(len(recorder.views), 10)
+        self.assertEqual(recorder.view_stats()[0]["max"], 24)
+
+    #----------------------------------------------------------------------
+    def test_summary_ordering(self):
+        recorder = instrumentation.Recorder()
+        for i in range(10):
+            recorder.record(
+                instrumentation.ViewSample("fast", "GET", 200, 1, 1, 0.5),
+                [instrumentation.QuerySample("fast", "SELECT %d" % i, 0.5)],
+            )
+            recorder.record(
+                instrumentation.ViewSample("slow", "GET", 200, 100, 2, 20),
+                [instrumentation.QuerySample("slow", "SELECT * FROM t WHERE id = %d" % i, 10)] * 2,
+            )
+
+        summary = recorder.summary()
+        self.assertEqual(summary["samples"], 20)
+        self.assertEqual([v["view"] for v in summary["views"]], ["slow", "fast"])
+        self.assertEqual(summary["views"][0]["queries"], 2)
+
+        slowest = summary["queries"][0]
+        self.assertEqual(slowest["fingerprint"], "SELECT * FROM t WHERE id = ?")
+        self.assertEqual(slowest["count"], 20)
+        self.assertEqual(slowest["total_time"], 200)
+        self.assertEqual(slowest["views"], ["slow"])
+
+
+#============================================================================
+class TestInstrumentationMiddleware(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.user = utils.create_user()
+        self.client.login(username="user", password="password")
+        instrumentation.recorder.clear()
+
+    #----------------------------------------------------------------------
+    def test_records_view(self):
+
+        self.client.get(reverse("unreviewed"))
+
+        views = dict((v["view"], v) for v in instrumentation.recorder.view_stats())
+        stats = views["qatrack.qa.views.review.Unreviewed"]
+        self.assertEqual(stats["count"], 1)
+        self.assertGreater(stats["queries"], 0)
+        self.assertTrue(instrumentation.recorder.query_stats())
+
+    #----------------------------------------------------------------------
+    def test_summary_view(self):
+
+        self.client.get(reverse("unreviewed"))
+
+        request = RequestFactory().get(reverse("instrumentation"))
+        request.user = self.user
+        response = instrumentation.summary_view(request)
+
+        summary = json.loads(response.content)
+        self.assertIn("qatrack.qa.views.review.Unreviewed", [v["view"] for v in summary["views"]])
+
+    #----------------------------------------------------------------------
+    def test_summary_view_staff_only(self):
+
+        self.user.is_staff = False
+        self.user.save()
+
+        response = self.client.get(reverse("instrumentation"))
+        self.assertNotEqual(response["Content-Type"], "application/json")
+
+
+#============================================================================
+class TestStatsdExporter(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.settimeout(2)
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        self.listener.close()
+
+    #----------------------------------------------------------------------
+    def test_send(self):
+
+        host, port = self.listener.getsockname()
+        exporter = instrumentation.StatsdExporter(host, port, prefix="test")
+        exporter.send(instrumentation.ViewSample("qatrack.qa.views.Foo", "GET", 200, 12.7, 3, 4.2))
+
+        packet = self.listener.recv(1024)
+        self.assertEqual(packet.splitlines(), [
+            "test.views.qatrack.qa.views.Foo.time:12|ms",
+            "test.views.qatrack.qa.views.Foo.queries:3|h",
+            "test.views.qatrack.qa.views.Foo.sql_time:4|ms",
+        ])
+
+
+#----------------------------------------------------------------------
+def busy_function(duration):
+    end = time.time() + duration
+    while time.time() < end:
+        sum(range(100))
+
+
+#============================================================================
+class TestSampler(TestCase):
+
+    #----------------------------------------------------------------------
+    def test_samples_registered_thread(self):
+
+        sampler = profiler.Sampler(interval=0.001)
+        sampler.start("myview")
+        busy_function(0.2)
+        sampler.stop()
+
+        collapsed = sampler.collapsed()
+        self.assertGreater(sampler.samples, 0)
+        self.assertIn("busy_function", collapsed)
+
+        for line in collapsed.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            self.assertTrue(stack.startswith("myview;"))
+            self.assertGreater(int(count), 0)
+
+    #----------------------------------------------------------------------
+    def test_other_threads(self):
+        """threads are only sampled while registered"""
+
+        sampler = profiler.Sampler(interval=0.001)
+
+        worker = threading.Thread(target=busy_function, args=(0.2,))
+        worker.start()
+        sampler.start("worker", worker.ident)
+        time.sleep(0.1)
+        sampler.stop(worker.ident)
+        worker.join()
+        time.sleep(0.01)  # allow an in progress sample to complete
+
+        samples = sampler.samples
+        self.assertGreater(samples, 0)
+        self.assertIn("busy_function", sampler.collapsed())
+        self.assertNotIn("test_other_threads", sampler.collapsed())
+
+        time.sleep(0.05)
+        self.assertEqual(sampler.samples, samples)
+
+    #----------------------------------------------------------------------
+    def test_should_sample(self):
+
+        middleware = profiler.ProfileMiddleware()
+        request = RequestFactory().get(reverse("unreviewed"))
+
+        with override_settings(PROFILE_SAMPLE_RATE=0, PROFILE_SAMPLE_URL_NAMES=()):
+            self.assertFalse(middleware.should_sample(request))
+
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            self.assertTrue(middleware.should_sample(request))
+
+        with override_settings(PROFILE_SAMPLE_RATE=0, PROFILE_SAMPLE_URL_NAMES=("unreviewed",)):
+            self.assertTrue(middleware.should_sample(request))
+
+        with override_settings(PROFILE_SAMPLE_RATE=0, PROFILE_SAMPLE_URL_NAMES=("charts",)):
+            self.assertFalse(middleware.should_sample(request))
+
+    #----------------------------------------------------------------------
+    def test_download(self):
+
+        profiler.sampler.clear()
+        profiler.sampler.stacks["view;a;b"] = 3
+
+        utils.create_user()
+        self.client.login(username="user", password="password")
+
+        response = self.client.get(reverse("sampled_profile"), {"reset": 1})
+        self.assertEqual(response.content, "view;a;b 3\n")
+        self.assertIn("attachment", response["Content-Disposition"])
+        self.assertEqual(profiler.sampler.collapsed(), "")
@@ -847,6 +847,46 @@ class TestUTCDueDates(TestCase):
         utils.create_test_instance(unit_test_info=uti, work_completed=now, status=status)
         self.assertTrue(utils.datetimes_same(timezone.localtime(utc.due_date), now + daily.due_delta()))
 
+    #---------------------------------------------------------------------------
+    def test_last_valid_completions(self):
+        now = timezone.now()
+        for delta in (-3, -2):
+            tli = utils.create_test_list_instance(unit_test_collection=self.utc_hist, work_completed=now + timezone.timedelta(days=delta))
+            utils.create_test_instance(unit_test_info=self.uti_hist, status=self.valid_status, test_list_instance=tli)
+
+        tli = utils.create_test_list_instance(unit_test_collection=self.utc_hist, work_completed=now)
+        utils.create_test_instance(unit_test_info=self.uti_hist, status=self.invalid_status, test_list_instance=tli)
+
+        last = models.UnitTestCollection.objects.last_valid_completions([self.utc_hist])
+        self.assertTrue(utils.datetimes_same(last[self.utc_hist.pk], now - timezone.timedelta(days=2)))
+
+    #---------------------------------------------------------------------------
+    def test_set_due_dates_matches_calc_due_date(self):
+        now = timezone.now()
+        tli = utils.create_test_list_instance(unit_test_collection=self.utc_hist, work_completed=now)
+        utils.create_test_instance(unit_test_info=self.uti_hist, status=self.valid_status, test_list_instance=tli)
+
+        unit = utils.create_unit(name="unit2", number=2)
+        invalid_utc = utils.create_unit_test_collection(unit=unit, test_collection=self.utc_hist.tests_object, frequency=self.monthly)
+        uti = models.UnitTestInfo.objects.get(test=self.uti_hist.test, unit=unit)
+        tli = utils.create_test_list_instance(unit_test_collection=invalid_utc, work_completed=now)
+        utils.create_test_instance(unit_test_info=uti, status=self.invalid_status, test_list_instance=tli)
+
+        never_done = utils.create_unit_test_collection(test_collection=self.utc_hist.tests_object, frequency=self.daily, unit=unit)
+
+        models.UnitTestCollection.objects.update(due_date=None)
+        with self.assertNumQueries(3):
+            models.UnitTestCollection.objects.set_due_dates()
+
+        for utc in models.UnitTestCollection.objects.all():
+            expected = utc.calc_due_date()
+            if expected is None:
+                self.assertIsNone(utc.due_date)
+            else:
+                self.assertTrue(utils.datetimes_same(utc.due_date, expected))
+
+        self.assertIsNone(models.UnitTestCollection.objects.get(pk=never_done.pk).due_date)
+
 
 #============================================================================
 class TestUnitTestCollection(TestCase):
@@ -1282,6 +1322,104 @@ class TestSignals(TestCase):
         self.assertEqual(len(utis), 4)
         self.assertListEqual(tests, [x.test for x in utis])
 
+    #---------------------------------------------------------------
+    def test_provision_queries(self):
+        from qatrack.qa import utils as qautils
+
+        test_list = utils.create_test_list()
+        group = utils.create_group()
+        frequency = utils.create_frequency()
+        units = [utils.create_unit(name="unit%d" % n, number=n) for n in range(6)]
+        for unit in units[:2]:
+            utils.create_unit_test_collection(unit=unit, frequency=frequency, test_collection=test_list, assigned_to=group)
+
+        with qautils.QueryBudget() as budget:
+            utils.create_test_list_membership(test_list, utils.create_test(name="test1"))
+        queries = len(budget)
+
+        for unit in units[2:]:
+            utils.create_unit_test_collection(unit=unit, frequency=frequency, test_collection=test_list, assigned_to=group)
+
+        # more units doesn't mean more queries
+        with qautils.QueryBudget(max_queries=queries):
+            utils.create_test_list_membership(test_list, utils.create_test(name="test2"))
+
+        utis = models.UnitTestInfo.objects.filter(unit__in=units)
+        self.assertEqual(utis.count(), 2 * len(units))
+        self.assertEqual(set(utis.values_list("assigned_to", flat=True)), set([group.pk]))
+
+    #---------------------------------------------------------------
+    def test_coalesced_last_instance_updates(self):
+        from qatrack.qa import signals
+
+        utc = utils.create_unit_test_collection()
+        now = timezone.now()
+
+        with signals.coalesce_last_instance_updates():
+            tli1 = utils.create_test_list_instance(unit_test_collection=utc, work_completed=now - timezone.timedelta(days=1))
+            tli2 = utils.create_test_list_instance(unit_test_collection=utc, work_completed=now)
+            tli1.save()
+            self.assertIsNone(models.UnitTestCollection.objects.get(pk=utc.pk).last_instance)
+
+        utc = models.UnitTestCollection.objects.get(pk=utc.pk)
+        self.assertEqual(utc.last_instance, tli2)
+        self.assertTrue(utils.datetimes_same(utc.due_date, now + utc.frequency.due_delta()))
+
+    #---------------------------------------------------------------
+    def test_coalesced_data_versions(self):
+        from django.db.models.signals import post_save
+        from qatrack.qa import data_versions, signals
+
+        test_list = utils.create_test_list()
+        for i in range(3):
+            utils.create_test_list_membership(test_list, utils.create_test(name="test %d" % i))
+        utc = utils.create_unit_test_collection(test_collection=test_list)
+        status = utils.create_status()
+        for uti in models.UnitTestInfo.objects.all():
+            utils.create_test_instance(unit_test_info=uti, status=status)
+        tis = list(models.TestInstance.objects.all())
+
+        versions = data_versions.get_versions([utc.unit_id])
+        with signals.coalesce_last_instance_updates():
+            # units are looked up once on exit rather than per instance
+            with self.assertNumQueries(0):
+                for ti in tis:
+                    post_save.send(sender=models.TestInstance, instance=ti, created=False)
+
+        self.assertNotEqual(data_versions.get_versions([utc.unit_id]), versions)
+
+    #---------------------------------------------------------------
+    def test_coalesced_last_instance_updates_discarded_on_error(self):
+        from qatrack.qa import signals
+
+        utc = utils.create_unit_test_collection()
+        try:
+            with signals.coalesce_last_instance_updates():
+                utils.create_test_list_instance(unit_test_collection=utc)
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertIsNone(models.UnitTestCollection.objects.get(pk=utc.pk).last_instance)
+
+        # subsequent saves are no longer deferred
+        tli = utils.create_test_list_instance(unit_test_collection=utc)
+        self.assertEqual(models.UnitTestCollection.objects.get(pk=utc.pk).last_instance, tli)
+
+    #---------------------------------------------------------------
+    def test_last_instance_set_for_cycles_on_unit(self):
+        test_list = utils.create_test_list()
+        utils.create_test_list_membership(test_list, utils.create_test())
+        cycle = utils.create_cycle(test_lists=[test_list])
+
+        list_utc = utils.create_unit_test_collection(test_collection=test_list)
+        cycle_utc = utils.create_unit_test_collection(test_collection=cycle, unit=list_utc.unit, frequency=list_utc.frequency)
+
+        tli = utils.create_test_list_instance(unit_test_collection=list_utc)
+
+        for utc in (list_utc, cycle_utc):
+            self.assertEqual(models.UnitTestCollection.objects.get(pk=utc.pk).last_instance, tli)
+
 
 #============================================================================
 class TestTestInstance(TestCase):
@@ -1754,6 +1892,79 @@ class TestTestListInstance(TestCase):
         self.assertEqual(utc.last_instance, self.test_list_instance)
 
 
+#============================================================================
+class TestUnreviewedCounter(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        models.unreviewed_counter.reset()
+        self.utc = utils.create_unit_test_collection()
+        self.unit = self.utc.unit.pk
+        self.group = self.utc.assigned_to.pk
+
+    #----------------------------------------------------------------------
+    def assertCounts(self, total, unit, group):
+        with self.assertNumQueries(0):
+            counts = (
+                models.unreviewed_counter.get(),
+                models.unreviewed_counter.get("unit", self.unit),
+                models.unreviewed_counter.get("group", self.group),
+            )
+        self.assertEqual(counts, (total, unit, group))
+        self.assertEqual(models.TestListInstance.objects.unreviewed_count(), total)
+
+    #----------------------------------------------------------------------
+    def test_maintained_by_delta(self):
+
+        # prime cache
+        models.unreviewed_counter.get()
+        models.unreviewed_counter.get("unit", self.unit)
+        models.unreviewed_counter.get("group", self.group)
+        self.assertCounts(0, 0, 0)
+
+        tli = utils.create_test_list_instance(unit_test_collection=self.utc)
+        self.assertCounts(1, 1, 1)
+
+        utils.create_test_list_instance(unit_test_collection=self.utc, in_progress=True)
+        self.assertCounts(1, 1, 1)
+
+        tli.update_all_reviewed()
+        self.assertCounts(0, 0, 0)
+
+        tli = models.TestListInstance.objects.get(pk=tli.pk)
+        tli.all_reviewed = False
+        tli.save()
+        self.assertCounts(1, 1, 1)
+
+        models.TestListInstance.objects.get(pk=tli.pk).delete()
+        self.assertCounts(0, 0, 0)
+
+    #----------------------------------------------------------------------
+    def test_other_units_unaffected(self):
+        models.unreviewed_counter.get("unit", self.unit)
+        unit = utils.create_unit(name="other", number=2)
+        other = utils.create_unit_test_collection(unit=unit, frequency=self.utc.frequency, test_collection=self.utc.tests_object)
+        utils.create_test_list_instance(unit_test_collection=other)
+
+        self.assertEqual(models.unreviewed_counter.get_many("unit", [self.unit, other.unit.pk]), {self.unit: 0, other.unit.pk: 1})
+
+    #----------------------------------------------------------------------
+    def test_reassigned(self):
+        utils.create_test_list_instance(unit_test_collection=self.utc)
+        models.unreviewed_counter.get("unit", self.unit)
+        models.unreviewed_counter.get("group", self.group)
+
+        group = utils.create_group(name="other")
+        unit = utils.create_unit(name="other", number=2)
+        utc = models.UnitTestCollection.objects.get(pk=self.utc.pk)
+        utc.assigned_to = group
+        utc.unit = unit
+        utc.save()
+
+        self.assertEqual(models.unreviewed_counter.get_many("group", [self.group, group.pk]), {self.group: 0, group.pk: 1})
+        self.assertEqual(models.unreviewed_counter.get_many("unit", [self.unit, unit.pk]), {self.unit: 0, unit.pk: 1})
+
+
 #============================================================================
 class TestAutoReview(TestCase):
 
@@ -0,0 +1,113 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from qatrack.qa import models, plans, utils as qautils
+
+import utils
+
+
+#============================================================================
+class TestExecutionPlan(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.unit = utils.create_unit()
+        self.test_list = utils.create_test_list("main")
+        self.tests = []
+
+        for order in range(3):
+            test = utils.create_test("main %d" % order)
+            utils.create_test_list_membership(self.test_list, test, 2 - order)
+            self.tests.insert(0, test)
+
+        for n in range(2):
+            sublist = utils.create_test_list("sub %d" % n)
+            for order in range(2):
+                test = utils.create_test("sub %d %d" % (n, order))
+                utils.create_test_list_membership(sublist, test, order)
+                self.tests.append(test)
+            self.test_list.sublists.add(sublist)
+
+        self.utc = utils.create_unit_test_collection(unit=self.unit, test_collection=self.test_list)
+
+    #----------------------------------------------------------------------
+    def test_order(self):
+
+        plan = plans.ExecutionPlan(self.unit, self.test_list)
+
+        self.assertEqual(plan.tests, self.tests)
+        self.assertEqual([uti.test for uti in plan.unit_test_infos], self.tests)
+        self.assertEqual(plan.missing, [])
+        self.assertEqual(plan.categories, set([self.tests[0].category]))
+
+        uti = plan.utis[self.tests[3].pk]
+        self.assertEqual((uti.unit, uti.test), (self.unit, self.tests[3]))
+
+    #----------------------------------------------------------------------
+    def test_missing(self):
+
+        models.UnitTestInfo.objects.filter(test=self.tests[1]).update(active=False)
+        plan = plans.ExecutionPlan(self.unit, self.test_list)
+
+        self.assertEqual(plan.missing, [self.tests[1]])
+        self.assertEqual(len(plan.unit_test_infos), len(self.tests) - 1)
+
+    #----------------------------------------------------------------------
+    def test_constant_queries(self):
+
+        with qautils.QueryBudget(max_queries=3):
+            plan = plans.ExecutionPlan(self.unit, self.test_list)
+            for uti in plan.unit_test_infos:
+                uti.reference, uti.tolerance, uti.test.category
+
+    #----------------------------------------------------------------------
+    def test_compiled_cached(self):
+
+        cache.clear()
+        compiled = plans.compile_collection(self.test_list)
+        with qautils.QueryBudget(max_queries=0):
+            self.assertEqual(plans.compile_collection(self.test_list).tests, compiled.tests)
+            self.assertEqual(compiled.test_data[self.tests[0].pk]["name"], self.tests[0].name)
+
+        # editing the list invalidates the structure
+        test = utils.create_test("new")
+        utils.create_test_list_membership(self.test_list, test, 3)
+        self.assertEqual(plans.compile_collection(self.test_list).tests, self.tests[:3] + [test] + self.tests[3:])
+
+        self.test_list.sublists.clear()
+        self.assertEqual(plans.compile_collection(self.test_list).tests, self.tests[:3] + [test])
+
+        test.name = "renamed"
+        test.save()
+        self.assertEqual(plans.compile_collection(self.test_list).test_data[test.pk]["name"], "renamed")
+
+
+#============================================================================
+class TestCompiledCycle(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.test_lists = [utils.create_test_list("tl %d" % i) for i in range(3)]
+        self.cycle = utils.create_cycle(self.test_lists)
+
+    #----------------------------------------------------------------------
+    def test_days(self):
+
+        cache.clear()
+        self.assertEqual(len(self.cycle), 3)
+        with qautils.QueryBudget(max_queries=0):
+            self.assertEqual(len(self.cycle), 3)
+            self.assertEqual(self.cycle.first(), self.test_lists[0])
+            self.assertEqual(self.cycle.get_list(1), (1, self.test_lists[1]))
+            self.assertEqual(self.cycle.get_list(5), (None, None))
+            self.assertEqual(self.cycle.next_list(1), (2, self.test_lists[2]))
+            self.assertEqual(self.cycle.next_list(2), (0, self.test_lists[0]))
+            self.assertEqual(self.cycle.next_list(None), (0, self.test_lists[0]))
+
+    #----------------------------------------------------------------------
+    def test_membership_changes(self):
+
+        self.assertEqual(len(self.cycle), 3)
+        models.TestListCycleMembership.objects.get(cycle=self.cycle, order=2).delete()
+        self.assertEqual(len(self.cycle), 2)
+        self.assertEqual(self.cycle.next_list(1), (0, self.test_lists[0]))
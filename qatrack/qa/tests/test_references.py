@@ -0,0 +1,80 @@
+from django.test import TestCase
+
+from qatrack.qa import models, references, utils as qautils
+
+import utils
+
+
+#============================================================================
+class TestReferences(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.user = utils.create_user()
+        self.tolerance = utils.create_tolerance(created_by=self.user)
+        self.unit1 = utils.create_unit(name="unit1", number=1)
+        self.unit2 = utils.create_unit(name="unit2", number=2)
+        self.tests = [utils.create_test(name="test%d" % n) for n in range(5)]
+        self.bool_test = utils.create_test(name="bool", test_type=models.BOOLEAN)
+        self.mc_test = utils.create_test(name="mc", test_type=models.MULTIPLE_CHOICE)
+        self.mc_test.choices = "a,b"
+        self.mc_test.save()
+
+        group = utils.create_group()
+        for unit in (self.unit1, self.unit2):
+            for test in self.tests + [self.bool_test, self.mc_test]:
+                utils.create_unit_test_info(unit=unit, test=test, assigned_to=group)
+
+    #----------------------------------------------------------------------
+    def utis(self, unit, tests):
+        return models.UnitTestInfo.objects.filter(unit=unit, test__in=tests).select_related("unit", "test", "reference")
+
+    #----------------------------------------------------------------------
+    def test_set_references(self):
+
+        existing = utils.create_reference(value=2, created_by=self.user)
+        utils.create_reference(name="dupe", value=2, created_by=self.user)
+
+        with qautils.QueryBudget(max_queries=4):
+            summary = references.set_references_and_tolerances(self.utis(self.unit1, self.tests), "2", self.tolerance, self.user)
+        self.assertEqual(summary, references.AssignmentSummary(5, 0, 1))
+
+        utis = self.utis(self.unit1, self.tests)
+        self.assertEqual(set(uti.reference_id for uti in utis), set([existing.pk]))
+        self.assertEqual(set(uti.tolerance_id for uti in utis), set([self.tolerance.pk]))
+
+        # one new reference shared by all utis
+        summary = references.set_references_and_tolerances(self.utis(self.unit2, self.tests), "3.5", self.tolerance, self.user)
+        self.assertEqual(summary, references.AssignmentSummary(5, 1, 0))
+        ref = models.Reference.objects.get(value=3.5)
+        self.assertEqual(ref.name, "unit2 test0")
+        self.assertEqual(set(self.utis(self.unit2, self.tests).values_list("reference", flat=True)), set([ref.pk]))
+
+        references.set_references_and_tolerances(self.utis(self.unit2, self.tests), "", None, self.user)
+        self.assertEqual(set(self.utis(self.unit2, self.tests).values_list("reference", "tolerance")), set([(None, None)]))
+
+    #----------------------------------------------------------------------
+    def test_boolean_and_multiple_choice(self):
+
+        mc_ref = utils.create_reference(value=7, created_by=self.user)
+        models.UnitTestInfo.objects.filter(test=self.mc_test).update(reference=mc_ref)
+
+        references.set_references_and_tolerances(self.utis(self.unit1, [self.bool_test]), "True", None, self.user)
+        uti = self.utis(self.unit1, [self.bool_test]).get()
+        self.assertEqual((uti.reference.value, uti.reference.type), (1, models.BOOLEAN))
+
+        references.set_references_and_tolerances(self.utis(self.unit1, [self.mc_test]), "", self.tolerance, self.user)
+        self.assertEqual(self.utis(self.unit1, [self.mc_test]).get().reference, mc_ref)
+
+    #----------------------------------------------------------------------
+    def test_copy_references(self):
+
+        references.set_references_and_tolerances(self.utis(self.unit1, self.tests[:3]), "4", self.tolerance, self.user)
+
+        with qautils.QueryBudget(max_queries=3):
+            summary = references.copy_references(self.unit1, self.unit2, [t.pk for t in self.tests])
+        self.assertEqual(summary.updated, len(self.tests))
+
+        copied = dict(self.utis(self.unit2, self.tests).values_list("test", "reference"))
+        source = dict(self.utis(self.unit1, self.tests).values_list("test", "reference"))
+        self.assertEqual(copied, source)
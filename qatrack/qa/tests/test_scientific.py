@@ -0,0 +1,32 @@
+from django.test import TestCase
+
+from qatrack.qa import scientific
+from qatrack.qa.management.commands.import_times import measure_import
+
+
+#============================================================================
+class TestScientific(TestCase):
+
+    #----------------------------------------------------------------------
+    def test_calculation_context(self):
+        import numpy
+        context = scientific.calculation_context()
+        self.assertEqual(sorted(context), ["math", "numpy", "scipy"])
+        self.assertIs(context["numpy"], numpy)
+        self.assertIs(scientific.calculation_context(), context)
+
+    #----------------------------------------------------------------------
+    def test_urls_lazy(self):
+        """loading the qa urls (& views) must not import numpy, scipy or matplotlib"""
+        result = measure_import("qatrack.qa.urls")
+        self.assertEqual(result.scientific_modules, [])
+
+    #----------------------------------------------------------------------
+    def test_measure_scientific(self):
+        result = measure_import("scipy.special")
+        self.assertIn("numpy", result.scientific_modules)
+        self.assertTrue(result.seconds > 0)
+
+    #----------------------------------------------------------------------
+    def test_measure_missing(self):
+        self.assertRaises(ImportError, measure_import, "qatrack.not_a_module")
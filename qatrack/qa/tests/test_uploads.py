@@ -0,0 +1,250 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from qatrack.qa import models, thumbnails, uploads
+
+import utils
+
+
+#============================================================================
+class TestUploads(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.tmp = os.path.join(self.root, "tmp")
+        os.mkdir(self.tmp)
+        self.settings = override_settings(UPLOAD_ROOT=self.root, TMP_UPLOAD_ROOT=self.tmp, UPLOADS_URL="/media/uploads/")
+        self.settings.enable()
+
+        self.test = utils.create_test(name="upload", test_type=models.UPLOAD)
+        self.uti = utils.create_unit_test_info(test=self.test)
+        utc = utils.create_unit_test_collection(unit=self.uti.unit, assigned_to=self.uti.assigned_to)
+        self.tli = utils.create_test_list_instance(unit_test_collection=utc)
+        self.status = utils.create_status()
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def write(self, name, content, directory=None, age=0):
+        path = os.path.join(directory or self.tmp, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(content)
+        if age:
+            t = time.time() - age
+            os.utime(path, (t, t))
+        return path
+
+    #----------------------------------------------------------------------
+    def create_instance(self, string_value):
+        ti = utils.create_test_instance(self.uti, value=None, status=self.status, test_list_instance=self.tli)
+        ti.string_value = string_value
+        ti.save()
+        return ti
+
+    #----------------------------------------------------------------------
+    def test_store_blob(self):
+
+        ref1 = uploads.store_blob(self.write("a.PNG", "data"))
+        ref2 = uploads.store_blob(self.write("b.png", "data"))
+        sha256 = hashlib.sha256("data").hexdigest()
+
+        self.assertEqual(ref1, "sha256/%s/a.PNG" % sha256)
+        self.assertEqual(uploads.parse_reference(ref2), (sha256, "b.png"))
+
+        # stored once
+        self.assertEqual(uploads.blob_path(ref1), uploads.blob_path(ref2))
+        self.assertEqual(os.listdir(os.path.join(self.root, "blobs", sha256[:2])), [sha256 + ".png"])
+        self.assertEqual(os.listdir(self.tmp), [])
+
+        self.assertEqual(uploads.blob_url(ref1), "/media/uploads/blobs/%s/%s.png" % (sha256[:2], sha256))
+
+    #----------------------------------------------------------------------
+    def test_upload_url(self):
+
+        ti = self.create_instance(uploads.store_blob(self.write("a.txt", "data")))
+        self.assertIn('title="a.txt"', ti.upload_url())
+        self.assertIn("/media/uploads/blobs/", ti.upload_url())
+
+        ti.string_value = "old.txt"
+        self.assertIn("/media/uploads/%d/old.txt" % self.tli.pk, ti.upload_url())
+
+    #----------------------------------------------------------------------
+    def test_collect_garbage(self):
+
+        day = 24 * 60 * 60
+
+        self.write("abandoned.txt", "abandoned", age=2 * day)
+        self.write("recent.txt", "recent")
+        self.write("in_progress.txt", "in progress", age=2 * day)
+        self.create_instance("in_progress.txt")
+
+        kept = self.create_instance(uploads.store_blob(self.write("kept.txt", "kept")))
+        unreferenced = uploads.blob_path(uploads.store_blob(self.write("gone.txt", "gone")))
+        os.utime(unreferenced, (time.time() - 2 * day,) * 2)
+
+        summary = uploads.collect_garbage(dry_run=True)
+        self.assertEqual((summary.temp_removed, summary.blobs_removed), (1, 1))
+        self.assertTrue(os.path.exists(unreferenced))
+
+        summary = uploads.collect_garbage()
+        self.assertEqual(summary, uploads.GCSummary(1, 1, 0, len("abandoned") + len("gone"), True))
+        self.assertEqual(sorted(os.listdir(self.tmp)), ["in_progress.txt", "recent.txt"])
+        self.assertFalse(os.path.exists(unreferenced))
+        self.assertTrue(os.path.exists(uploads.blob_path(kept.string_value)))
+
+    #----------------------------------------------------------------------
+    def test_migrate(self):
+
+        directory = os.path.join(self.root, "%d" % self.tli.pk)
+        tis = [self.create_instance("file%d.txt" % n) for n in range(3)]
+        for ti in tis:
+            self.write(ti.string_value, "same content", directory=directory)
+
+        summary = uploads.collect_garbage(migrate=True, batch_size=2)
+        self.assertEqual(summary.migrated, 3)
+        self.assertFalse(os.path.exists(directory))
+
+        values = models.TestInstance.objects.filter(pk__in=[ti.pk for ti in tis]).values_list("string_value", flat=True)
+        self.assertTrue(all(uploads.is_reference(v) for v in values))
+        self.assertEqual(len(set(uploads.blob_path(v) for v in values)), 1)
+        self.assertTrue(os.path.exists(uploads.blob_path(values[0])))
+
+    #----------------------------------------------------------------------
+    def test_duplicate_of_old_blob_kept(self):
+
+        old = uploads.blob_path(uploads.store_blob(self.write("old.txt", "data")))
+        os.utime(old, (time.time() - 2 * 24 * 60 * 60,) * 2)
+
+        # identical file uploaded after garbage collection listed the blob
+        uploads.store_blob(self.write("new.txt", "data"))
+
+        summary = uploads.collect_garbage()
+        self.assertEqual(summary.blobs_removed, 0)
+        self.assertTrue(os.path.exists(old))
+
+    #----------------------------------------------------------------------
+    def test_migrate_interrupted(self):
+
+        directory = os.path.join(self.root, "%d" % self.tli.pk)
+        ti = self.create_instance("file.txt")
+        path = self.write(ti.string_value, "content", directory=directory)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("database went away")
+
+        bulk_case_update = uploads.utils.bulk_case_update
+        uploads.utils.bulk_case_update = fail
+        try:
+            self.assertRaises(RuntimeError, uploads.collect_garbage, migrate=True)
+        finally:
+            uploads.utils.bulk_case_update = bulk_case_update
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(models.TestInstance.objects.get(pk=ti.pk).string_value, "file.txt")
+
+        self.assertEqual(uploads.collect_garbage(migrate=True).migrated, 1)
+        self.assertFalse(os.path.exists(path))
+
+    #----------------------------------------------------------------------
+    def test_process_file_upload_form(self):
+        from qatrack.qa.views.perform import process_file_upload_form
+
+        class Form(object):
+            unit_test_info = self.uti
+            in_progress = False
+            cleaned_data = {"skipped": False, "string_value": "upload.txt"}
+
+        self.write("upload.txt", "content")
+        form = Form()
+        process_file_upload_form(form, self.tli)
+
+        reference = form.cleaned_data["string_value"]
+        self.assertEqual(uploads.parse_reference(reference), (hashlib.sha256("content").hexdigest(), "upload.txt"))
+        self.assertTrue(os.path.exists(uploads.blob_path(reference)))
+
+        # already stored
+        process_file_upload_form(form, self.tli)
+        self.assertEqual(form.cleaned_data["string_value"], reference)
+
+    #----------------------------------------------------------------------
+    def write_image(self, name, rows, cols):
+        import numpy
+        from matplotlib import image
+        path = os.path.join(self.tmp, name)
+        image.imsave(path, numpy.random.random((rows, cols)))
+        return path
+
+    #----------------------------------------------------------------------
+    def test_make_thumbnail(self):
+        from matplotlib import image
+
+        self.test.display_image = True
+        self.test.save()
+
+        ti = self.create_instance(uploads.store_blob(self.write_image("image.png", 300, 600)))
+        self.assertIsNone(ti.thumbnail_url())
+        self.assertTrue(thumbnails.can_thumbnail(ti.string_value))
+
+        path = thumbnails.make_thumbnail(ti.string_value, size=100)
+        self.assertEqual(os.path.dirname(path), os.path.dirname(uploads.blob_path(ti.string_value)))
+        self.assertEqual(image.imread(path).shape[:2], (50, 100))
+        self.assertTrue(ti.thumbnail_url().endswith(".thumb.png"))
+
+        bad = uploads.store_blob(self.write("bad.png", "not an image"))
+        self.assertFalse(thumbnails.can_thumbnail(bad))
+        self.assertRaises(IOError, thumbnails.make_thumbnail, bad)
+
+    #----------------------------------------------------------------------
+    def test_thumbnail_garbage(self):
+
+        day = 24 * 60 * 60
+        kept = self.create_instance(uploads.store_blob(self.write_image("kept.png", 10, 10)))
+        gone = uploads.store_blob(self.write_image("gone.png", 20, 20))
+
+        for reference in (kept.string_value, gone):
+            path = thumbnails.make_thumbnail(reference)
+            os.utime(path, (time.time() - 2 * day,) * 2)
+
+        summary = uploads.collect_garbage(max_age=0)
+        self.assertEqual(summary.blobs_removed, 2)
+        self.assertTrue(thumbnails.has_thumbnail(kept.string_value))
+        self.assertFalse(thumbnails.has_thumbnail(gone))
+
+    #----------------------------------------------------------------------
+    def test_schedule_after_upload(self):
+        from qatrack.qa.views.perform import process_file_upload_form
+
+        self.test.display_image = True
+        self.test.save()
+
+        class Form(object):
+            unit_test_info = self.uti
+            in_progress = False
+            cleaned_data = {"skipped": False, "string_value": "upload.png"}
+
+        self.write_image("upload.png", 10, 10)
+        form = Form()
+        process_file_upload_form(form, self.tli)
+        thumbnails.wait()
+
+        self.assertTrue(thumbnails.has_thumbnail(form.cleaned_data["string_value"]))
+
+        # files that can't be decoded aren't scheduled
+        form.cleaned_data["string_value"] = "upload.dcm"
+        self.write("upload.dcm", "DICM")
+        process_file_upload_form(form, self.tli)
+        thumbnails.wait()
+
+        self.assertFalse(thumbnails.has_thumbnail(form.cleaned_data["string_value"]))
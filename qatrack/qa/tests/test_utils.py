@@ -1,6 +1,6 @@
 from django.test import TestCase
 
-from qatrack.qa import utils as qautils
+from qatrack.qa import models, utils as qautils
 import json
 
 
@@ -53,3 +53,108 @@ class TestUtils(TestCase):
 
         for number, prec, expected in numbers:
             self.assertEqual(qautils.to_precision(number, prec), expected)
+
+
+#============================================================================
+class TestQueryBudget(TestCase):
+
+    #----------------------------------------------------------------------
+    def test_records_queries(self):
+        with qautils.QueryBudget() as budget:
+            list(models.Test.objects.all())
+            list(models.TestList.objects.all())
+        self.assertEqual(len(budget), 2)
+
+    #----------------------------------------------------------------------
+    def test_max_queries(self):
+        def run():
+            with qautils.QueryBudget(max_queries=1):
+                list(models.Test.objects.all())
+                list(models.TestList.objects.all())
+        self.assertRaises(qautils.QueryBudgetExceeded, run)
+
+    #----------------------------------------------------------------------
+    def test_repeated(self):
+        with qautils.QueryBudget() as budget:
+            for pk in range(1, 4):
+                list(models.Test.objects.filter(pk=pk))
+            list(models.TestList.objects.all())
+
+        repeated = budget.repeated()
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][1], 3)
+
+    #----------------------------------------------------------------------
+    def test_max_repeats(self):
+        def run():
+            with qautils.QueryBudget(max_repeats=2):
+                for pk in range(1, 4):
+                    list(models.Test.objects.filter(pk=pk))
+        self.assertRaises(qautils.QueryBudgetExceeded, run)
+
+    #----------------------------------------------------------------------
+    def test_decorator(self):
+
+        @qautils.QueryBudget(max_queries=1)
+        def queries(n):
+            for i in range(n):
+                list(models.Test.objects.all())
+            return n
+
+        self.assertEqual(queries(1), 1)
+        self.assertRaises(qautils.QueryBudgetExceeded, queries, 2)
+
+    #----------------------------------------------------------------------
+    def test_nested(self):
+        with qautils.QueryBudget() as outer:
+            with qautils.QueryBudget() as inner:
+                list(models.Test.objects.all())
+            list(models.TestList.objects.all())
+        self.assertEqual(len(inner), 1)
+        self.assertEqual(len(outer), 2)
+
+    #----------------------------------------------------------------------
+    def test_request_started(self):
+        """queries made before a request (e.g. by the test client) starts are kept"""
+        from django.core.signals import request_started
+        with qautils.QueryBudget() as budget:
+            list(models.Test.objects.all())
+            request_started.send(sender=self.__class__)
+            list(models.TestList.objects.all())
+        self.assertEqual(len(budget), 2)
+
+    #----------------------------------------------------------------------
+    def test_request_started_after_reconnect(self):
+        """assertNumQueries reconnects reset_queries after the budget's receiver"""
+        from django.core.signals import request_started
+        with self.assertNumQueries(0):
+            pass
+        with qautils.QueryBudget() as budget:
+            list(models.Test.objects.all())
+            request_started.send(sender=self.__class__)
+        self.assertEqual(len(budget), 1)
+
+    #----------------------------------------------------------------------
+    def test_other_threads_reset(self):
+        """requests in other threads still reset their query log"""
+        import threading
+        from django.core.signals import request_started
+        from django.db import connection
+
+        queries = []
+
+        def request():
+            connection.queries = [{"sql": "SELECT 1", "time": "0.000"}]
+            request_started.send(sender=self.__class__)
+            queries.extend(connection.queries)
+
+        with qautils.QueryBudget():
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+        self.assertEqual(queries, [])
+
+    #----------------------------------------------------------------------
+    def test_fingerprint(self):
+        sql = "SELECT * FROM t WHERE a = 'x' AND b IN (1, 2,  3)"
+        self.assertEqual(qautils.fingerprint(sql), "SELECT * FROM t WHERE a = ? AND b IN (...)")
@@ -1,13 +1,15 @@
 from urllib import urlencode
 
 from django.conf import settings
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import User, Group, Permission
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import RequestFactory
 from django.test.utils import setup_test_environment
 from django.utils import unittest, timezone
 from qatrack.qa import models, views
+from qatrack.qa import utils as qautils
 from qatrack.qa.views import forms
 
 import calendar
@@ -16,6 +18,7 @@ import qatrack.qa.views.charts
 import qatrack.qa.views.review
 import qatrack.qa.views.base
 import qatrack.qa.views.backup
+import qatrack.qa.paper
 from qatrack.data_tables.views import BaseDataTablesDataSource
 import django.forms
 import json
@@ -25,6 +28,19 @@ import random
 import StringIO
 import utils
 
+# Maximum number of queries allowed for key views (with a cold cache). If a
+# change legitimately requires more queries, update the budget here.
+QUERY_BUDGETS = {
+    "perform_get": 19,
+    "perform_get_cached": 14,
+    "perform_post": 25,
+    "review_get": 20,
+    "review_post": 23,
+    "utc_list": 9,
+    "charts": 11,
+    "chart_data": 9,
+}
+
 
 logger = qatrack.qa.views.base.logger
 
@@ -195,6 +211,19 @@ class TestDataTables(TestCase):
 
         self.client.get(url, data=data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
 
+    #----------------------------------------------------------------------
+    def test_utc_list_query_budget(self):
+        """number of queries must not depend on the number of rows displayed"""
+
+        for i in range(3, 8):
+            unit = utils.create_unit(number=i, name="u%d" % i)
+            utc = utils.create_unit_test_collection(unit=unit, test_collection=self.utc.tests_object, frequency=self.utc.frequency)
+            utils.create_test_list_instance(unit_test_collection=utc)
+
+        cache.clear()
+        with qautils.QueryBudget(max_queries=QUERY_BUDGETS["utc_list"], max_repeats=2):
+            self.client.get(self.url, data={"iDisplayLength": 100}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
 
 #============================================================================
 class TestControlImage(TestCase):
@@ -560,6 +589,49 @@ class TestChartData(TestCase):
 
         self.assertEqual(resp.get('Content-Disposition'), 'attachment; filename="qatrackexport.csv"')
 
+    #----------------------------------------------------------------------
+    def test_chart_data_not_modified(self):
+        data = {
+            "tests[]": [self.test1.pk],
+            "test_lists[]": [self.tl1.pk],
+            "units[]": [self.utc1.unit.pk],
+            "statuses[]": [self.status.pk],
+        }
+        etag = self.client.get(self.url, data=data)["ETag"]
+
+        # session & user only
+        with qautils.QueryBudget(max_queries=2):
+            resp = self.client.get(self.url, data=data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        tli = utils.create_test_list_instance(unit_test_collection=self.utc1)
+        utils.create_test_instance(value=2., status=self.status, unit_test_info=self.uti1, test_list_instance=tli)
+        resp = self.client.get(self.url, data=data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+
+    #----------------------------------------------------------------------
+    def test_chart_view_query_budget(self):
+        cache.clear()
+        with qautils.QueryBudget(max_queries=QUERY_BUDGETS["charts"], max_repeats=1):
+            self.client.get(reverse("charts"))
+
+    #----------------------------------------------------------------------
+    def test_chart_data_query_budget(self):
+        data = {
+            "tests[]": [self.test1.pk, self.test2.pk],
+            "test_lists[]": [self.tl1.pk, self.tl2.pk],
+            "units[]": [self.utc1.unit.pk],
+            "statuses[]": [self.status.pk],
+        }
+
+        # one query per unit/test list/test combination is expected
+        n_series = 2 * 2
+        for url in (self.url, reverse("charts_export_csv")):
+            cache.clear()
+            with qautils.QueryBudget(max_queries=QUERY_BUDGETS["chart_data"], max_repeats=n_series):
+                self.client.get(url, data=data)
+
 
 #============================================================================
 class TestComposite(TestCase):
@@ -901,6 +973,17 @@ class TestPerformQA(TestCase):
         self.assertTrue(isinstance(widget, django.forms.Select))
         self.assertEqual(widget.choices, [('', ''), (0, 'c1'), (1, 'c2'), (2, 'c3')])
 
+    #----------------------------------------------------------------------
+    def test_widgets_shared(self):
+        utis = models.UnitTestInfo.objects.filter(test__in=[self.t_bool, self.t_mult, self.t_const]).order_by("test__name")
+        formset = forms.CreateTestInstanceFormSet(unit_test_infos=list(utis) * 2, user=self.user)
+        n = len(utis)
+
+        for form, other in zip(formset.forms[:n], formset.forms[n:]):
+            shared = form.unit_test_info.test.type != models.CONSTANT
+            self.assertEqual(form.fields["value"].widget is other.fields["value"].widget, shared)
+            self.assertEqual(form.fields["value"].widget.attrs["class"], "qa-input")
+
     #---------------------------------------------------------------------------
     def test_perform_in_progress(self):
         data = {
@@ -920,6 +1003,34 @@ class TestPerformQA(TestCase):
         # user is redirected if form submitted successfully
         self.assertEqual(response.status_code, 302)
 
+    #---------------------------------------------------------------------------
+    def test_perform_get_query_budget(self):
+        """number of queries must not depend on the number of tests in the list"""
+
+        cache.clear()
+        with qautils.QueryBudget(max_queries=QUERY_BUDGETS["perform_get"], max_repeats=2):
+            self.client.get(self.url)
+
+        # test list structure is cached after the first request
+        with qautils.QueryBudget(max_queries=QUERY_BUDGETS["perform_get_cached"], max_repeats=2):
+            self.client.get(self.url)
+
+    #---------------------------------------------------------------------------
+    def test_perform_post_query_budget(self):
+        data = {
+            "work_started": "11-07-2012 00:09",
+            "status": self.status.pk,
+            "form-TOTAL_FORMS": len(self.tests),
+            "form-INITIAL_FORMS": len(self.tests),
+            "form-MAX_NUM_FORMS": "",
+        }
+        self.set_form_data(data)
+
+        cache.clear()
+        with qautils.QueryBudget(max_queries=QUERY_BUDGETS["perform_post"], max_repeats=2):
+            response = self.client.post(self.url, data=data)
+        self.assertEqual(response.status_code, 302)
+
     #---------------------------------------------------------------
     def set_form_data(self, data):
         for test_idx, uti in enumerate(self.unit_test_infos):
@@ -1277,6 +1388,44 @@ result = json.load(FILE)
         data = json.loads(response.content)
         self.assertEqual(data["result"]["baz"]["baz1"], "test")
 
+    #---------------------------------------------------------------
+    def test_upload_sha256(self):
+        import hashlib
+        content = self.test_file.getvalue()
+        response = self.client.post(self.url, {"test_id": self.test.pk, "upload": self.test_file, "meta": "{}"})
+        data = json.loads(response.content)
+        self.assertEqual(data["sha256"], hashlib.sha256(content).hexdigest())
+
+    #---------------------------------------------------------------
+    def test_upload_buffer(self):
+        self.test.calculation_procedure = "import json\nresult = json.loads(BUFFER[:])['bar']"
+        self.test.save()
+        response = self.client.post(self.url, {"test_id": self.test.pk, "upload": self.test_file, "meta": "{}"})
+        data = json.loads(response.content)
+        self.assertEqual(data["result"], [1, 2, 3, 4])
+
+    #---------------------------------------------------------------
+    def test_save_temporary_upload(self):
+        import hashlib
+        from django.core.files.uploadedfile import TemporaryUploadedFile
+        from qatrack.qa import uploads
+
+        content = "x" * (3 * 1024 * 1024)
+        f = TemporaryUploadedFile("big.txt", "text/plain", len(content), None)
+        f.write(content)
+        f.seek(0)
+
+        upload = uploads.save_upload(f, "TESTRUNNER_big.txt")
+        self.assertFalse(os.path.exists(f.temporary_file_path()))
+        self.assertEqual(upload.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual((upload.size, len(upload.buffer)), (len(content), len(content)))
+        self.assertEqual(upload.file.read(10), "x" * 10)
+        upload.close()
+
+        # temporary upload files are only readable by their owner
+        if settings.FILE_UPLOAD_PERMISSIONS is None:
+            self.assertEqual(os.stat(upload.path).st_mode & 0777, 0666 & ~uploads.UMASK)
+
 
 #============================================================================
 class TestBaseEditTestListInstance(TestCase):
@@ -1567,8 +1716,148 @@ class TestReviewTestListInstance(TestCase):
         tli = models.TestListInstance.objects.get(pk=self.tli.pk)
         self.assertFalse(tli.all_reviewed)
 
+    #----------------------------------------------------------------------
+    def test_review_query_budget(self):
+
+        cache.clear()
+        with qautils.QueryBudget(max_queries=QUERY_BUDGETS["review_get"], max_repeats=1):
+            self.client.get(self.url)
+
+        self.base_data.update({"testinstance_set-0-status": self.review_status.pk})
+        cache.clear()
+        with qautils.QueryBudget(max_queries=QUERY_BUDGETS["review_post"], max_repeats=1):
+            self.client.post(self.url, data=self.base_data)
+
 
 #============================================================================
+class TestBulkReview(TestCase):
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+
+        self.status = utils.create_status()
+        self.review_status = utils.create_status(name="reviewed", slug="reviewed", is_default=False)
+        self.review_status.requires_review = False
+        self.review_status.save()
+
+        self.test_list = utils.create_test_list()
+        self.test = utils.create_test(name="test_simple")
+        utils.create_test_list_membership(self.test_list, self.test)
+
+        self.utc = utils.create_unit_test_collection(test_collection=self.test_list)
+        uti = models.UnitTestInfo.objects.get(unit=self.utc.unit, test=self.test)
+
+        self.tlis = []
+        for i in range(3):
+            tli = utils.create_test_list_instance(
+                unit_test_collection=self.utc,
+                work_completed=timezone.now() - timezone.timedelta(days=i),
+            )
+            ti = utils.create_test_instance(unit_test_info=uti, value=1, status=self.status)
+            ti.test_list_instance = tli
+            ti.save()
+            self.tlis.append(tli)
+
+        self.url = reverse("bulk_review")
+        self.client.login(username="user", password="password")
+        self.user = User.objects.get(username="user")
+        models.unreviewed_counter.reset()
+
+    #----------------------------------------------------------------------
+    def test_review(self):
+
+        self.assertEqual(models.unreviewed_counter.get(), 3)
+
+        data = {"status": self.review_status.pk, "tli": [tli.pk for tli in self.tlis[:2]]}
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, 302)
+
+        reviewed = models.TestListInstance.objects.filter(all_reviewed=True, reviewed_by=self.user)
+        self.assertEqual(set(reviewed.values_list("pk", flat=True)), set(tli.pk for tli in self.tlis[:2]))
+        self.assertEqual(models.TestInstance.objects.filter(status=self.review_status).count(), 2)
+        self.assertEqual(models.unreviewed_counter.get(), 1)
+
+    #----------------------------------------------------------------------
+    def test_invalid_updates_due_date(self):
+
+        self.utc.set_due_date()
+        self.utc = models.UnitTestCollection.objects.get(pk=self.utc.pk)
+        delta = self.utc.frequency.due_delta()
+        self.assertEqual(self.utc.due_date, self.tlis[0].work_completed + delta)
+
+        invalid = utils.create_status(name="invalid", slug="invalid", is_default=False)
+        invalid.valid = False
+        invalid.save()
+
+        self.client.post(self.url, {"status": invalid.pk, "tli": [self.tlis[0].pk]})
+
+        utc = models.UnitTestCollection.objects.get(pk=self.utc.pk)
+        self.assertEqual(utc.due_date, self.tlis[1].work_completed + delta)
+
+    #----------------------------------------------------------------------
+    def test_review_own_not_allowed(self):
+
+        self.user.is_superuser = False
+        self.user.save()
+        self.user.user_permissions.add(Permission.objects.get(codename="can_review"))
+
+        data = {"status": self.review_status.pk, "tli": [tli.pk for tli in self.tlis]}
+        self.client.post(self.url, data)
+
+        self.assertEqual(models.TestListInstance.objects.filter(all_reviewed=True).count(), 0)
+        self.assertEqual(models.TestInstance.objects.filter(status=self.review_status).count(), 0)
+
+    #----------------------------------------------------------------------
+    def test_skipped_own_count(self):
+
+        self.user.is_superuser = False
+        self.user.save()
+        self.user.user_permissions.add(Permission.objects.get(codename="can_review"))
+
+        in_progress = self.tlis[2]
+        in_progress.in_progress = True
+        in_progress.save()
+
+        data = {"status": self.review_status.pk, "tli": [tli.pk for tli in self.tlis] + [999999]}
+        response = self.client.post(self.url, data, follow=True)
+
+        warnings = [m.message for m in response.context["messages"]]
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue(warnings[0].startswith("2 test lists were not reviewed"))
+
+    #----------------------------------------------------------------------
+    def test_redirect_next(self):
+        url = self.url + "?next=" + reverse("home")
+        response = self.client.post(url, {"status": self.review_status.pk, "tli": [self.tlis[0].pk]})
+        self.assertTrue(response["Location"].endswith(reverse("home")))
+
+    #----------------------------------------------------------------------
+    def test_redirect_unsafe_next(self):
+        url = self.url + "?next=http://example.com/"
+        response = self.client.post(url, {"status": self.review_status.pk, "tli": [self.tlis[0].pk]})
+        self.assertTrue(response["Location"].endswith(reverse("unreviewed")))
+
+    #----------------------------------------------------------------------
+    def test_no_permission(self):
+
+        self.user.is_superuser = False
+        self.user.save()
+
+        response = self.client.post(self.url, {"status": self.review_status.pk, "tli": [self.tlis[0].pk]})
+        self.assertEqual(response.status_code, 403)
+
+    #----------------------------------------------------------------------
+    def test_get_not_allowed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 405)
+
+    #----------------------------------------------------------------------
+    def test_unreviewed_has_checkboxes(self):
+        response = self.client.get(reverse("unreviewed"))
+        self.assertContains(response, 'id="bulk-review-form"')
+
+
+#====================================================================================
 class TestDueDateOverView(TestCase):
 
     #----------------------------------------------------------------------
@@ -1776,6 +2065,59 @@ class TestPaperForms(TestCase):
 
         response = self.client.get(self.url + "?" + q)
         self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "test_simple")
+
+    #----------------------------------------------------------------------
+    def create_cycle_utc(self):
+
+        unit = utils.create_unit(name="unit2", number=2)
+        test_lists = [utils.create_test_list(name="day%d" % n) for n in range(2)]
+        tests = [utils.create_test(name="cycle test %d" % n) for n in range(4)]
+        for n, test in enumerate(tests):
+            utils.create_test_list_membership(test_lists[n // 2], test, order=-n)
+        cycle = utils.create_cycle(test_lists=test_lists)
+        utils.create_unit_test_collection(unit=unit, frequency=self.frequencies["daily"], test_collection=cycle, assigned_to=self.utc.assigned_to)
+        return unit, test_lists, tests
+
+    #----------------------------------------------------------------------
+    def test_documents(self):
+
+        unit, test_lists, tests = self.create_cycle_utc()
+        utcs = qatrack.qa.paper.unit_test_collections(
+            models.Unit.objects.values_list("pk", flat=True),
+            models.Frequency.objects.values_list("pk", flat=True),
+            Group.objects.values_list("pk", flat=True),
+        )
+        categories = list(models.Category.objects.values_list("pk", flat=True))
+
+        qatrack.qa.paper.paper_documents(utcs, categories)
+        # utcs, test lists, cycles & utis
+        with qautils.QueryBudget(max_queries=4):
+            documents = qatrack.qa.paper.paper_documents(utcs, categories)
+
+        self.assertEqual([d.unit for d in documents], [self.utc.unit, unit])
+        self.assertEqual([f.name for f in documents[1].forms], ["day0", "day1"])
+        self.assertEqual([uti.test for uti in documents[1].forms[0].utis], [tests[1], tests[0]])
+        self.assertEqual([uti.test for uti in documents[0].forms[0].utis], [self.test])
+
+    #----------------------------------------------------------------------
+    def test_zip(self):
+        import tempfile
+        import zipfile
+        from django.core.management import call_command
+
+        self.create_cycle_utc()
+
+        path = tempfile.mktemp(suffix=".zip")
+        try:
+            call_command("paper_forms", path, stdout=StringIO.StringIO())
+            archive = zipfile.ZipFile(path)
+            self.assertEqual(archive.namelist(), ["1-unit.html", "2-unit2.html"])
+            self.assertIn("cycle test 3", archive.read("2-unit2.html"))
+            self.assertNotIn("cycle test 3", archive.read("1-unit.html"))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+"""
+Size bounded thumbnails of uploaded images.
+
+Thumbnails are generated once, after a test list with image upload tests
+(tests with display_image set) is submitted, by a background thread so
+that submitting a test list never waits on image processing:
+
+    schedule(reference)
+
+The thumbnail is written next to the uploaded file in the blob store
+(see uploads.thumbnail_path) and is used in place of the full size image
+on the review, detail & history pages once it exists.  Only images
+matplotlib can decode get thumbnails: PNG natively and JPEG, GIF, BMP &
+TIFF via Pillow (listed in requirements/base.txt; without it only PNG
+files get thumbnails, see can_thumbnail).  For other uploads the detail
+& history pages just link to the file.
+
+The queue is held in memory by the web process that received the upload,
+so there is no separate task queue to deploy, but:
+
+* references still queued when a worker process exits or is recycled
+  (e.g. a restart or mod_wsgi maximum-requests) are lost
+* the worker thread only runs under WSGI servers that allow application
+  threads.  Apache/mod_wsgi (the supported deployment) & the development
+  server do; uWSGI must be started with --enable-threads.
+
+Missing thumbnails, including those for images uploaded before thumbnails
+were introduced, are generated by the make_thumbnails management command
+which can be run periodically (e.g. nightly from cron) to pick up any
+lost work.
+"""
+
+import imghdr
+import logging
+import os
+import Queue
+import threading
+
+from django.conf import settings
+
+import uploads
+
+# maximum width & height of thumbnails in pixels
+THUMBNAIL_SIZE = getattr(settings, "THUMBNAIL_SIZE", 256)
+
+logger = logging.getLogger('qatrack.console')
+
+# matplotlib reads PNG files itself and other formats only via PIL
+try:
+    import PIL  # NOQA
+    READABLE_FORMATS = ("png", "jpeg", "gif", "bmp", "tiff")
+except ImportError:
+    READABLE_FORMATS = ("png",)
+
+_queue = Queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+#----------------------------------------------------------------------
+def make_thumbnail(reference, size=THUMBNAIL_SIZE):
+    """Write a thumbnail no larger than size x size pixels of the blob
+    referred to by reference and return its path.  Images are read with
+    matplotlib which reads PNG files natively and other formats when PIL
+    is installed. Raises IOError if the image can't be read or written."""
+
+    # imported here since matplotlib is slow to import
+    from matplotlib import image
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    try:
+        img = image.imread(uploads.blob_path(reference))
+    except Exception as e:
+        # matplotlib raises a variety of errors for unreadable files
+        raise IOError("Unable to read image %s: %s" % (reference, e))
+
+    rows, cols = img.shape[:2]
+    scale = min(1., float(size) / max(rows, cols))
+
+    dpi = 100.
+    fig = Figure(figsize=(max(1, int(cols * scale)) / dpi, max(1, int(rows * scale)) / dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1], frameon=False, xticks=[], yticks=[])
+    ax.imshow(img, aspect="auto", interpolation="bilinear", cmap="gray" if img.ndim == 2 else None)
+
+    # written to a temporary name so a partial thumbnail is never served
+    path = uploads.thumbnail_path(reference)
+    tmp_path = path + ".part"
+    try:
+        with open(tmp_path, "wb") as f:
+            fig.savefig(f, dpi=dpi, format="png")
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    uploads.set_permissions(path)
+    return path
+
+
+#----------------------------------------------------------------------
+def can_thumbnail(reference):
+    """True if the blob referred to by reference is an image that can be read"""
+    try:
+        return imghdr.what(uploads.blob_path(reference)) in READABLE_FORMATS
+    except IOError:
+        return False
+
+
+#----------------------------------------------------------------------
+def has_thumbnail(reference):
+    return os.path.exists(uploads.thumbnail_path(reference))
+
+
+#----------------------------------------------------------------------
+def _work():
+    while True:
+        reference = _queue.get()
+        try:
+            if not has_thumbnail(reference):
+                make_thumbnail(reference)
+        except Exception as e:
+            logger.warning("Thumbnail generation failed for %s: %s" % (reference, e))
+        finally:
+            _queue.task_done()
+
+
+#----------------------------------------------------------------------
+def schedule(reference):
+    """queue generation of a thumbnail for reference in the background"""
+
+    global _worker
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name="thumbnails")
+            _worker.daemon = True
+            _worker.start()
+
+    _queue.put(reference)
+
+
+#----------------------------------------------------------------------
+def wait():
+    """block until all scheduled thumbnails have been generated"""
+    _queue.join()
@@ -0,0 +1,391 @@
+"""
+Handling of files uploaded for file upload tests.
+
+Uploaded files are written to TMP_UPLOAD_ROOT in chunks while their
+sha256 digest is calculated so that neither the upload nor the digest
+calculation requires holding the whole file in memory.  When Django has
+already spooled a (large) upload to a temporary file on disk it is hashed
+in chunks and moved into place rather than copied:
+
+    upload = save_upload(request.FILES["upload"], name)
+
+Calculation procedures are given the upload as an open file handle (FILE)
+as well as a read only memory mapped buffer (BUFFER) so that procedures
+can work with large image & DICOM files without reading them into memory.
+
+When a test list is submitted, uploads are moved from TMP_UPLOAD_ROOT to
+content addressed storage where each distinct file is stored only once:
+
+    UPLOAD_ROOT/blobs/<first 2 digits of sha256>/<sha256><extension>
+
+and the TestInstance.string_value refers to the file by its digest and
+original name (see make_reference):
+
+    sha256/<sha256>/<original name>
+
+Older uploads stored under UPLOAD_ROOT/<test list instance pk>/<name> are
+still supported and can be moved to the blob store with the clean_uploads
+management command which also removes abandoned temporary uploads and
+blobs no longer referenced by any TestInstance (see collect_garbage).
+
+Thumbnails of uploaded images (see thumbnails) are stored next to their
+blob as <sha256>.thumb.png and are removed along with it.
+"""
+
+import collections
+import hashlib
+import itertools
+import mmap
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+
+import models
+import utils
+
+CHUNK_SIZE = getattr(settings, "UPLOAD_CHUNK_SIZE", 1024 * 1024)
+
+BLOB_DIR = "blobs"
+REFERENCE_PREFIX = "sha256/"
+THUMBNAIL_SUFFIX = ".thumb.png"
+
+GCSummary = collections.namedtuple("GCSummary", "temp_removed blobs_removed migrated bytes_freed complete")
+
+
+#============================================================================
+class StoredUpload(object):
+    """an uploaded file saved to disk"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, path, sha256, size):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.sha256 = sha256
+        self.size = size
+        self._file = None
+        self._buffer = None
+
+    #----------------------------------------------------------------------
+    @property
+    def file(self):
+        """file handle (opened on first use) positioned at start of file"""
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        return self._file
+
+    #----------------------------------------------------------------------
+    @property
+    def buffer(self):
+        """read only memory mapped buffer (None for empty files)"""
+        if self._buffer is None and self.size:
+            self._buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._buffer
+
+    #----------------------------------------------------------------------
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+        if self._file is not None:
+            self._file.close()
+        self._file = self._buffer = None
+
+
+#----------------------------------------------------------------------
+def file_digest(path):
+    """return (sha256 hex digest, size) of file at path, read in chunks"""
+
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+#----------------------------------------------------------------------
+def _get_umask():
+    # os.umask can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# read once at import since changing the umask isn't thread safe
+UMASK = _get_umask()
+
+
+#----------------------------------------------------------------------
+def set_permissions(path):
+    """Set permissions of a stored file to FILE_UPLOAD_PERMISSIONS or, if
+    that isn't set, to those of a newly created file.  Files moved from
+    Django's temporary upload files would otherwise be readable by their
+    owner only (and so e.g. can't be served by the front end web server)"""
+
+    if settings.FILE_UPLOAD_PERMISSIONS is not None:
+        os.chmod(path, settings.FILE_UPLOAD_PERMISSIONS)
+    else:
+        os.chmod(path, 0666 & ~UMASK)
+
+
+#----------------------------------------------------------------------
+def save_upload(uploaded_file, name, directory=None):
+    """Write uploaded_file (a Django UploadedFile) to directory (default
+    TMP_UPLOAD_ROOT) as name and return a StoredUpload"""
+
+    directory = directory or settings.TMP_UPLOAD_ROOT
+    path = os.path.join(directory, name)
+
+    if hasattr(uploaded_file, "temporary_file_path"):
+        # already on disk, no need to write it again
+        sha256, size = file_digest(uploaded_file.temporary_file_path())
+        file_move_safe(uploaded_file.temporary_file_path(), path, allow_overwrite=True)
+        # temp file is gone so nothing for close to clean up
+        uploaded_file.close()
+        set_permissions(path)
+        return StoredUpload(path, sha256, size)
+
+    digest = hashlib.sha256()
+    size = 0
+
+    # write to a temporary name first so a partially written file
+    # is never seen under its final name
+    tmp_path = path + ".part"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in uploaded_file.chunks(CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        file_move_safe(tmp_path, path, allow_overwrite=True)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    set_permissions(path)
+    return StoredUpload(path, digest.hexdigest(), size)
+
+
+#----------------------------------------------------------------------
+def blob_root():
+    return os.path.join(settings.UPLOAD_ROOT, BLOB_DIR)
+
+
+#----------------------------------------------------------------------
+def is_reference(value):
+    return bool(value) and value.startswith(REFERENCE_PREFIX)
+
+
+#----------------------------------------------------------------------
+def make_reference(sha256, name):
+    """string_value for a stored blob with digest sha256 uploaded as name"""
+    reference = "%s%s/" % (REFERENCE_PREFIX, sha256)
+    return reference + name[:models.MAX_STRING_VAL_LEN - len(reference)]
+
+
+#----------------------------------------------------------------------
+def parse_reference(reference):
+    """return (sha256, name) for a blob reference"""
+    sha256, name = reference[len(REFERENCE_PREFIX):].split("/", 1)
+    return sha256, name
+
+
+#----------------------------------------------------------------------
+def blob_name(sha256, name):
+    return sha256 + os.path.splitext(name)[1].lower()
+
+
+#----------------------------------------------------------------------
+def blob_path(reference):
+    sha256, name = parse_reference(reference)
+    return os.path.join(blob_root(), sha256[:2], blob_name(sha256, name))
+
+
+#----------------------------------------------------------------------
+def blob_url(reference):
+    sha256, name = parse_reference(reference)
+    return "%s%s/%s/%s" % (settings.UPLOADS_URL, BLOB_DIR, sha256[:2], blob_name(sha256, name))
+
+
+#----------------------------------------------------------------------
+def thumbnail_path(reference):
+    sha256, name = parse_reference(reference)
+    return os.path.join(blob_root(), sha256[:2], sha256 + THUMBNAIL_SUFFIX)
+
+
+#----------------------------------------------------------------------
+def thumbnail_url(reference):
+    sha256, name = parse_reference(reference)
+    return "%s%s/%s/%s" % (settings.UPLOADS_URL, BLOB_DIR, sha256[:2], sha256 + THUMBNAIL_SUFFIX)
+
+
+#----------------------------------------------------------------------
+def store_blob(path, name=None, sha256=None, keep=False):
+    """Move (or copy if keep is True) the file at path into the blob store
+    (or just remove it if an identical file is already stored) and return
+    its reference"""
+
+    name = name or os.path.basename(path)
+    if sha256 is None:
+        sha256, size = file_digest(path)
+
+    reference = make_reference(sha256, name)
+    dest = blob_path(reference)
+
+    if os.path.exists(dest):
+        # the stored blob may be old & unreferenced so touch it to
+        # prevent collect_garbage removing it before it is referenced
+        os.utime(dest, None)
+        if not keep:
+            os.remove(path)
+        return reference
+
+    if not os.path.isdir(os.path.dirname(dest)):
+        try:
+            os.makedirs(os.path.dirname(dest))
+        except OSError:
+            # created by another process
+            if not os.path.isdir(os.path.dirname(dest)):
+                raise
+
+    if keep:
+        tmp_path = dest + ".part"
+        shutil.copyfile(path, tmp_path)
+        file_move_safe(tmp_path, dest, allow_overwrite=True)
+        set_permissions(dest)
+    else:
+        file_move_safe(path, dest, allow_overwrite=True)
+
+    return reference
+
+
+#----------------------------------------------------------------------
+def upload_values():
+    """set of all string_values of file upload TestInstances"""
+
+    values = models.TestInstance.objects.filter(
+        unit_test_info__test__type=models.UPLOAD,
+    ).exclude(string_value="").values_list("string_value", flat=True)
+
+    return set(values.iterator())
+
+
+#----------------------------------------------------------------------
+def _stale_files(directory, max_age, recursive=False):
+    """yield (path, name, size) for files in directory not modified for max_age seconds"""
+
+    if not os.path.isdir(directory):
+        return
+
+    cutoff = time.time() - max_age
+    walk = os.walk(directory) if recursive else [(directory, None, os.listdir(directory))]
+    for dirpath, _, names in walk:
+        for name in sorted(names):
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path) and stat.st_mtime < cutoff:
+                yield path, name, stat.st_size
+
+
+#----------------------------------------------------------------------
+def _legacy_uploads():
+    """yield (pk, path, name) for TestInstances with uploads stored per test list instance"""
+
+    tis = models.TestInstance.objects.filter(
+        unit_test_info__test__type=models.UPLOAD,
+        in_progress=False,
+    ).exclude(
+        string_value="",
+    ).exclude(
+        string_value__startswith=REFERENCE_PREFIX,
+    ).values_list("pk", "test_list_instance", "string_value")
+
+    # not using iterator() since the rows are updated as they are migrated
+    for pk, tli, name in list(tis):
+        path = os.path.join(settings.UPLOAD_ROOT, "%s" % tli, name)
+        if os.path.isfile(path):
+            yield pk, path, name
+
+
+#----------------------------------------------------------------------
+def collect_garbage(max_age=24 * 60 * 60, batch_size=500, max_seconds=None, migrate=False, dry_run=False):
+    """Remove temporary uploads & blobs which are not referenced by any
+    TestInstance and haven't been modified for max_age seconds.  If migrate
+    is True uploads stored per test list instance are first moved to the
+    blob store.  Work is done in batches of batch_size files and stops
+    (with complete=False in the returned GCSummary) after the first batch
+    finishing after max_seconds."""
+
+    deadline = time.time() + max_seconds if max_seconds else None
+    counts = collections.Counter()
+
+    def out_of_time():
+        return deadline is not None and time.time() > deadline
+
+    def batches(items):
+        items = iter(items)
+        while not out_of_time():
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def summary(complete):
+        return GCSummary(counts["temp_removed"], counts["blobs_removed"], counts["migrated"], counts["bytes_freed"], complete)
+
+    if migrate:
+        for batch in batches(_legacy_uploads()):
+            if not dry_run:
+                # originals are only removed once the rows referring to
+                # them have been updated so an interrupted migration never
+                # leaves a row pointing at a missing file
+                updates = dict((pk, (store_blob(path, name, keep=True),)) for pk, path, name in batch)
+                utils.bulk_case_update(models.TestInstance, ["string_value"], updates)
+                for pk, path, name in batch:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    try:
+                        # remove test list instance directory once empty
+                        os.rmdir(os.path.dirname(path))
+                    except OSError:
+                        pass
+            counts["migrated"] += len(batch)
+        if out_of_time():
+            return summary(False)
+
+    values = upload_values()
+    referenced = [parse_reference(v) for v in values if is_reference(v)]
+    referenced_blobs = set(blob_name(sha256, name) for sha256, name in referenced)
+    referenced_blobs.update(sha256 + THUMBNAIL_SUFFIX for sha256, name in referenced)
+
+    removals = [
+        ("temp_removed", _stale_files(settings.TMP_UPLOAD_ROOT, max_age), lambda name: name in values),
+        ("blobs_removed", _stale_files(blob_root(), max_age, recursive=True), lambda name: name in referenced_blobs),
+    ]
+
+    for kind, files, is_referenced in removals:
+        unreferenced = ((path, size) for path, name, size in files if not is_referenced(name))
+        for batch in batches(unreferenced):
+            cutoff = time.time() - max_age
+            for path, size in batch:
+                if not dry_run:
+                    try:
+                        # check again in case the file has been touched since being
+                        # listed (e.g. by store_blob for an identical upload)
+                        if os.stat(path).st_mtime >= cutoff:
+                            continue
+                        os.remove(path)
+                    except OSError:
+                        continue
+                counts[kind] += 1
+                counts["bytes_freed"] += size
+        if out_of_time():
+            return summary(False)
+
+    return summary(True)
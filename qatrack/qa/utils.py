@@ -1,6 +1,11 @@
+import collections
+import functools
 import json
 import math
+import re
 import StringIO
+import threading
+import time
 import tokenize
 import token
 
@@ -132,23 +137,238 @@ def almost_equal(a, b, significant=7):
     return abs(sc_b - sc_a) <= math.pow(10., -(significant - 1))
 
 
+#----------------------------------------------------------------------
+def chunks(seq, size):
+    """yield successive lists of length size from seq"""
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+#----------------------------------------------------------------------
+def bulk_case_update(model, fields, values, batch_size=500):
+    """Update many rows of model with a single UPDATE statement per batch.
+
+    fields is a sequence of field names and values is a dict mapping
+    primary keys to a tuple of new values (one per field). e.g.
+
+        bulk_case_update(UnitTestCollection, ["due_date"], {1: (d1,), 2: (d2,)})
+
+    results in SQL like:
+
+        UPDATE qa_unittestcollection SET due_date = CASE id WHEN 1 THEN d1 WHEN 2 THEN d2 ELSE due_date END
+        WHERE id IN (1, 2)
+
+    Note: no pre_save/post_save signals are sent for the updated rows.
+    Returns the number of rows updated.
+    """
+
+    from django.db import connection, transaction
+
+    if not values:
+        return 0
+
+    qn = connection.ops.quote_name
+    opts = model._meta
+    pk_col = qn(opts.pk.column)
+    model_fields = [opts.get_field(f) for f in fields]
+
+    # postgres can't infer the type of untyped parameters in a CASE expression
+    cast = connection.vendor == "postgresql"
+
+    cursor = connection.cursor()
+    updated = 0
+    for batch in chunks(sorted(values), batch_size):
+        sets, params = [], []
+        for idx, field in enumerate(model_fields):
+            col = qn(field.column)
+            then = "CAST(%%s AS %s)" % field.db_type(connection) if cast else "%s"
+            when = "WHEN %%s THEN %s" % then
+            sets.append("%s = CASE %s %s ELSE %s END" % (col, pk_col, " ".join([when] * len(batch)), col))
+            for pk in batch:
+                params.extend([pk, field.get_db_prep_save(values[pk][idx], connection=connection)])
+
+        sql = "UPDATE %s SET %s WHERE %s IN (%s)" % (
+            qn(opts.db_table), ", ".join(sets), pk_col, ", ".join(["%s"] * len(batch))
+        )
+        cursor.execute(sql, params + list(batch))
+        updated += cursor.rowcount
+
+    transaction.commit_unless_managed()
+
+    return updated
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_WHITESPACE = re.compile(r"\s+")
+
+
+#----------------------------------------------------------------------
+def fingerprint(sql):
+    """return sql with literals replaced by placeholders so that queries
+    which only differ by their parameters are grouped together"""
+
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+#============================================================================
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+# QueryBudgets currently recording in this thread
+_active_budgets = threading.local()
+_RESTORE_UID = "qatrack.qa.utils.QueryBudget"
+
+
+#----------------------------------------------------------------------
+def _restore_query_logs(**kwargs):
+    """request_started receiver (connected after Django's reset_queries)
+    which gives the connections recorded by QueryBudgets in this thread
+    their query log back, so that queries from requests made within a
+    budget (e.g. by the test client) are counted"""
+
+    for budget in getattr(_active_budgets, "budgets", ()):
+        budget.connection.queries = budget.log
+
+
+#============================================================================
+class QueryBudget(object):
+    """
+    Record the SQL executed within a block and optionally enforce a budget
+    on the total number of queries and on the number of times any single
+    query (after normalizing literals, see `fingerprint`) is repeated.
+    Repeated queries are usually a sign of an N+1 pattern e.g. a query per
+    row of a table.
+
+    Can be used as a context manager:
+
+        with QueryBudget(max_queries=10, max_repeats=1) as budget:
+            response = client.get(url)
+
+    or as a decorator:
+
+        @QueryBudget(max_queries=10)
+        def foo():
+            ...
+
+    QueryBudgetExceeded (an AssertionError so that it is reported as a test
+    failure) is raised on exit from the block if the budget was exceeded.
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, max_queries=None, max_repeats=None, using="default"):
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.using = using
+        self.queries = []
+        self.elapsed = 0.
+
+    #----------------------------------------------------------------------
+    def __enter__(self):
+        from django.core.signals import request_started
+        from django.db import connections
+
+        # receivers run in the order they were connected so this is reconnected
+        # on every entry to run after reset_queries, which e.g. assertNumQueries
+        # disconnects & reconnects
+        request_started.disconnect(dispatch_uid=_RESTORE_UID)
+        request_started.connect(_restore_query_logs, dispatch_uid=_RESTORE_UID)
+
+        self.connection = connections[self.using]
+        self.use_debug_cursor = self.connection.use_debug_cursor
+        self.connection.use_debug_cursor = True
+        self.log = self.connection.queries
+        self.start = len(self.log)
+        self.queries = []
+        if not hasattr(_active_budgets, "budgets"):
+            _active_budgets.budgets = []
+        _active_budgets.budgets.append(self)
+        self.t0 = time.time()
+        return self
+
+    #----------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_budgets.budgets.remove(self)
+
+        self.elapsed = 1000. * (time.time() - self.t0)
+        self.queries = self.log[self.start:]
+        self.connection.use_debug_cursor = self.use_debug_cursor
+        if not (settings.DEBUG or self.use_debug_cursor):
+            # no one else is logging queries so don't let the log grow
+            del self.log[self.start:]
+
+        if exc_type is None:
+            self.check()
+
+    #----------------------------------------------------------------------
+    def __call__(self, func):
+
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with QueryBudget(self.max_queries, self.max_repeats, self.using):
+                return func(*args, **kwargs)
+        return inner
+
+    #----------------------------------------------------------------------
+    def __len__(self):
+        return len(self.queries)
+
+    #----------------------------------------------------------------------
+    def fingerprints(self):
+        """return Counter of form {fingerprint: number of executions}"""
+        return collections.Counter(fingerprint(q["sql"]) for q in self.queries)
+
+    #----------------------------------------------------------------------
+    def repeated(self, max_repeats=1):
+        """return list of (fingerprint, count) for queries executed more
+        than max_repeats times, most repeated first"""
+
+        return [(fp, n) for fp, n in self.fingerprints().most_common() if n > max_repeats]
+
+    #----------------------------------------------------------------------
+    def violations(self):
+        violations = []
+
+        if self.max_queries is not None and len(self) > self.max_queries:
+            violations.append("%d queries executed (budget %d)" % (len(self), self.max_queries))
+
+        if self.max_repeats is not None:
+            for fp, n in self.repeated(self.max_repeats):
+                violations.append("query repeated %d times (budget %d): %s" % (n, self.max_repeats, fp))
+
+        return violations
+
+    #----------------------------------------------------------------------
+    def report(self):
+        lines = ["%d queries in %.1f ms" % (len(self), self.elapsed)]
+        lines.extend("  %dx %s" % (n, fp) for fp, n in self.repeated())
+        return "\n".join(lines)
+
+    #----------------------------------------------------------------------
+    def check(self):
+        violations = self.violations()
+        if violations:
+            raise QueryBudgetExceeded("\n".join(violations + [self.report()]))
+
+
 #----------------------------------------------------------------------
 def check_query_count():  # pragma: nocover
     """ A useful debugging decorator for checking the number of queries
     a function is making"""
 
-    from django.db import connection
-    import time
-
     def decorator(func):
         if settings.DEBUG:
-            def inner(self, *args, **kwargs):
-                initial_queries = len(connection.queries)
-                t1 = time.time()
-                ret = func(self, *args, **kwargs)
-                t2 = time.time()
-                final_queries = len(connection.queries)
-                print "****QUERIES****", final_queries - initial_queries, "in %.3f ms" % (t2 - t1)
+            @functools.wraps(func)
+            def inner(*args, **kwargs):
+                with QueryBudget() as budget:
+                    ret = func(*args, **kwargs)
+                print "****QUERIES****", budget.report()
                 return ret
             return inner
         return func
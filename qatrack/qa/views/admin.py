@@ -62,9 +62,9 @@ class SetReferencesAndTolerances(FormPreview):
         else:
             form = forms.SetReferencesAndTolerancesForm(request.POST)
             form.full_clean()
-            form.save()
+            summary = form.save()
 
-            messages.success(request, "References & tolerances successfully copied")
+            messages.success(request, "References & tolerances successfully copied to %d tests" % summary.updated)
 
         return HttpResponseRedirect(reverse_lazy('qa_copy_refs_and_tols'))
 
@@ -7,7 +7,7 @@ from django.utils.translation import ugettext as _
 from django.views.generic import ListView, FormView
 from django import forms
 
-from .. import models
+from .. import models, paper
 from qatrack.units.models import Unit
 
 
@@ -101,57 +101,23 @@ class PaperForms(ListView):
     def get_queryset(self):
         """filter queryset based on requested options"""
 
-        qs = super(PaperForms, self).get_queryset().filter(
-            unit__pk__in=self.request.GET.getlist("unit"),
-            frequency__pk__in=self.request.GET.getlist("frequency"),
-            assigned_to__pk__in=self.request.GET.getlist("assigned_to"),
+        return paper.unit_test_collections(
+            self.request.GET.getlist("unit"),
+            self.request.GET.getlist("frequency"),
+            self.request.GET.getlist("assigned_to"),
+            include_inactive=self.request.GET.get("include_inactive", "False") == "True",
         )
 
-        if self.request.GET.get("include_inactive", "False") != "True":
-            qs = qs.filter(active=True)
-
-        return qs.select_related("unit", "testlist").prefetch_related("tests_object")
-
     #---------------------------------------------------------------
     def get_context_data(self, *args, **kwargs):
         """
-        Patch each :model:`qa.UnitTestCollection` object with all
-        its relevant TestList's, Test's & UnitTestInfo's.
+        Add a paper.PaperDocument with all the relevant TestList's &
+        UnitTestInfo's for each unit.
         """
 
         context = super(PaperForms, self).get_context_data(*args, **kwargs)
 
         context["include_refs"] = self.request.GET.get("include_refs", "True") != "False"
-
-        test_lists = {}
-
-        for utc in context["object_list"]:
-            key = (utc.content_type_id, utc.object_id)
-
-            try:
-                # if we've already seen this test list or test list cycle we don't need to
-                # fetch all the test list members & tests again
-                all_lists = test_lists[key]
-            except KeyError:
-                # first time we've seen this test list or test list cycle
-                # find  all member test lists and tests
-                all_lists = utc.tests_object.test_list_members().prefetch_related("testlistmembership_set__test")
-                for li in all_lists:
-                    li.all_tests = li.ordered_tests()
-                test_lists[key] = all_lists
-
-            for li in all_lists:
-                utis = models.UnitTestInfo.objects.filter(
-                    test__in=li.all_tests,
-                    test__type__in=[models.BOOLEAN, models.SIMPLE, models.MULTIPLE_CHOICE, models.STRING],
-                    test__category__pk__in=self.request.GET.getlist("category"),
-                    unit=utc.unit,
-                ).select_related(
-                    "test", "reference", "tolerance"
-                )
-
-                li.utis = list(sorted(utis, key=lambda uti: li.all_tests.index(uti.test)))
-
-            utc.all_lists = all_lists
+        context["documents"] = paper.paper_documents(context["object_list"], self.request.GET.getlist("category"))
 
         return context
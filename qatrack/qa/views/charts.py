@@ -9,14 +9,11 @@ from django.http import HttpResponse
 from django.template import Context
 from django.template.loader import get_template
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views.generic import TemplateView, View
 
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-import numpy
-
 from .. import models
-from qatrack.qa.control_chart import control_chart
+from qatrack.qa.data_versions import conditional
 from qatrack.units.models import Unit
 from qatrack.qa.utils import SetEncoder
 from braces.views import JSONResponseMixin, PermissionRequiredMixin
@@ -150,6 +147,21 @@ class ChartView(PermissionRequiredMixin, TemplateView):
         )
 
 
+#----------------------------------------------------------------------
+def chart_filters(request):
+    """return pks of units charted (see qatrack.qa.data_versions)"""
+    return request.GET.getlist("units[]") or None
+
+
+#----------------------------------------------------------------------
+def chart_since(request):
+    """default date ranges are relative to now so charts without explicit
+    dates are also considered modified daily"""
+
+    if not (request.GET.get("from_date") and request.GET.get("to_date")):
+        return timezone.localtime(timezone.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
 #============================================================================
 class BaseChartView(View):
     """
@@ -158,6 +170,7 @@ class BaseChartView(View):
     """
 
     #----------------------------------------------------------------------
+    @method_decorator(conditional(chart_filters, chart_since))
     def get(self, request):
 
         self.get_plot_data()
@@ -394,6 +407,12 @@ class ControlChartImage(PermissionRequiredMixin, BaseChartView):
     def render_to_response(self, context):
         """Create a png image and write the control chart image to it"""
 
+        # imported here so that loading urls doesn't import matplotlib (see qa.scientific)
+        from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+        from matplotlib.figure import Figure
+        import numpy
+        from qatrack.qa.control_chart import control_chart
+
         fig = Figure(dpi=72, facecolor="white")
         dpi = fig.get_dpi()
         fig.set_size_inches(
@@ -30,11 +30,23 @@ class UserFormsetMixin(object):
     def _construct_forms(self):
         """add user to all children"""
         self.forms = []
+        can_skip_without_comment = self.user.has_perm("qa.can_skip_without_comment")
         for i in xrange(self.total_form_count()):
             f = self._construct_form(i)
             f.user = self.user
+            f.can_skip_without_comment = can_skip_without_comment
             self.forms.append(f)
 
+    #----------------------------------------------------------------------
+    @property
+    def management_form(self):
+        """Django rebuilds (and for bound formsets cleans) the management
+        form every time it is accessed which happens once per child form"""
+
+        if not hasattr(self, "_cached_management_form"):
+            self._cached_management_form = super(UserFormsetMixin, self).management_form
+        return self._cached_management_form
+
 
 #============================================================================
 class TestInstanceWidgetsMixin(object):
@@ -63,7 +75,7 @@ class TestInstanceWidgetsMixin(object):
             elif (value is not None or string_value) and skipped:
                 self._errors["value"] = self.error_class(["Clear value if skipping"])
 
-            if not self.user.has_perm("qa.can_skip_without_comment") and skipped and not comment:
+            if not self.can_skip_without_comment and skipped and not comment:
                 self._errors["skipped"] = self.error_class(["Please add comment when skipping"])
                 del cleaned_data["skipped"]
 
@@ -77,31 +89,42 @@ class TestInstanceWidgetsMixin(object):
         return cleaned_data
 
     #---------------------------------------------------------------------------
-    def set_value_widget(self):
-        """add custom widget for boolean values (after form has been initialized)"""
+    def set_value_widget(self, widget_prototypes=None):
+        """add custom widget for boolean, multiple choice & upload tests (after
+        form has been initialized).  Widgets are only read when rendering so
+        the forms of a formset share one widget per test type (per test for
+        multiple choice tests) via the widget_prototypes dict"""
+
+        if widget_prototypes is None:
+            widget_prototypes = {}
 
-        # temp store attributes so they can be restored to reset widget
         self.fields["string_value"].widget.attrs["class"] = "qa-input"
         self.fields["value"].widget.attrs["class"] = "qa-input"
         attrs = self.fields["value"].widget.attrs
         str_attrs = self.fields["string_value"].widget.attrs
 
-        test_type = self.unit_test_info.test.type
-
-        if test_type == models.BOOLEAN:
-            self.fields["value"].widget = RadioSelect(choices=BOOL_CHOICES)
-        elif test_type == models.MULTIPLE_CHOICE:
-            self.fields["value"].widget = Select(choices=[("", "")] + self.unit_test_info.test.get_choices())
-        elif test_type == models.UPLOAD:
-            self.fields["string_value"].widget = HiddenInput()
-
-        if test_type in (models.BOOLEAN, models.MULTIPLE_CHOICE):
+        test = self.unit_test_info.test
+
+        if test.type == models.BOOLEAN:
+            key = (models.BOOLEAN,)
+            if key not in widget_prototypes:
+                widget_prototypes[key] = RadioSelect(attrs=attrs, choices=BOOL_CHOICES)
+            self.fields["value"].widget = widget_prototypes[key]
+        elif test.type == models.MULTIPLE_CHOICE:
+            key = (models.MULTIPLE_CHOICE, test.pk)
+            if key not in widget_prototypes:
+                widget_prototypes[key] = Select(attrs=attrs, choices=[("", "")] + test.get_choices())
+            self.fields["value"].widget = widget_prototypes[key]
+        elif test.type == models.UPLOAD:
+            key = (models.UPLOAD,)
+            if key not in widget_prototypes:
+                widget_prototypes[key] = HiddenInput(attrs=str_attrs)
+            self.fields["string_value"].widget = widget_prototypes[key]
+
+        if test.type in (models.BOOLEAN, models.MULTIPLE_CHOICE):
             if hasattr(self, "instance") and self.instance.value is not None:
                 self.initial["value"] = int(self.instance.value)
 
-        self.fields["value"].widget.attrs.update(attrs)
-        self.fields["string_value"].widget.attrs.update(str_attrs)
-
     #----------------------------------------------------------------------
     def disable_read_only_fields(self):
         """disable some fields for constant and composite tests"""
@@ -127,9 +150,9 @@ class CreateTestInstanceForm(TestInstanceWidgetsMixin, forms.Form):
         self.fields["comment"].widget.attrs["rows"] = 2
 
     #----------------------------------------------------------------------
-    def set_unit_test_info(self, unit_test_info):
+    def set_unit_test_info(self, unit_test_info, widget_prototypes=None):
         self.unit_test_info = unit_test_info
-        self.set_value_widget()
+        self.set_value_widget(widget_prototypes)
         self.disable_read_only_fields()
 
     #----------------------------------------------------------------------
@@ -175,8 +198,9 @@ class CreateTestInstanceFormSet(UserFormsetMixin, BaseTestInstanceFormSet):
 
         super(CreateTestInstanceFormSet, self).__init__(*args, **kwargs)
 
+        widget_prototypes = {}
         for form, uti in zip(self.forms, unit_test_infos):
-            form.set_unit_test_info(uti)
+            form.set_unit_test_info(uti, widget_prototypes)
 
 
 #============================================================================
@@ -190,10 +214,11 @@ class UpdateTestInstanceForm(TestInstanceWidgetsMixin, forms.ModelForm):
     #----------------------------------------------------------------------
     def __init__(self, *args, **kwargs):
 
+        widget_prototypes = kwargs.pop("widget_prototypes", None)
         super(UpdateTestInstanceForm, self).__init__(*args, **kwargs)
         self.fields["value"].required = False
         self.unit_test_info = self.instance.unit_test_info
-        self.set_value_widget()
+        self.set_value_widget(widget_prototypes)
         self.disable_read_only_fields()
 
     #----------------------------------------------------------------------
@@ -211,7 +236,14 @@ BaseUpdateTestInstanceFormSet = inlineformset_factory(models.TestListInstance, m
 
 
 class UpdateTestInstanceFormSet(UserFormsetMixin, BaseUpdateTestInstanceFormSet):
-    pass
+
+    #----------------------------------------------------------------------
+    def _construct_form(self, i, **kwargs):
+        """share value widgets between forms (see set_value_widget)"""
+        if not hasattr(self, "widget_prototypes"):
+            self.widget_prototypes = {}
+        kwargs["widget_prototypes"] = self.widget_prototypes
+        return super(UpdateTestInstanceFormSet, self)._construct_form(i, **kwargs)
 
 
 #============================================================================
@@ -391,4 +423,4 @@ class SetReferencesAndTolerancesForm(forms.Form):
             )
         except models.UnitTestCollection.DoesNotExist:
             raise ValidationError(_('Invalid value'), code='invalid')
-        source_utc.copy_references(dest_unit)
+        return source_utc.copy_references(dest_unit)
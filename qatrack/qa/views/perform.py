@@ -1,14 +1,10 @@
 import collections
 import json
-import math
 import os
-import shutil
 import imghdr
 
 
 import dateutil
-import numpy
-import scipy
 from django.conf import settings
 from django.contrib import messages
 from django.core.urlresolvers import reverse
@@ -21,19 +17,13 @@ from django.utils import timezone
 from django.utils.translation import ugettext as _
 
 from . import forms
-from .. import models, utils, signals
+from .. import data_versions, models, plans, scientific, thumbnails, uploads, utils, signals
 from .base import BaseEditTestListInstance, TestListInstances, UTCList, logger
 from qatrack.contacts.models import Contact
 from qatrack.units.models import Unit
 
 from braces.views import JSONResponseMixin, PermissionRequiredMixin
 
-DEFAULT_CALCULATION_CONTEXT = {
-    "math": math,
-    "scipy": scipy,
-    "numpy": numpy,
-}
-
 
 #---------------------------------------------------------------------------
 def process_procedure(procedure):
@@ -51,7 +41,7 @@ def process_procedure(procedure):
 def process_file_upload_form(ti_form, test_list_instance):
     """
     Check if test instance form is file upload and move the file out of
-    tmp directory if it is
+    tmp directory and into the blob store (see uploads) if it is
     """
 
     upload_to_process = (
@@ -64,11 +54,17 @@ def process_file_upload_form(ti_form, test_list_instance):
     if upload_to_process:
         fname = ti_form.cleaned_data["string_value"]
         src = os.path.join(settings.TMP_UPLOAD_ROOT, fname)
-        d = os.path.join(settings.UPLOAD_ROOT, "%s" % test_list_instance.pk)
-        if not os.path.exists(d):
-            os.mkdir(d)
-        dest = os.path.join(settings.UPLOAD_ROOT, d, fname)
-        shutil.move(src, dest)
+        if uploads.is_reference(fname) or not os.path.isfile(src):
+            # already stored (e.g. editing a completed test list)
+            return
+
+        reference = uploads.store_blob(src, fname)
+        ti_form.cleaned_data["string_value"] = reference
+        if hasattr(ti_form, "instance"):
+            ti_form.instance.string_value = reference
+
+        if ti_form.unit_test_info.test.display_image and thumbnails.can_thumbnail(reference):
+            thumbnails.schedule(reference)
 
 
 #============================================================================
@@ -88,6 +84,7 @@ class Upload(JSONResponseMixin, View):
 
         results = {
             'temp_file_name': self.file_name,
+            'sha256': self.upload.sha256,
             'is_image': self.is_image(),
             'success': False,
             'errors': [],
@@ -106,7 +103,11 @@ class Upload(JSONResponseMixin, View):
         except Exception, e:
             results["errors"].append("Invalid Test Procedure: %s" % e)
 
-        return self.render_json_response(results)
+        try:
+            # result may still refer to FILE/BUFFER
+            return self.render_json_response(results)
+        finally:
+            self.upload.close()
 
     #---------------------------------------------------------------
     @staticmethod
@@ -128,7 +129,7 @@ class Upload(JSONResponseMixin, View):
 
     #----------------------------------------------------------------------
     def handle_upload(self):
-        """read incoming file and save tmp file to disk ready for processing"""
+        """stream incoming file to a tmp file on disk ready for processing"""
 
         self.file_name = self.get_upload_name(
             self.request.COOKIES.get('sessionid'),
@@ -136,13 +137,7 @@ class Upload(JSONResponseMixin, View):
             self.request.FILES.get("upload").name,
         )
 
-        self.upload = open(os.path.join(settings.TMP_UPLOAD_ROOT, self.file_name), "w+b")
-
-        for chunk in self.request.FILES.get("upload").chunks():
-            self.upload.write(chunk)
-
-        # rewind to beginning of file so it  can be read correctly by calc procedure
-        self.upload.seek(0)
+        self.upload = uploads.save_upload(self.request.FILES.get("upload"), self.file_name)
 
     #----------------------------------------------------------------------
     def set_calculation_context(self):
@@ -161,12 +156,13 @@ class Upload(JSONResponseMixin, View):
         tols = self.get_json_data("tols")
 
         self.calculation_context = {
-            "FILE": self.upload,
+            "FILE": self.upload.file,
+            "BUFFER": self.upload.buffer,
             "META": meta_data,
             "REFS": refs,
             "TOLS": tols,
         }
-        self.calculation_context.update(DEFAULT_CALCULATION_CONTEXT)
+        self.calculation_context.update(scientific.calculation_context())
 
     #----------------------------------------------------------------------
     def get_json_data(self, name):
@@ -185,7 +181,7 @@ class Upload(JSONResponseMixin, View):
     def is_image(self):
         """check if the uploaded file is an image"""
 
-        if imghdr.what(self.upload.name):
+        if imghdr.what(self.upload.path):
             return True
         else:
             return False
@@ -289,7 +285,7 @@ class CompositeCalculation(JSONResponseMixin, View):
             "TOLS": tols,
         }
 
-        self.calculation_context.update(DEFAULT_CALCULATION_CONTEXT)
+        self.calculation_context.update(scientific.calculation_context())
 
         for slug, val in values.iteritems():
             if slug not in self.composite_tests:
@@ -405,17 +401,6 @@ class PerformQA(PermissionRequiredMixin, CreateView):
         if self.test_list is None:
             raise Http404
 
-        self.all_lists = [self.test_list] + list(self.test_list.sublists.all())
-
-    #----------------------------------------------------------------------
-    def set_all_tests(self):
-        """Find all tests to be performed, including tests from sublists"""
-
-        self.all_tests = []
-        for test_list in self.all_lists:
-            tests = test_list.tests.all().order_by("testlistmembership__order")
-            self.all_tests.extend(tests)
-
     #----------------------------------------------------------------------
     def set_unit_test_collection(self):
         """Set the requested :model:`qa.UnitTestCollection` to be performed."""
@@ -442,57 +427,33 @@ class PerformQA(PermissionRequiredMixin, CreateView):
     #---------------------------------------------------------------
     def template_unit_test_infos(self):
         """Convert :model:`qa.UnitTestInfo` into dicts for rendering in template"""
-
-        template_utis = []
-        for uti in self.unit_test_infos:
-            template_utis.append({
-                "id": uti.pk,
-                "test": model_to_dict(uti.test),
-                "reference": model_to_dict(uti.reference) if uti.reference else None,
-                "tolerance": model_to_dict(uti.tolerance) if uti.tolerance else None,
-            })
-
-        return template_utis
+        return self.plan.template_unit_test_infos()
 
     #----------------------------------------------------------------------
-    def set_unit_test_infos(self):
-        """Find and order all :model:`qa.UniTestInfo` objects for tests to be performed"""
+    def set_execution_plan(self):
+        """Find all tests to be performed (including tests from sublists)
+        and their :model:`qa.UnitTestInfo` objects in order"""
 
-        utis = models.UnitTestInfo.objects.filter(
-            unit=self.unit_test_col.unit,
-            test__in=self.all_tests,
-            active=True,
-        ).select_related(
-            "reference",
-            "test__category",
-            "test__pk",
-            "tolerance",
-            "unit",
-        )
+        self.plan = plans.ExecutionPlan(self.unit_test_col.unit, self.test_list)
+        self.all_tests = self.plan.tests
+        self.unit_test_infos = self.plan.unit_test_infos
 
-        # make sure utis are correctly ordered
-        uti_tests = [x.test for x in utis]
-        self.unit_test_infos = []
-        for test in self.all_tests:
-            try:
-                self.unit_test_infos.append(utis[uti_tests.index(test)])
-            except ValueError:
-                # if this happens it usually indicates a bug somewhere. Please report.
-                msg = "Do not treat! Please call physics.  Test '%s' is missing information for this unit " % test.name
-                logger.error(msg + " Test=%d" % test.pk)
-                messages.error(self.request, _(msg))
+        for test in self.plan.missing:
+            # if this happens it usually indicates a bug somewhere. Please report.
+            msg = "Do not treat! Please call physics.  Test '%s' is missing information for this unit " % test.name
+            logger.error(msg + " Test=%d" % test.pk)
+            messages.error(self.request, _(msg))
 
     #----------------------------------------------------------------------
     def add_histories(self, forms):
         """paste historical values onto unit test infos (ugly)"""
 
-        history, history_dates = self.unit_test_col.history()
+        history, history_dates = self.unit_test_col.history(tests=self.all_tests)
         self.history_dates = history_dates
+        history = dict((test.pk, hist) for test, hist in history)
         for form in forms:
-            for test, hist in history:
-                if test == form.unit_test_info.test:
-                    form.history = hist
-                    break
+            if form.unit_test_info.test_id in history:
+                form.history = history[form.unit_test_info.test_id]
 
     #---------------------------------------------------------------------------
     def get_test_status(self, form):
@@ -507,6 +468,7 @@ class PerformQA(PermissionRequiredMixin, CreateView):
             return models.TestInstanceStatus.objects.default()
 
     #----------------------------------------------------------------------
+    @signals.coalesced_last_instance_updates
     def form_valid(self, form):
         """
         TestListInstance form has validated, now check for validity of
@@ -576,11 +538,15 @@ class PerformQA(PermissionRequiredMixin, CreateView):
             to_save.append(ti)
 
         models.TestInstance.objects.bulk_create(to_save)
+        data_versions.touch_instances(to_save)
 
-        #set due date to account for any non default statuses
-        self.object.unit_test_collection.set_due_date()
-
-        self.object.update_all_reviewed()
+        # statuses of the new test instances are already known so there is no need
+        # to requery them (via update_all_reviewed) to determine review state
+        all_reviewed = not any(ti.status.requires_review for ti in to_save)
+        if all_reviewed != self.object.all_reviewed:
+            self.object.all_reviewed = all_reviewed
+            models.TestListInstance.objects.filter(pk=self.object.pk).update(all_reviewed=all_reviewed)
+            self.object.update_unreviewed_counts()
 
         if not self.object.in_progress:
             # TestListInstance & TestInstances have been successfully create, fire signal
@@ -610,8 +576,7 @@ class PerformQA(PermissionRequiredMixin, CreateView):
         self.set_unit_test_collection()
         self.set_test_lists()
         self.set_last_day()
-        self.set_all_tests()
-        self.set_unit_test_infos()
+        self.set_execution_plan()
 
         if self.request.method == "POST":
             formset = forms.CreateTestInstanceFormSet(self.request.POST, self.request.FILES, unit_test_infos=self.unit_test_infos, user=self.request.user)
@@ -622,7 +587,7 @@ class PerformQA(PermissionRequiredMixin, CreateView):
 
         context["formset"] = formset
         context["history_dates"] = self.history_dates
-        context['categories'] = set([x.test.category for x in self.unit_test_infos])
+        context['categories'] = self.plan.categories
         context['current_day'] = self.actual_day + 1
         context["last_instance"] = self.unit_test_col.last_instance
         context['last_day'] = self.last_day
@@ -681,6 +646,7 @@ class EditTestListInstance(PermissionRequiredMixin, BaseEditTestListInstance):
     formset_class = forms.UpdateTestInstanceFormSet
 
     #----------------------------------------------------------------------
+    @signals.coalesced_last_instance_updates
     def form_valid(self, form):
         context = self.get_context_data()
         formset = context["formset"]
@@ -705,8 +671,6 @@ class EditTestListInstance(PermissionRequiredMixin, BaseEditTestListInstance):
                 ti = ti_form.save(commit=False)
                 self.update_test_instance(ti)
 
-            self.object.unit_test_collection.set_due_date()
-
             if not self.object.in_progress:
                 signals.testlist_complete.send(sender=self, instance=self.object, created=False)
 
@@ -2,13 +2,17 @@ import calendar
 import collections
 
 from django.contrib import messages
+from django.core.urlresolvers import reverse
 from django.db.models import Q
 from django.http import HttpResponseRedirect, Http404
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.http import is_safe_url
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
-from django.views.generic import ListView, TemplateView, DetailView
+from django.views.generic import ListView, TemplateView, DetailView, View
 
-from .. import models
+from .. import data_versions, models, signals
 from . import forms
 from .base import TestListInstanceMixin, BaseEditTestListInstance, TestListInstances, UTCList
 from .perform import ChooseUnit
@@ -43,6 +47,7 @@ class ReviewTestListInstance(PermissionRequiredMixin, BaseEditTestListInstance):
         kwargs['user'] = self.request.user
         return kwargs
 
+    @signals.coalesced_last_instance_updates
     def form_valid(self, form):
         """
         Update users, times & statuses for the :model:`qa.TestListInstance`
@@ -82,13 +87,12 @@ class ReviewTestListInstance(PermissionRequiredMixin, BaseEditTestListInstance):
             if status.requires_review:
                 still_requires_review = True
             models.TestInstance.objects.filter(pk__in=test_instance_pks).update(status=status)
+        data_versions.touch_instances(ti_form.instance for ti_form in formset)
 
         if still_requires_review:
             test_list_instance.all_reviewed = False
             test_list_instance.save()
 
-        test_list_instance.unit_test_collection.set_due_date()
-
         # let user know request succeeded and return to unit list
         messages.success(self.request, _("Successfully updated %s " % self.object.test_list.name))
         return HttpResponseRedirect(self.get_success_url())
@@ -157,6 +161,19 @@ class ChooseUnitForReview(ChooseUnit):
     active_only = False
     template_name = "units/unittype_choose_for_review.html"
 
+    #----------------------------------------------------------------------
+    def get_context_data(self, *args, **kwargs):
+        """add cached unreviewed count for each unit"""
+
+        context = super(ChooseUnitForReview, self).get_context_data(*args, **kwargs)
+
+        units = [u for unit_type, units in context["unit_types"] for u in units]
+        counts = models.unreviewed_counter.get_many("unit", [u["unit"] for u in units])
+        for u in units:
+            u["unreviewed"] = counts[u["unit"]]
+
+        return context
+
 
 #====================================================================================
 class ChooseFrequencyForReview(ListView):
@@ -179,6 +196,103 @@ class Unreviewed(PermissionRequiredMixin, TestListInstances):
     def get_page_title(self):
         return "Unreviewed Test Lists"
 
+    #----------------------------------------------------------------------
+    def get_template_context_data(self, context):
+        """add cached unreviewed counts for the groups the user belongs to"""
+
+        context = super(Unreviewed, self).get_template_context_data(context)
+
+        groups = list(self.request.user.groups.order_by("name"))
+        counts = models.unreviewed_counter.get_many("group", [g.pk for g in groups])
+        context["unreviewed_by_group"] = [(g, counts[g.pk]) for g in groups]
+        if self.request.user.has_perm("qa.can_review"):
+            context["bulk_review_statuses"] = models.TestInstanceStatus.objects.all()
+
+        return context
+
+    #----------------------------------------------------------------------
+    def get_actions(self, tli):
+        """add a checkbox for selecting instances to bulk review"""
+        actions = super(Unreviewed, self).get_actions(tli)
+        if not self.request.user.has_perm("qa.can_review"):
+            return actions
+        checkbox = '<input type="checkbox" class="bulk-review" title="Select for bulk review" value="%d"/> ' % tli.pk
+        return mark_safe(checkbox + actions)
+
+
+#============================================================================
+class BulkReviewTestListInstances(PermissionRequiredMixin, View):
+    """
+    Apply a single :model:`qa.TestInstanceStatus` to all the
+    :model:`qa.TestInstance`s of many :model:`qa.TestListInstance`s at once
+    using a constant number of queries.
+    """
+
+    permission_required = "qa.can_review"
+    raise_exception = True
+
+    #----------------------------------------------------------------------
+    def post(self, request, *args, **kwargs):
+
+        status = get_object_or_404(models.TestInstanceStatus, pk=request.POST.get("status"))
+
+        try:
+            pks = set(int(pk) for pk in request.POST.getlist("tli"))
+        except ValueError:
+            raise Http404
+
+        test_list_instances = models.TestListInstance.objects.filter(
+            pk__in=pks,
+            in_progress=False,
+        ).select_related("unit_test_collection")
+
+        skipped_own = 0
+        if not request.user.has_perm("qa.can_review_own_tests"):
+            skipped_own = test_list_instances.filter(created_by=request.user).count()
+            test_list_instances = test_list_instances.exclude(created_by=request.user)
+
+        test_list_instances = list(test_list_instances)
+        if test_list_instances:
+            self.review(test_list_instances, status)
+            messages.success(request, _("Successfully reviewed %d test lists" % len(test_list_instances)))
+
+        if skipped_own:
+            messages.warning(request, _("%d test lists were not reviewed since you do not have the required permission to review your own tests." % skipped_own))
+
+        next_url = request.GET.get("next")
+        if not is_safe_url(next_url, host=request.get_host()):
+            next_url = reverse("unreviewed")
+
+        return HttpResponseRedirect(next_url)
+
+    #----------------------------------------------------------------------
+    def review(self, test_list_instances, status):
+        """set status of all test instances, update review info and then
+        do last instance/due date & unreviewed count bookkeeping in bulk"""
+
+        review_time = timezone.now()
+        pks = [tli.pk for tli in test_list_instances]
+
+        models.TestInstance.objects.filter(test_list_instance__in=pks).update(status=status)
+        data_versions.touch_test_list_instances(pks)
+
+        all_reviewed = not status.requires_review
+        models.TestListInstance.objects.filter(pk__in=pks).update(
+            reviewed=review_time,
+            reviewed_by=self.request.user,
+            all_reviewed=all_reviewed,
+        )
+
+        for tli in test_list_instances:
+            tli.all_reviewed = all_reviewed
+            tli.update_unreviewed_counts()
+
+        # validity of statuses may have changed so due dates need updating
+        signals.update_last_instances_bulk(
+            (tli.unit_test_collection_id, tli.unit_test_collection.unit_id, tli.test_list_id)
+            for tli in test_list_instances
+        )
+
 
 #============================================================================
 class DueDateOverview(PermissionRequiredMixin, TemplateView):
@@ -143,6 +143,7 @@ if not os.path.isfile(SITE_SPECIFIC_CSS_PATH):
 #------------------------------------------------------------------------------
 # Middleware
 MIDDLEWARE_CLASSES = (
+    'qatrack.middleware.instrumentation.InstrumentationMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -167,11 +168,10 @@ LOGIN_URL = "/accounts/login/"
 #------------------------------------------------------------------------------
 # Template settings
 # List of callables that know how to import templates from various sources.
+# (wrapped in the cached loader below when DEBUG is False)
 TEMPLATE_LOADERS = (
-    #('django.template.loaders.cached.Loader', (
     'django.template.loaders.filesystem.Loader',
     'django.template.loaders.app_directories.Loader',
-    #)),
     #     'django.template.loaders.eggs.Loader',
 )
 
@@ -231,20 +231,58 @@ INSTALLED_APPS = [
 
 CACHE_UNREVIEWED_COUNT = 'unreviewed-count'
 CACHE_QA_FREQUENCIES = 'qa-frequencies'
+CACHE_NOTIFICATION_RECIPIENTS = 'notification-recipients'
+CACHE_TEST_LIST_STRUCTURE = 'test-list-structure'
 MAX_CACHE_TIMEOUT = 24 * 60 * 60  # 24hours
 
 CACHE_LOCATION = os.path.join(PROJECT_ROOT, "cache", "cache_data")
 if not os.path.isdir(CACHE_LOCATION):
     os.mkdir(CACHE_LOCATION)
 
+# The default cache is a short lived in-process memory tier in front of a
+# shared cache (see qatrack/cache/backends.py). For deployments with multiple
+# processes/servers, the shared tier should be replaced with memcached e.g.
+#    'shared': {
+#        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#        'LOCATION': '127.0.0.1:11211',
+#        'TIMEOUT': MAX_CACHE_TIMEOUT,
+#    }
 CACHES = {
     'default': {
+        'BACKEND': 'qatrack.cache.backends.TieredCache',
+        'TIMEOUT': MAX_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_TIMEOUT': 5,
+        },
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': CACHE_LOCATION,
         'TIMEOUT': MAX_CACHE_TIMEOUT,
-    }
+    },
 }
 
+#-----------------------------------------------------------------------------
+# Instrumentation settings (see qatrack/middleware/instrumentation.py)
+
+# number of most recent view and query samples kept in memory per process
+INSTRUMENTATION_BUFFER_SIZE = 1000
+INSTRUMENTATION_QUERY_BUFFER_SIZE = 5000
+
+# set a host (e.g. "127.0.0.1") to send view timings to a statsd server
+INSTRUMENTATION_STATSD_HOST = None
+INSTRUMENTATION_STATSD_PORT = 8125
+INSTRUMENTATION_STATSD_PREFIX = "qatrack"
+
+# Sampling profiler (requires 'qatrack.middleware.profiler.ProfileMiddleware'
+# to be added to MIDDLEWARE_CLASSES after the authentication middleware).
+# Set a fraction of requests (e.g. 0.05) and/or url names (e.g. ("perform_qa", "charts"))
+# to sample. Samples can be downloaded by staff users from /profile/samples/
+PROFILE_SAMPLE_RATE = 0
+PROFILE_SAMPLE_URL_NAMES = ()
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds
+
 #-----------------------------------------------------------------------------
 # Session Settings
 SESSION_COOKIE_AGE = 14 * 24 * 60 * 60
@@ -259,6 +297,21 @@ EMAIL_NOTIFICATION_SENDER = "qatrack"
 #EMAIL_NOTIFICATION_SUBJECT = "QATrack+ Test Status Notification"
 EMAIL_NOTIFICATION_SUBJECT_TEMPLATE = "notification_email_subject.txt"
 
+# set to True to queue notifications in the database rather than sending them
+# during the request. Queued notifications are delivered by running
+# `python manage.py send_notifications --loop` (or periodically without --loop)
+EMAIL_NOTIFICATION_QUEUE = False
+EMAIL_NOTIFICATION_MAX_ATTEMPTS = 5
+EMAIL_NOTIFICATION_RETRY_DELAY = 60  # seconds, doubled after every failed attempt
+
+# set to a number of seconds (e.g. 4*60*60) to send each recipient a single digest
+# of all tolerance/action results completed within that window rather than one
+# email per test list. Digests are sent by running
+# `python manage.py send_notification_digest` periodically (e.g. from cron)
+EMAIL_NOTIFICATION_DIGEST_WINDOW = None
+EMAIL_NOTIFICATION_DIGEST_TEMPLATE = "notification_digest_email.txt"
+EMAIL_NOTIFICATION_DIGEST_SUBJECT_TEMPLATE = "notification_digest_subject.txt"
+
 EMAIL_FAIL_SILENTLY = True
 EMAIL_HOST = ""  # e.g. 'smtp.gmail.com'
 EMAIL_HOST_USER = ''  # e.g. "randle.taylor@gmail.com"
@@ -360,6 +413,11 @@ PAGINATE_DEFAULT = 50  # remember to change iDisplayLength in unittestcollection
 
 NHIST = 5  # number of historical test results to show when reviewing/performing qa
 
+# numpy, scipy & matplotlib are imported when first needed by calculation
+# procedures & control charts.  Set to True to import them when a WSGI
+# process starts instead (e.g. in processes dedicated to performing QA).
+PRELOAD_SCIENTIFIC_MODULES = False
+
 ICON_SETTINGS = {
     'SHOW_STATUS_ICONS_PERFORM':  True,
     'SHOW_STATUS_ICONS_LISTING':  True,
@@ -385,3 +443,12 @@ try:
     from local_settings import *  # NOQA
 except ImportError:
     pass
+
+# Compiled templates are cached for the life of the process (templates
+# like qa/history.html are rendered once per row of large tables) unless
+# DEBUG is on, so that template changes don't require a restart.  Done
+# after local_settings so that its DEBUG & TEMPLATE_LOADERS are used.
+if not DEBUG and not any(isinstance(loader, (list, tuple)) for loader in TEMPLATE_LOADERS):
+    TEMPLATE_LOADERS = (
+        ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+    )
@@ -12,6 +12,9 @@ urlpatterns = patterns('',
     url(r'^accounts/', include('qatrack.accounts.urls')),
     url(r'^qa/', include('qatrack.qa.urls')),
 
+    url(r'^instrumentation/$', 'qatrack.middleware.instrumentation.summary_view', name="instrumentation"),
+    url(r'^profile/samples/$', 'qatrack.middleware.profiler.sampled_profile', name="sampled_profile"),
+
     # Uncomment the next line to enable the admin:
     url(r'^admin/', include(admin.site.urls)),
 
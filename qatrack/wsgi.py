@@ -23,6 +23,11 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "qatrack.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+from django.conf import settings
+if getattr(settings, "PRELOAD_SCIENTIFIC_MODULES", False):
+    from qatrack.qa import scientific
+    scientific.preload()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)